@@ -0,0 +1,114 @@
+"""Per-user listening aggregates for the heatmap and calendar endpoints.
+
+``user_daily_plays`` (one row per user per UTC day) and ``user_hourly_plays``
+(at most 7 x 24 rows per user) are bumped by an upsert on every play, so a
+year's calendar reads at most 366 rows and the heatmap 168, however long the
+history is.
+
+    python aggregates.py rebuild [user_id]
+"""
+from datetime import date, datetime
+import sys
+
+from sqlalchemy import select, func, delete, extract, cast, Date, Integer
+from sqlalchemy.orm import Session
+
+from database import insert
+from models import Play, UserDailyPlays, UserHourlyPlays
+
+def record_play(db: Session, user_id: int, played_at: datetime, duration: int | None) -> None:
+    """Count a play in the user's daily and hourly aggregates. Caller commits."""
+    record_plays(db, [(user_id, played_at, duration)])
+
+def record_plays(db: Session, plays: list[tuple[int, datetime, int | None]]) -> None:
+    """Count (user_id, played_at, duration) plays, one upsert per table for the whole batch. Caller commits."""
+    daily: dict[tuple[int, date], list[int]] = {}
+    hourly: dict[tuple[int, int, int], int] = {}
+    for user_id, played_at, duration in plays:
+        totals = daily.setdefault((user_id, played_at.date()), [0, 0])
+        totals[0] += 1
+        totals[1] += duration or 0
+        key = (user_id, played_at.weekday(), played_at.hour)
+        hourly[key] = hourly.get(key, 0) + 1
+
+    daily_insert = insert(UserDailyPlays)
+    db.execute(daily_insert.on_conflict_do_update(
+        index_elements=["user_id", "day"],
+        set_={
+            'play_count': UserDailyPlays.play_count + daily_insert.excluded.play_count,
+            'total_seconds': UserDailyPlays.total_seconds + daily_insert.excluded.total_seconds
+        }
+    ), [
+        {'user_id': user_id, 'day': day, 'play_count': count, 'total_seconds': seconds}
+        for (user_id, day), (count, seconds) in sorted(daily.items())
+    ])
+    hourly_insert = insert(UserHourlyPlays)
+    db.execute(hourly_insert.on_conflict_do_update(
+        index_elements=["user_id", "weekday", "hour"],
+        set_={'play_count': UserHourlyPlays.play_count + hourly_insert.excluded.play_count}
+    ), [
+        {'user_id': user_id, 'weekday': weekday, 'hour': hour, 'play_count': count}
+        for (user_id, weekday, hour), count in sorted(hourly.items())
+    ])
+
+def heatmap(db: Session, user_id: int) -> list[list[int]]:
+    """Plays as 7 rows (Monday first) of 24 hourly cells, UTC."""
+    cells = [[0] * 24 for _ in range(7)]
+    rows = db.execute(
+        select(UserHourlyPlays.weekday, UserHourlyPlays.hour, UserHourlyPlays.play_count)
+        .where(UserHourlyPlays.user_id == user_id)
+    )
+    for weekday, hour, count in rows:
+        cells[weekday][hour] = count
+    return cells
+
+def calendar(db: Session, user_id: int, year: int) -> tuple[list[int], list[int]]:
+    """Daily play counts and listening seconds for every day of a year, January 1st first."""
+    start, end = date(year, 1, 1), date(year + 1, 1, 1)
+    days = (end - start).days
+    counts, seconds = [0] * days, [0] * days
+    rows = db.execute(
+        select(UserDailyPlays.day, UserDailyPlays.play_count, UserDailyPlays.total_seconds)
+        .where(UserDailyPlays.user_id == user_id, UserDailyPlays.day >= start, UserDailyPlays.day < end)
+    )
+    for day, count, total in rows:
+        counts[(day - start).days] = count
+        seconds[(day - start).days] = total
+    return counts, seconds
+
+def rebuild(db: Session, user_id: int | None = None) -> None:
+    """Recompute the aggregates from plays."""
+    if db.get_bind().dialect.name == "sqlite":
+        day = func.date(Play.created_at)
+        weekday = (cast(func.strftime("%w", Play.created_at), Integer) + 6) % 7  # %w counts from Sunday
+        hour = cast(func.strftime("%H", Play.created_at), Integer)
+    else:
+        day = cast(Play.created_at, Date)
+        weekday = cast(extract("isodow", Play.created_at), Integer) - 1
+        hour = cast(extract("hour", Play.created_at), Integer)
+    daily = select(Play.user_id, day, func.count(), func.coalesce(func.sum(Play.duration), 0)).group_by(Play.user_id, day)
+    hourly = select(Play.user_id, weekday, hour, func.count()).group_by(Play.user_id, weekday, hour)
+    clear_daily, clear_hourly = delete(UserDailyPlays), delete(UserHourlyPlays)
+    if user_id is not None:
+        daily, hourly = daily.where(Play.user_id == user_id), hourly.where(Play.user_id == user_id)
+        clear_daily = clear_daily.where(UserDailyPlays.user_id == user_id)
+        clear_hourly = clear_hourly.where(UserHourlyPlays.user_id == user_id)
+
+    db.execute(clear_daily)
+    db.execute(clear_hourly)
+    db.execute(insert(UserDailyPlays).from_select(["user_id", "day", "play_count", "total_seconds"], daily))
+    db.execute(insert(UserHourlyPlays).from_select(["user_id", "weekday", "hour", "play_count"], hourly))
+    db.commit()
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    if sys.argv[1:2] != ["rebuild"]:
+        print("Usage: python aggregates.py rebuild [user_id]")
+        sys.exit(1)
+    db = SessionLocal()
+    try:
+        rebuild(db, int(sys.argv[2]) if len(sys.argv) > 2 else None)
+        print("Rebuilt listening aggregates")
+    finally:
+        db.close()
@@ -0,0 +1,350 @@
+"""Cover art thumbnails for ``GET /art/{album_id}?size=``.
+
+Album art lives on the Cover Art Archive (``Album.cover_art_url``, filled in by
+enrichment). Each original is fetched once, and resized copies are served from a
+content-addressed cache on local disk:
+
+- ``originals/ab/<sha256>`` is a fetched image, named by the hash of its bytes;
+  ``urls/ab/<sha256 of the url>`` records which original a URL resolved to;
+- ``thumbs/ab/<sha256>-<size>q<quality>.<webp|jpg>`` is a thumbnail of that
+  original. The name depends only on the original's bytes and how it was
+  rendered, so it is also the response's strong ``ETag``;
+- thumbnails are rendered in a process pool, off the event loop and the
+  request threads;
+- concurrent requests for the same URL or thumbnail share one fetch or render;
+- the cache is bounded by ``ART_CACHE_MAX_BYTES``. Hits touch the file's mtime
+  (at most once per ``TOUCH_INTERVAL``), and when a write takes the total over
+  the limit the least recently used files are deleted down to ``LOW_WATER``.
+
+Sizes are snapped up to one of ``ART_SIZES`` so clients can't fill the cache
+with one thumbnail per pixel width. WebP goes to clients that accept it and
+JPEG to the rest.
+
+    python artcache.py status|evict
+"""
+import argparse
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import io
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from typing import TYPE_CHECKING
+
+from fastapi import HTTPException
+
+import metrics
+
+if TYPE_CHECKING:
+    import httpx
+
+ART_CACHE_DIR = os.getenv("ART_CACHE_DIR", os.path.join(os.path.dirname(__file__), ".cache", "art"))
+ART_CACHE_MAX_BYTES = int(os.getenv("ART_CACHE_MAX_BYTES", str(1024 ** 3)))
+ART_SIZES = tuple(sorted(int(size) for size in os.getenv("ART_SIZES", "64,128,256,512").split(",")))
+ART_WORKERS = int(os.getenv("ART_WORKERS", "2"))
+ART_FETCH_TIMEOUT = float(os.getenv("ART_FETCH_TIMEOUT", "10"))
+ART_MAX_AGE = int(os.getenv("ART_MAX_AGE", "86400"))  # an album's art changes only when enrichment changes its URL
+
+MAX_ORIGINAL_BYTES = 20 * 1024 ** 2
+MAX_PIXELS = 50_000_000  # larger originals are refused rather than decoded
+LOW_WATER = 0.9  # eviction stops at this fraction of the limit
+TOUCH_INTERVAL = 3600  # seconds; LRU order only needs to be roughly right
+FAILURE_TTL = 300  # seconds a failed fetch is remembered before the origin is asked again
+MAX_FAILURES = 10_000  # remembered failures; the oldest are forgotten first
+
+# extension: (Pillow format, media type, quality)
+FORMATS = {
+    "webp": ("WEBP", "image/webp", 80),
+    "jpg": ("JPEG", "image/jpeg", 85),
+}
+
+def snap(size: int) -> int:
+    """The smallest allowed size at least as large as the one asked for."""
+    return next((allowed for allowed in ART_SIZES if allowed >= size), ART_SIZES[-1])
+
+def negotiate(accept: str | None) -> str:
+    return "webp" if "image/webp" in (accept or "") else "jpg"
+
+def _sharded(directory: str, name: str) -> str:
+    return os.path.join(directory, name[:2], name)
+
+def _write_atomic(path: str, chunks) -> int:
+    """Write chunks to path through a temporary file; returns the bytes written."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    written = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                written += len(chunk)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return written
+
+def render(original: str, target: str, size: int, ext: str) -> int:
+    """Resize an original into a thumbnail file. Runs in the worker pool; returns its size in bytes."""
+    from PIL import Image, ImageOps
+
+    Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+    pil_format, _, quality = FORMATS[ext]
+    buffer = io.BytesIO()
+    with Image.open(original) as image:
+        # JPEG decodes straight to a smaller scale, which is most of the saving on large scans
+        image.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGBA" if ext == "webp" and image.has_transparency_data else "RGB")
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        image.save(buffer, pil_format, quality=quality)
+    return _write_atomic(target, [buffer.getvalue()])
+
+class Thumbnail:
+    def __init__(self, path: str, etag: str, media_type: str):
+        self.path = path
+        self.etag = etag
+        self.media_type = media_type
+
+class ArtCache:
+    """Originals and thumbnails on disk, bounded by total size."""
+
+    def __init__(self, directory: str, max_bytes: int, workers: int = ART_WORKERS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self._pool: ProcessPoolExecutor | None = None
+        self._client: "httpx.Client | None" = None
+        self._setup_lock = threading.Lock()
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._failures: OrderedDict[str, tuple[float, HTTPException]] = OrderedDict()
+        # Bytes on disk as of the last scan plus what this process wrote since
+        self._bytes: int | None = None
+        self._evict_lock = threading.Lock()
+
+    def _ref_path(self, url: str) -> str:
+        return _sharded(os.path.join(self.directory, "urls"), hashlib.sha256(url.encode()).hexdigest())
+
+    def _original_path(self, digest: str) -> str:
+        return _sharded(os.path.join(self.directory, "originals"), digest)
+
+    def _thumb_name(self, digest: str, size: int, ext: str) -> str:
+        return f"{digest}-{size}q{FORMATS[ext][2]}.{ext}"
+
+    def _thumb_path(self, name: str) -> str:
+        return _sharded(os.path.join(self.directory, "thumbs"), name)
+
+    def _http(self) -> "httpx.Client":
+        # Only the API process fetches; the workers import this module without httpx
+        import httpx
+
+        with self._setup_lock:
+            if self._client is None:
+                self._client = httpx.Client(timeout=ART_FETCH_TIMEOUT, follow_redirects=True)
+            return self._client
+
+    def _workers(self) -> ProcessPoolExecutor:
+        with self._setup_lock:
+            if self._pool is None:
+                # Not fork: the API process has threads holding locks and pooled connections
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    async def _once(self, key: str, start):
+        """Await start(), sharing one run with every concurrent caller for the same key."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(start())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # A client that goes away doesn't cancel the work for the others
+        return await asyncio.shield(task)
+
+    def _resolved(self, url: str) -> str | None:
+        """The digest of the original a URL was fetched as, if it is known."""
+        try:
+            with open(self._ref_path(url)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _failed(self, key: str, error: HTTPException) -> HTTPException:
+        self._failures[key] = (time.monotonic() + FAILURE_TTL, error)
+        self._failures.move_to_end(key)
+        # Oldest first is also soonest to expire
+        while len(self._failures) > MAX_FAILURES:
+            self._failures.popitem(last=False)
+        return error
+
+    def _check(self, key: str) -> None:
+        """Raise the error a recent attempt failed with, rather than trying again."""
+        failure = self._failures.get(key)
+        if failure is None:
+            return
+        if failure[0] > time.monotonic():
+            raise failure[1]
+        self._failures.pop(key, None)
+
+    def _fetch(self, url: str) -> str:
+        """Download an original into the cache; returns its digest."""
+        import httpx
+
+        self._check(url)
+        directory = os.path.join(self.directory, "originals")
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        hasher = hashlib.sha256()
+        received = 0
+        try:
+            with os.fdopen(fd, "wb") as f, self._http().stream("GET", url) as response:
+                if response.status_code == 404:
+                    raise self._failed(url, HTTPException(
+                        status_code=404,
+                        detail="Cover art not found"
+                    ))
+                response.raise_for_status()
+                for chunk in response.iter_bytes():
+                    received += len(chunk)
+                    if received > MAX_ORIGINAL_BYTES:
+                        raise self._failed(url, HTTPException(
+                            status_code=502,
+                            detail="Cover art is too large"
+                        ))
+                    hasher.update(chunk)
+                    f.write(chunk)
+        except httpx.HTTPError as e:
+            os.unlink(tmp)
+            print(f"Warning: fetching cover art {url} failed: {e!r}")
+            raise self._failed(url, HTTPException(
+                status_code=502,
+                detail="Could not fetch cover art"
+            ))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        digest = hasher.hexdigest()
+        path = self._original_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp, path)
+        self._wrote(received + _write_atomic(self._ref_path(url), [digest.encode()]))
+        return digest
+
+    def _hit(self, path: str) -> bool:
+        """Whether a cached file exists, marking it recently used."""
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return False
+        if mtime < time.time() - TOUCH_INTERVAL:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                return False
+        return True
+
+    async def etag(self, url: str, size: int, ext: str) -> str | None:
+        """The ETag the thumbnail will have, if the original was fetched before.
+
+        Enough to answer a conditional request without rendering anything."""
+        digest = await asyncio.to_thread(self._resolved, url)
+        return f'"{self._thumb_name(digest, size, ext)}"' if digest else None
+
+    async def thumbnail(self, url: str, size: int, ext: str) -> Thumbnail:
+        """The thumbnail for a cover art URL, fetching and rendering it if needed."""
+        digest = await asyncio.to_thread(self._resolved, url)
+        name = self._thumb_name(digest, size, ext) if digest else None
+        hit = bool(name) and await asyncio.to_thread(self._hit, self._thumb_path(name))
+        metrics.record_cache_lookup("art", hit)
+        if not hit:
+            if not digest or not await asyncio.to_thread(self._hit, self._original_path(digest)):
+                digest = await self._once(f"fetch:{url}", lambda: asyncio.to_thread(self._fetch, url))
+            name = self._thumb_name(digest, size, ext)
+            await self._once(f"render:{name}", lambda: self._render(digest, name, size, ext))
+        return Thumbnail(self._thumb_path(name), f'"{name}"', FORMATS[ext][1])
+
+    async def _render(self, digest: str, name: str, size: int, ext: str) -> None:
+        self._check(digest)
+        loop = asyncio.get_running_loop()
+        try:
+            written = await loop.run_in_executor(
+                self._workers(), render, self._original_path(digest), self._thumb_path(name), size, ext
+            )
+        except Exception as e:
+            print(f"Warning: rendering cover art {digest} failed: {e!r}")
+            raise self._failed(digest, HTTPException(
+                status_code=502,
+                detail="Cover art could not be decoded"
+            ))
+        await asyncio.to_thread(self._wrote, written)
+
+    def _wrote(self, written: int) -> None:
+        if self._bytes is None:
+            self._bytes = self.usage()[1]
+        else:
+            self._bytes += written
+        if self._bytes > self.max_bytes:
+            self.evict()
+
+    def _files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def usage(self) -> tuple[int, int]:
+        """(files, bytes) in the cache."""
+        files = total = 0
+        for _, size, _ in self._files():
+            files += 1
+            total += size
+        return files, total
+
+    def evict(self) -> int:
+        """Delete least recently used files until the cache is under its low-water mark.
+
+        Rescans the directory, so writes by other API processes are counted too.
+        Returns the files deleted."""
+        with self._evict_lock:
+            files = sorted(self._files(), key=lambda file: file[2])
+            total = sum(size for _, size, _ in files)
+            deleted = 0
+            if total > self.max_bytes:
+                for path, size, _ in files:
+                    if total <= self.max_bytes * LOW_WATER:
+                        break
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+                    total -= size
+                    deleted += 1
+            self._bytes = total
+            return deleted
+
+    def close(self) -> None:
+        with self._setup_lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cover art thumbnail cache")
+    parser.add_argument("command", choices=["status", "evict"])
+    args = parser.parse_args()
+
+    cache = ArtCache(ART_CACHE_DIR, ART_CACHE_MAX_BYTES)
+    if args.command == "evict":
+        print(f"Deleted {cache.evict()} files")
+    files, total = cache.usage()
+    print(f"{ART_CACHE_DIR}: {files} files, {total / 1024 ** 2:.1f} MiB of {ART_CACHE_MAX_BYTES / 1024 ** 2:.0f} MiB")
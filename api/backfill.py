@@ -0,0 +1,146 @@
+"""Online backfills: rewrite a large table in small, throttled transactions.
+
+A single ``UPDATE plays SET ...`` holds its row locks until it commits and
+ships as one huge burst of WAL, so replicas fall minutes behind. ``run``
+walks the table in primary-key order instead, one chunk per transaction:
+
+- the chunk size adapts so each transaction takes about ``TARGET_SECONDS``;
+- each chunk commits together with a ``job_watermarks`` checkpoint
+  (``backfill:<name>``), so an interrupted backfill resumes where it stopped
+  and no chunk is applied twice;
+- it waits whenever a replica is more than ``max_lag`` seconds behind, and
+  gives up on a chunk that can't get its locks within ``LOCK_TIMEOUT_MS``
+  rather than queueing behind other writers.
+
+Only rows that exist when the backfill starts are visited, so the application
+must already write the new value for new rows. Changing ``plays`` online is
+then: add the column as nullable (no table rewrite), deploy code that fills it,
+backfill, then add constraints. In a migration:
+
+    def upgrade() -> None:
+        op.add_column('plays', sa.Column('seconds_played', sa.Integer(), nullable=True))
+        backfill.run_in_migration(
+            "plays_seconds_played", "plays",
+            "UPDATE plays SET seconds_played = duration WHERE id > :start AND id <= :end"
+        )
+
+The statement gets the chunk's exclusive lower and inclusive upper key as
+``:start`` and ``:end``.
+
+    python backfill.py status
+"""
+import argparse
+import time
+
+from sqlalchemy import select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+
+from database import REPLICA_MAX_LAG, lag_guard, replica_engines
+from models import JobWatermark
+from similarity import get_watermark, set_watermark
+
+TARGET_SECONDS = 0.5  # aim for transactions this long
+MIN_CHUNK = 100
+MAX_CHUNK = 100_000
+LOCK_TIMEOUT_MS = 2000
+MAX_RETRIES = 10  # consecutive failed chunks before giving up
+REPORT_INTERVAL = 10.0  # seconds between progress lines
+
+def _checkpoint_name(name: str) -> str:
+    return f"backfill:{name}"
+
+def next_chunk_size(size: int, elapsed: float, target: float = TARGET_SECONDS) -> int:
+    """Scale the chunk size towards the target duration, at most doubling or halving it per chunk."""
+    scale = target / max(elapsed, 1e-3)
+    return int(min(max(size * min(max(scale, 0.5), 2.0), MIN_CHUNK), MAX_CHUNK))
+
+def wait_for_replicas(max_lag: float = REPLICA_MAX_LAG) -> float:
+    """Sleep while any reachable replica is more than max_lag seconds behind. Returns seconds waited."""
+    waited = 0.0
+    while True:
+        # Unreachable replicas report infinite lag; reads already skip them, so don't stall on them
+        lags = [lag for lag in (lag_guard.lag(i) for i in range(len(replica_engines))) if lag != float("inf")]
+        if not lags or max(lags) <= max_lag:
+            return waited
+        print(f"Replica {max(lags):.1f}s behind, pausing backfill")
+        time.sleep(1.0)
+        waited += 1.0
+
+def run(engine: Engine, name: str, table: str, statement: str, key: str = "id", chunk_size: int = 1000,
+        max_lag: float = REPLICA_MAX_LAG, pause: float = 0.0) -> int:
+    """Apply statement to every key range of table, resuming from the last checkpoint. Returns chunks applied."""
+    checkpoint = _checkpoint_name(name)
+    statement = text(statement)
+    next_key = text(f"SELECT max({key}) FROM (SELECT {key} FROM {table} WHERE {key} > :start ORDER BY {key} LIMIT :size) AS chunk")
+    with engine.connect() as conn:
+        start = get_watermark(conn, checkpoint)
+        stop = conn.scalar(text(f"SELECT max({key}) FROM {table}")) or 0
+    if start >= stop:
+        return 0
+    print(f"Backfill {name}: {table}.{key} {start} -> {stop}")
+
+    chunks, retries, last_report = 0, 0, time.monotonic()
+    while start < stop:
+        wait_for_replicas(max_lag)
+        started = time.perf_counter()
+        try:
+            with engine.begin() as conn:
+                if conn.dialect.name == "postgresql":
+                    conn.execute(text(f"SET LOCAL lock_timeout = {LOCK_TIMEOUT_MS}"))
+                end = min(conn.scalar(next_key, {'start': start, 'size': chunk_size}) or stop, stop)
+                conn.execute(statement, {'start': start, 'end': end})
+                set_watermark(conn, checkpoint, end)
+        except OperationalError as e:
+            # Lock timeouts and serialization failures: back off with a smaller chunk
+            retries += 1
+            if retries > MAX_RETRIES:
+                raise
+            chunk_size = max(chunk_size // 2, MIN_CHUNK)
+            print(f"Backfill {name} chunk after {start} failed, retrying with {chunk_size} rows: {e.orig}")
+            time.sleep(min(2 ** retries, 30))
+            continue
+        retries = 0
+        chunks += 1
+        start = end
+        chunk_size = next_chunk_size(chunk_size, time.perf_counter() - started)
+        if time.monotonic() - last_report > REPORT_INTERVAL:
+            print(f"Backfill {name}: at {start} of {stop}, {chunk_size} rows per chunk")
+            last_report = time.monotonic()
+        if pause:
+            time.sleep(pause)
+    print(f"Backfill {name} done in {chunks} chunks")
+    return chunks
+
+def run_in_migration(name: str, table: str, statement: str, **options) -> int:
+    """``run`` from an Alembic migration, committing the migration's DDL first so its locks are released."""
+    from alembic import context, op
+
+    if context.is_offline_mode():
+        # No database to walk: emit the statement for the whole table
+        op.execute(text(statement).bindparams(start=-(2 ** 63), end=2 ** 63 - 1))
+        return 0
+    with context.get_context().autocommit_block():
+        return run(op.get_bind().engine, name, table, statement, **options)
+
+def status(engine: Engine) -> list[tuple[str, int]]:
+    """(name, last key) of every backfill checkpoint."""
+    with engine.connect() as conn:
+        return [
+            (name.removeprefix("backfill:"), last_id)
+            for name, last_id in conn.execute(
+                select(JobWatermark.name, JobWatermark.last_id)
+                .where(JobWatermark.name.startswith("backfill:"))
+                .order_by(JobWatermark.name)
+            )
+        ]
+
+if __name__ == "__main__":
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="Online backfill checkpoints")
+    parser.add_argument("command", choices=["status"])
+    parser.parse_args()
+
+    for name, last_id in status(engine):
+        print(f"{name}: up to {last_id}")
@@ -0,0 +1,53 @@
+"""What API key authentication adds to a request.
+
+A bare app wrapped in the real ``APIKeyMiddleware`` serves the same no-op
+route as a public path, behind the middleware, and behind the middleware plus
+the ``get_current_user`` dependency every endpoint also runs.
+"""
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+import crud
+from main import APIKeyMiddleware, get_current_user
+
+@pytest.fixture(scope="module")
+def auth_client(dataset):
+    app = FastAPI()
+    app.add_middleware(APIKeyMiddleware, public_paths={"/public"})
+
+    @app.get("/public")
+    async def public():
+        return {}
+
+    @app.get("/private")
+    async def private():
+        return {}
+
+    @app.get("/private/user")
+    async def private_user(user=Depends(get_current_user)):
+        return {}
+
+    with TestClient(app) as client:
+        yield client
+
+@pytest.fixture(scope="module")
+def api_key(accounts):
+    return accounts[min(accounts)][1]
+
+@pytest.mark.parametrize("path", ["/public", "/private", "/private/user"])
+def test_auth_overhead(benchmark, auth_client, api_key, path):
+    headers = {"X-API-Key": api_key}
+
+    def get():
+        response = auth_client.get(path, headers=headers)
+        assert response.status_code == 200
+
+    benchmark(get)
+
+def test_rejected_key(benchmark, auth_client):
+    benchmark(lambda: auth_client.get("/private", headers={"X-API-Key": "not-a-key"}))
+
+def test_get_user_by_api_key(benchmark, db, api_key):
+    user = benchmark(crud.get_user_by_api_key, db, api_key)
+    assert user is not None
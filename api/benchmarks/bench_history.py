@@ -0,0 +1,28 @@
+"""Play history pages at increasing offsets, on the largest synthetic user."""
+import pytest
+
+import crud
+
+@pytest.fixture(scope="module")
+def history_user(accounts):
+    return accounts[max(accounts)]
+
+@pytest.mark.parametrize("limit", [50, 500])
+@pytest.mark.parametrize("offset", [0, 1000, 10_000, 100_000])
+def test_get_user_plays(benchmark, db, accounts, history_user, offset, limit):
+    if offset >= max(accounts):
+        pytest.skip("offset is past the end of the history")
+    plays = benchmark(crud.get_user_plays, db, history_user[0], limit, offset)
+    assert len(plays) == min(limit, max(accounts) - offset)
+
+@pytest.mark.parametrize("offset", [0, 10_000])
+def test_plays_endpoint(benchmark, client, accounts, history_user, offset):
+    if offset >= max(accounts):
+        pytest.skip("offset is past the end of the history")
+    headers = {"X-API-Key": history_user[1]}
+
+    def get():
+        response = client.get(f"/plays?limit=50&offset={offset}", headers=headers)
+        assert response.status_code == 200
+
+    benchmark(get)
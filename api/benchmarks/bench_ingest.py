@@ -0,0 +1,37 @@
+"""Play ingest: ``crud.create_play`` directly and through ``POST /track/play``."""
+import itertools
+import secrets
+
+import crud
+from schemas import PlayCreate
+
+def _catalog_bodies(sampler, n: int = 10000):
+    """Plays of already known tracks, drawn with the seeder's popularity skew."""
+    tracks, stations, ratings = sampler.tracks(n), sampler.stations(n), sampler.ratings(n)
+    return itertools.cycle([
+        sampler.catalog.play_body(int(t), int(s), int(r), int(sampler.durations[t]))
+        for t, s, r in zip(tracks, stations, ratings)
+    ])
+
+def test_create_play_known_track(benchmark, db, sampler, ingest_user):
+    bodies = _catalog_bodies(sampler)
+    benchmark(lambda: crud.create_play(db, PlayCreate(**next(bodies)), ingest_user[0]))
+
+def test_create_play_new_track(benchmark, db, ingest_user):
+    """Worst case: every play creates its artist, album, track and station."""
+    def play():
+        name = secrets.token_hex(6)
+        body = PlayCreate(title=f"T {name}", artist=f"A {name}", album=f"L {name}", station=f"S {name}", rating=0)
+        crud.create_play(db, body, ingest_user[0])
+
+    benchmark(play)
+
+def test_post_play_endpoint(benchmark, client, sampler, ingest_user):
+    bodies = _catalog_bodies(sampler)
+    headers = {"X-API-Key": ingest_user[1]}
+
+    def post():
+        response = client.post("/track/play", json=next(bodies), headers=headers)
+        assert response.status_code == 200
+
+    benchmark(post)
@@ -0,0 +1,20 @@
+"""Response serialization, the way FastAPI renders a ``response_model``."""
+import pytest
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+import crud
+from schemas import PlayResponse, StatsResponse
+
+def _render(adapter: TypeAdapter, value) -> bytes:
+    validated = adapter.validate_python(value, from_attributes=True)
+    return JSONResponse(adapter.dump_python(validated, mode="json")).body
+
+@pytest.mark.parametrize("limit", [50, 500])
+def test_play_history(benchmark, db, accounts, limit):
+    plays = crud.get_user_plays(db, accounts[max(accounts)][0], limit)
+    benchmark(_render, TypeAdapter(list[PlayResponse]), plays)
+
+def test_stats(benchmark, db, accounts):
+    stats = crud.get_user_stats(db, accounts[min(accounts)][0])
+    benchmark(_render, TypeAdapter(StatsResponse), stats)
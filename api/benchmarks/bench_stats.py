@@ -0,0 +1,44 @@
+"""``get_user_stats`` latency against history size."""
+import columnar
+import crud
+
+def _rounds(plays: int) -> int:
+    # A million-play stats call takes long enough that one round is representative
+    return max(1, min(10, 100_000 // plays))
+
+def test_get_user_stats(benchmark, db, accounts, history_size):
+    user_id = accounts[history_size][0]
+
+    def stats():
+        result = crud.get_user_stats(db, user_id)
+        # Drop the loaded plays so each round pays for loading them again
+        db.expunge_all()
+        return result
+
+    result = benchmark.pedantic(stats, rounds=_rounds(history_size), warmup_rounds=1)
+    assert result['overall']['total_plays'] == history_size
+
+def test_columnar_cold(benchmark, db, accounts, history_size):
+    user_id = accounts[history_size][0]
+
+    def stats():
+        columnar.store = columnar.ColumnStore()  # load the whole history each round
+        return columnar.get_user_stats(db, user_id)
+
+    result = benchmark.pedantic(stats, rounds=_rounds(history_size), warmup_rounds=1)
+    assert result['overall']['total_plays'] == history_size
+
+def test_columnar_resident(benchmark, db, accounts, history_size):
+    user_id = accounts[history_size][0]
+    columnar.get_user_stats(db, user_id)
+    result = benchmark(columnar.get_user_stats, db, user_id)
+    assert result['overall']['total_plays'] == history_size
+
+def test_stats_endpoint(benchmark, client, accounts, history_size):
+    headers = {"X-API-Key": accounts[history_size][1]}
+
+    def get():
+        response = client.get("/api/stats", headers=headers)
+        assert response.status_code == 200
+
+    benchmark.pedantic(get, rounds=_rounds(history_size), warmup_rounds=1)
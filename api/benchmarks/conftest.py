@@ -0,0 +1,102 @@
+"""Shared fixtures for the pytest-benchmark suite.
+
+The suite writes to the database, so it refuses to run unless
+``BENCH_DATABASE_URL`` points at a scratch database. Synthetic users with
+``BENCH_SIZES`` plays each (default 1k, 100k and 1M) are loaded once per
+session with the COPY seeder, so the suite needs Postgres; the behaviour
+tests that don't are in ``tests/``.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SIZES = [int(size) for size in os.getenv("BENCH_SIZES", "1000,100000,1000000").split(",")]
+
+def pytest_configure(config):
+    url = os.getenv("BENCH_DATABASE_URL")
+    if not url:
+        raise pytest.UsageError("Set BENCH_DATABASE_URL to a scratch database; the benchmarks write to it")
+    # database.py reads DATABASE_URL at import time, so this has to happen before any app import
+    os.environ["DATABASE_URL"] = url
+    # One key per history size sends every request; don't let the limiter answer them
+    os.environ["RATE_LIMIT_ENABLED"] = "false"
+    # Keep maintenance jobs from running in the middle of a measurement
+    os.environ["SCHEDULER_ENABLED"] = "false"
+    # Every request the suite sends also checks its endpoint's @query_budget
+    os.environ["QUERY_BUDGET_ENFORCE"] = "true"
+
+def pytest_generate_tests(metafunc):
+    if "history_size" in metafunc.fixturenames:
+        metafunc.parametrize("history_size", SIZES, ids=[f"{size}-plays" for size in SIZES])
+
+@pytest.fixture(scope="session")
+def schema():
+    """The app's tables on the scratch database, created if it is empty."""
+    from sqlalchemy import inspect, text
+    from database import engine
+    from models import Base
+
+    if not inspect(engine).has_table("plays"):
+        if engine.dialect.name == "postgresql":
+            with engine.begin() as conn:
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        Base.metadata.create_all(engine)
+
+@pytest.fixture(scope="session")
+def dataset(schema):
+    """One synthetic user per size: {plays: (user_id, api_key)}, plus the sampler of the last load."""
+    from database import engine
+    import seed
+
+    if engine.dialect.name != "postgresql":
+        pytest.skip("the seeder loads with COPY, which needs Postgres")
+
+    users, sampler = {}, None
+    for size in SIZES:
+        accounts, sampler = seed.generate(users=1, plays_per_user=size, artists=2000, stations=200, seed=size)
+        users[size] = accounts[0]
+    return users, sampler
+
+@pytest.fixture(scope="session")
+def accounts(dataset):
+    return dataset[0]
+
+@pytest.fixture(scope="session")
+def sampler(dataset):
+    return dataset[1]
+
+@pytest.fixture(scope="session")
+def client(dataset):
+    from fastapi.testclient import TestClient
+    from main import app
+
+    with TestClient(app) as client:
+        yield client
+
+@pytest.fixture
+def db(dataset):
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.rollback()
+        db.close()
+
+@pytest.fixture(scope="session")
+def ingest_user(dataset):
+    """A separate user for write benchmarks, so they don't grow the read fixtures."""
+    import secrets
+    from database import SessionLocal
+    import crud
+
+    db = SessionLocal()
+    try:
+        user = crud.create_user(db, f"bench-{secrets.token_hex(4)}@example.com", "password123")
+        return user.id, user.api_key
+    finally:
+        db.close()
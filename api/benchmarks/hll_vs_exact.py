@@ -0,0 +1,82 @@
+"""Compare HyperLogLog unique counts against the exact set-based path.
+
+    python benchmarks/hll_vs_exact.py          # synthetic, no database needed
+    python benchmarks/hll_vs_exact.py --db     # every user in DATABASE_URL
+
+The synthetic run simulates a year of daily sketches: it measures the error
+of the merged estimate and the time/memory of answering the query by merging
+365 sketches versus building a Python set over every play.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hll
+
+def synthetic(cardinalities: list[int], days: int = 365, seed: int = 42) -> None:
+    rng = np.random.default_rng(seed)
+    print(f"{'distinct':>10} {'plays':>10} {'estimate':>10} {'error':>8} "
+          f"{'set ms':>8} {'merge ms':>9} {'set KB':>8} {'sketch KB':>10}")
+    for distinct in cardinalities:
+        plays = distinct * 5
+        ids = rng.integers(0, distinct, size=plays)
+        # Make sure every id shows up at least once so the exact answer is `distinct`
+        ids[:distinct] = np.arange(distinct)
+        per_day = np.array_split(rng.permutation(ids), days)
+
+        started = time.perf_counter()
+        exact = len(set(ids.tolist()))
+        set_ms = (time.perf_counter() - started) * 1000
+        set_kb = sys.getsizeof(set(range(exact))) / 1024
+
+        sketches = []
+        for chunk in per_day:
+            sketch = hll.HyperLogLog()
+            for value in chunk.tolist():
+                sketch.add(value)
+            sketches.append(sketch.to_bytes())
+
+        started = time.perf_counter()
+        estimate = hll.HyperLogLog.union(sketches).count()
+        merge_ms = (time.perf_counter() - started) * 1000
+
+        error = (estimate - exact) / exact
+        print(f"{exact:>10} {plays:>10} {estimate:>10} {error:>+8.2%} "
+              f"{set_ms:>8.1f} {merge_ms:>9.1f} {set_kb:>8.0f} {days * hll.NUM_REGISTERS / 1024:>10.0f}")
+    print(f"\nExpected standard error: {hll.RELATIVE_ERROR:.2%}")
+
+def database() -> None:
+    from sqlalchemy import select
+    from database import SessionLocal
+    from models import User
+
+    db = SessionLocal()
+    try:
+        for user_id in db.scalars(select(User.id)).all():
+            started = time.perf_counter()
+            exact = hll.exact_unique(db, user_id)
+            exact_ms = (time.perf_counter() - started) * 1000
+            started = time.perf_counter()
+            estimate = hll.estimate_unique(db, user_id)
+            estimate_ms = (time.perf_counter() - started) * 1000
+            for key in ('unique_tracks', 'unique_artists'):
+                error = (estimate[key] - exact[key]) / exact[key] if exact[key] else 0.0
+                print(f"user {user_id:>6} {key:<15} exact={exact[key]:<8} estimate={estimate[key]:<8} "
+                      f"error={error:+.2%} exact_ms={exact_ms:.1f} estimate_ms={estimate_ms:.1f}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", action="store_true", help="compare against the configured database")
+    parser.add_argument("--cardinalities", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    args = parser.parse_args()
+    if args.db:
+        database()
+    else:
+        synthetic(args.cardinalities)
@@ -0,0 +1,136 @@
+"""Query plans of the hot endpoints.
+
+Each case sends one request and records every SELECT it runs, then runs them
+again under ``EXPLAIN (ANALYZE, FORMAT JSON)`` against the seeded users. A
+statement fails the test when its plan:
+
+- sequentially scans a table with more than ``LARGE_TABLE_ROWS`` rows;
+- sorts or hashes on disk instead of in ``work_mem``;
+- is estimated to return more than the case's row budget.
+
+Whether ``idx_plays_user_created_at`` and friends are used depends on the
+data, so run this after changing a query, an index or the seeder.
+"""
+import json
+
+import pytest
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+LARGE_TABLE_ROWS = 10_000
+ROW_BUDGET = 1_000  # estimated rows a statement may return
+
+# (method, path, row budget); the history user's key authenticates reads, the ingest user's writes.
+# {artist}, {album}, {track} and {station} are the history user's most played ones.
+CASES = [
+    ("GET", "/plays?limit=50", ROW_BUDGET),
+    ("GET", "/plays?limit=50&offset=10000", ROW_BUDGET),
+    ("POST", "/track/play", ROW_BUDGET),
+    ("GET", "/api/stats", None),  # loads the user's whole history once
+    ("GET", "/api/stats/unique", ROW_BUDGET),
+    ("GET", "/api/stats/heatmap", ROW_BUDGET),
+    ("GET", "/api/stats/calendar", ROW_BUDGET),
+    ("GET", "/api/stats/compare", ROW_BUDGET),
+    ("GET", "/api/charts/top", None),  # full per-shard counts, merged in Python
+    ("GET", "/search?q=artist", ROW_BUDGET),
+    ("GET", "/webhooks", ROW_BUDGET),
+    ("GET", "/artists/{artist}/plays", ROW_BUDGET),
+    ("GET", "/artists/{artist}/stats", ROW_BUDGET),
+    ("GET", "/albums/{album}/stats", ROW_BUDGET),
+    ("GET", "/tracks/{track}/plays", ROW_BUDGET),
+    ("GET", "/stations/{station}/stats", ROW_BUDGET),
+]
+
+@pytest.fixture(scope="module")
+def table_rows(dataset):
+    """Planner row counts per table, after analyzing the seeded data."""
+    from database import engine
+
+    if engine.dialect.name != "postgresql":
+        pytest.skip("query plans are checked on Postgres")
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+        return dict(conn.execute(text(
+            "SELECT relname, reltuples FROM pg_class WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace"
+        )).all())
+
+def _most_played(user_id: int) -> dict[str, int]:
+    """Ids of the user's most played track and its artist, album and station."""
+    from database import engine
+
+    with engine.connect() as conn:
+        row = conn.execute(text(
+            "SELECT p.track_id, t.artist_id, t.album_id, p.station_id FROM plays p JOIN tracks t ON t.id = p.track_id"
+            " WHERE p.user_id = :user_id GROUP BY 1, 2, 3, 4 ORDER BY count(*) DESC LIMIT 1"
+        ), {"user_id": user_id}).one()
+    return dict(zip(("track", "artist", "album", "station"), row))
+
+def _capture(send) -> list[tuple[Engine, str, dict]]:
+    """Distinct SELECTs run while calling send(), with the parameters they first ran with."""
+    statements: dict[str, tuple[Engine, str, dict]] = {}
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(("SELECT", "WITH")):
+            statements.setdefault(statement, (conn.engine, statement, parameters))
+
+    event.listen(Engine, "before_cursor_execute", record)
+    try:
+        send()
+    finally:
+        event.remove(Engine, "before_cursor_execute", record)
+    return list(statements.values())
+
+def _explain(engine: Engine, statement: str, parameters) -> dict:
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + statement, parameters)
+        plan = cursor.fetchone()[0]
+        conn.rollback()
+    finally:
+        conn.close()
+    plan = json.loads(plan) if isinstance(plan, str) else plan
+    return plan[0]["Plan"]
+
+def _nodes(plan: dict):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _nodes(child)
+
+def plan_problems(plan: dict, table_rows: dict[str, float], row_budget: int | None) -> list[str]:
+    """What is wrong with one statement's plan, if anything."""
+    problems = []
+    for node in _nodes(plan):
+        relation = node.get("Relation Name")
+        if node["Node Type"] == "Seq Scan" and table_rows.get(relation, 0) > LARGE_TABLE_ROWS:
+            problems.append(f"seq scan on {relation} ({table_rows[relation]:.0f} rows)")
+        if node.get("Sort Space Type") == "Disk":
+            problems.append(f"sort spilled to disk ({node.get('Sort Space Used')} kB)")
+        if node.get("Hash Batches", 1) > 1 or node.get("Disk Usage", 0) > 0:
+            problems.append(f"{node['Node Type']} spilled to disk")
+    if row_budget is not None and plan["Plan Rows"] > row_budget:
+        problems.append(f"estimated {plan['Plan Rows']} rows, budget is {row_budget}")
+    return problems
+
+@pytest.mark.parametrize("method,path,row_budget", CASES, ids=[f"{m} {p}" for m, p, _ in CASES])
+def test_query_plans(client, accounts, sampler, ingest_user, table_rows, history_size, method, path, row_budget):
+    if method == "POST":
+        track, station, rating = sampler.tracks(1)[0], sampler.stations(1)[0], sampler.ratings(1)[0]
+        body = sampler.catalog.play_body(int(track), int(station), int(rating), int(sampler.durations[track]))
+        send = lambda: client.post(path, json=body, headers={"X-API-Key": ingest_user[1]})
+    else:
+        user_id, api_key = accounts[history_size]
+        path = path.format(**_most_played(user_id)) if "{" in path else path
+        send = lambda: client.get(path, headers={"X-API-Key": api_key})
+
+    responses = []
+    statements = _capture(lambda: responses.append(send()))
+    assert responses[0].status_code == 200, responses[0].text
+    assert statements
+
+    failures = []
+    for engine, statement, parameters in statements:
+        problems = plan_problems(_explain(engine, statement, parameters), table_rows, row_budget)
+        if problems:
+            failures.append(f"{'; '.join(problems)}\n    {' '.join(statement.split())[:300]}")
+    assert not failures, f"{method} {path}:\n" + "\n".join(failures)
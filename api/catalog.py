@@ -0,0 +1,281 @@
+"""Catalog name canonicalization and the duplicate merge job.
+
+Ingest matches artists, albums and tracks on a normalized key (Unicode NFKC,
+case folding, collapsed whitespace, typographic quotes, "feat." credits
+removed), so "Radiohead", "radiohead " and "Radiohead feat. X" resolve to one
+artist.
+
+Rows created before that was in place are merged offline:
+
+    python catalog.py merge [--batch-size 5000] [--dry-run] [--renormalize]
+
+The job backfills the normalized keys, clusters duplicates, repoints
+``albums``/``tracks``/``plays`` to the canonical row in batched transactions,
+records a ``catalog_aliases`` row for every merged id and deletes the
+duplicates. On a sharded deployment every shard then does the same to its
+catalog copies and plays. Rows with different MusicBrainz ids are never
+merged.
+
+Every database whose plays were repointed has its catalog generation (the
+``catalog:generation`` job watermark) bumped afterwards, which tells caches
+holding catalog ids, like the columnar stats, to reload.
+"""
+import argparse
+import re
+import unicodedata
+
+from sqlalchemy import select, update, delete, text, case, true, table as table_clause, column as column_clause
+from sqlalchemy.orm import Session
+
+from models import Artist, Album, Track, CatalogAlias, JobWatermark
+
+_QUOTES = str.maketrans({"‘": "'", "’": "'", "“": '"', "”": '"', "´": "'", "`": "'"})
+_FEATURING = r"(?:feat\.?|ft\.?|featuring)"
+_BRACKETED_FEATURE = re.compile(rf"\s*[\(\[]\s*{_FEATURING}\s+[^\)\]]*[\)\]]", re.IGNORECASE)
+# A bare "ft." or "featuring" can be part of a title ("Ft. Lauderdale Blues"), so
+# unbracketed credits need a separator before them; only "feat." is unambiguous
+_TRAILING_FEATURE = re.compile(rf"(?:\s*[-–—,;/|]\s*{_FEATURING}|\s+feat\.)\s+.*$", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+GENERATION = "catalog:generation"
+
+def strip_featuring(name: str) -> str:
+    """Drop "feat. X" credits, bracketed or trailing, keeping the primary name.
+
+    Trailing credits are "feat. X" or any credit after a separator ("- ft. X",
+    ", featuring X"); "Blues Featuring the Band" is left alone.
+    """
+    stripped = _TRAILING_FEATURE.sub("", _BRACKETED_FEATURE.sub("", name))
+    return _WHITESPACE.sub(" ", stripped).strip() or _WHITESPACE.sub(" ", name).strip()
+
+def normalize_name(name: str) -> str:
+    """Matching key for a catalog name."""
+    name = unicodedata.normalize("NFKC", name).translate(_QUOTES)
+    name = unicodedata.normalize("NFKC", name.casefold())
+    return strip_featuring(name)
+
+def display_name(name: str) -> str:
+    """Name to store for a new artist: trimmed and without featured artists."""
+    return strip_featuring(unicodedata.normalize("NFKC", name))
+
+# Each mergeable kind: model, name column, normalized column, grouping columns,
+# and the (table, column) foreign keys that point at it
+_KINDS = {
+    "artist": (Artist, "name", "name_normalized", (), [("albums", "artist_id"), ("tracks", "artist_id")]),
+    "album": (Album, "title", "title_normalized", ("artist_id",), [("tracks", "album_id")]),
+    "track": (Track, "title", "title_normalized", ("artist_id", "album_id"), [("plays", "track_id")]),
+}
+
+def backfill_normalized(db: Session, kind: str, batch_size: int = 5000, recompute: bool = False) -> int:
+    """Fill missing normalized keys in keyset-ordered batches. Returns rows updated.
+
+    With ``recompute``, existing keys are checked too and rewritten where
+    ``normalize_name`` has changed since they were computed.
+    """
+    model, name_attr, key_attr, _, _ = _KINDS[kind]
+    name_col, key_col = getattr(model, name_attr), getattr(model, key_attr)
+    updated, last_id = 0, 0
+    while True:
+        rows = db.execute(
+            select(model.id, name_col, key_col).where(model.id > last_id, true() if recompute else key_col.is_(None))
+            .order_by(model.id).limit(batch_size)
+        ).all()
+        if not rows:
+            return updated
+        changes = [
+            {'id': row[0], key_attr: key} for row in rows
+            if (key := normalize_name(row[1])) != row[2]
+        ]
+        if changes:
+            db.execute(update(model), changes)
+            db.commit()
+        updated += len(changes)
+        last_id = rows[-1][0]
+
+def find_duplicates(db: Session, kind: str) -> dict[int, int]:
+    """Map every duplicate id to its canonical id.
+
+    The canonical row is the one with a MusicBrainz id if there is one, else
+    the oldest. Rows carrying a different MusicBrainz id stay separate.
+    """
+    model, _, key_attr, group_attrs, _ = _KINDS[kind]
+    columns = [getattr(model, attr) for attr in group_attrs] + [getattr(model, key_attr)]
+    rows = db.execute(
+        select(model.id, model.mbid, *columns)
+        .where(getattr(model, key_attr).is_not(None))
+        .order_by(*columns, model.mbid.is_(None), model.id)
+    ).all()
+
+    mapping = {}
+    canonical_id, canonical_mbid, current_key = None, None, None
+    for row in rows:
+        key = tuple(row[2:])
+        if key != current_key:
+            current_key, canonical_id, canonical_mbid = key, row.id, row.mbid
+        elif row.mbid is None or row.mbid == canonical_mbid:
+            mapping[row.id] = canonical_id
+    return mapping
+
+def _repoint(db: Session, table: str, column: str, mapping: dict[int, int], batch_size: int) -> int:
+    """Move foreign keys from duplicates to canonical rows, batch_size rows per transaction."""
+    if db.get_bind().dialect.name == "sqlite":
+        return _repoint_sqlite(db, table, column, mapping, batch_size)
+    dup_ids, canonical_ids = list(mapping), list(mapping.values())
+    moved = 0
+    statement = text(f"""
+        UPDATE {table} AS t SET {column} = m.canonical_id
+        FROM unnest(CAST(:dup_ids AS integer[]), CAST(:canonical_ids AS integer[])) AS m(dup_id, canonical_id)
+        WHERE t.{column} = m.dup_id
+          AND t.id IN (SELECT id FROM {table} WHERE {column} = ANY(CAST(:dup_ids AS integer[])) LIMIT :batch_size)
+    """)
+    for chunk in range(0, len(dup_ids), 1000):
+        params = {
+            'dup_ids': dup_ids[chunk:chunk + 1000],
+            'canonical_ids': canonical_ids[chunk:chunk + 1000],
+            'batch_size': batch_size
+        }
+        while (count := db.execute(statement, params).rowcount):
+            db.commit()
+            moved += count
+    return moved
+
+def _repoint_sqlite(db: Session, table: str, column: str, mapping: dict[int, int], batch_size: int) -> int:
+    """``_repoint`` without ``unnest``: the new key comes from a CASE over each chunk."""
+    target = table_clause(table, column_clause("id"), column_clause(column))
+    key = target.c[column]
+    dup_ids = list(mapping)
+    moved = 0
+    for chunk in range(0, len(dup_ids), 1000):
+        ids = dup_ids[chunk:chunk + 1000]
+        batch = select(target.c.id).where(key.in_(ids)).limit(batch_size).scalar_subquery()
+        statement = update(target).where(target.c.id.in_(batch)).values({column: case({id: mapping[id] for id in ids}, value=key)})
+        while (count := db.execute(statement).rowcount):
+            db.commit()
+            moved += count
+    return moved
+
+def generation_query():
+    """The database's catalog generation, as a scalar subquery to add to a read."""
+    return select(JobWatermark.last_id).where(JobWatermark.name == GENERATION).scalar_subquery()
+
+def bump_generation(db: Session) -> None:
+    """Mark ids cached from this database's catalog as stale, and commit."""
+    if not db.execute(
+        update(JobWatermark).where(JobWatermark.name == GENERATION).values(last_id=JobWatermark.last_id + 1)
+    ).rowcount:
+        db.add(JobWatermark(name=GENERATION, last_id=1))
+    db.commit()
+
+def merge_kind(db: Session, kind: str, batch_size: int = 5000, dry_run: bool = False,
+               renormalize: bool = False) -> int:
+    """Merge all duplicates of one kind. Returns the number of rows merged away."""
+    model, name_attr, _, _, references = _KINDS[kind]
+    backfill_normalized(db, kind, batch_size, renormalize)
+    mapping = find_duplicates(db, kind)
+    if dry_run or not mapping:
+        return len(mapping)
+
+    for table, column in references:
+        _repoint(db, table, column, mapping, batch_size)
+
+    dup_ids = list(mapping)
+    for chunk in range(0, len(dup_ids), 1000):
+        ids = dup_ids[chunk:chunk + 1000]
+        names = dict(db.execute(select(model.id, getattr(model, name_attr)).where(model.id.in_(ids))).all())
+        db.add_all(
+            CatalogAlias(kind=kind, alias_id=dup_id, canonical_id=mapping[dup_id], name=names[dup_id])
+            for dup_id in ids
+        )
+        # Earlier merges may have pointed aliases at rows that are now duplicates themselves
+        for dup_id in ids:
+            db.execute(
+                update(CatalogAlias)
+                .where(CatalogAlias.kind == kind, CatalogAlias.canonical_id == dup_id)
+                .values(canonical_id=mapping[dup_id])
+            )
+        db.execute(delete(model).where(model.id.in_(ids)))
+        db.commit()
+    bump_generation(db)
+
+    # Shards keep their own copies of the catalog rows their plays use
+    import sharding
+    if sharding.enabled():
+        rows = _canonical_rows(db, kind, set(mapping.values()))
+        sharding.scatter(lambda shard_db: _merge_on_shard(shard_db, kind, mapping, rows, batch_size), read_only=False)
+    return len(mapping)
+
+def _canonical_rows(db: Session, kind: str, ids: set[int]) -> dict[int, list[tuple[type, dict]]]:
+    """Snapshots of each canonical row and the rows it references, parents first."""
+    import sharding
+
+    model = _KINDS[kind][0]
+    rows = {}
+    ids = list(ids)
+    for chunk in range(0, len(ids), 1000):
+        canonicals = db.scalars(select(model).where(model.id.in_(ids[chunk:chunk + 1000]))).all()
+        for row in canonicals:
+            parents = []
+            if kind == "track":
+                parents = [row.album.artist, row.artist, row.album]
+            elif kind == "album":
+                parents = [row.artist]
+            rows[row.id] = sharding._snapshot(parents + [row])
+    return rows
+
+def _merge_on_shard(db: Session, kind: str, mapping: dict[int, int], canonical_rows: dict[int, list],
+                    batch_size: int) -> int:
+    """Repoint a shard's plays and catalog copies from duplicates to canonical rows, then drop the duplicates."""
+    import sharding
+
+    model, _, _, _, references = _KINDS[kind]
+    dup_ids = list(mapping)
+    present = []
+    for chunk in range(0, len(dup_ids), 1000):
+        present.extend(db.scalars(select(model.id).where(model.id.in_(dup_ids[chunk:chunk + 1000]))).all())
+    if not present:
+        return 0
+
+    copies = {}
+    for dup_id in present:
+        for row_model, values in canonical_rows[mapping[dup_id]]:
+            copies[(row_model, values["id"])] = (row_model, values)
+    sharding._copy_rows(db, copies.values())
+    db.commit()
+    local = {dup_id: mapping[dup_id] for dup_id in present}
+    for table, column in references:
+        _repoint(db, table, column, local, batch_size)
+    for chunk in range(0, len(present), 1000):
+        db.execute(delete(model).where(model.id.in_(present[chunk:chunk + 1000])))
+        db.commit()
+    bump_generation(db)
+    return len(present)
+
+def canonical_id(db: Session, kind: str, item_id: int) -> int:
+    """Resolve an id that may have been merged away."""
+    return db.scalar(
+        select(CatalogAlias.canonical_id).where(CatalogAlias.kind == kind, CatalogAlias.alias_id == item_id)
+    ) or item_id
+
+def merge_duplicates(db: Session, batch_size: int = 5000, dry_run: bool = False,
+                     renormalize: bool = False) -> dict[str, int]:
+    # Artists first: merging them is what makes album and track duplicates line up
+    return {kind: merge_kind(db, kind, batch_size, dry_run, renormalize) for kind in ("artist", "album", "track")}
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Canonicalize catalog names and merge duplicates")
+    parser.add_argument("command", choices=["merge"])
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--dry-run", action="store_true", help="report duplicates without merging")
+    parser.add_argument("--renormalize", action="store_true",
+                        help="recompute every normalized key, after normalize_name changes")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        for kind, count in merge_duplicates(db, args.batch_size, args.dry_run, args.renormalize).items():
+            print(f"{kind}: {count} duplicates {'found' if args.dry_run else 'merged'}")
+        if not args.dry_run:
+            print("Rebuild derived tables afterwards: python hll.py rebuild && python similarity.py --full")
+    finally:
+        db.close()
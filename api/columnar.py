@@ -0,0 +1,290 @@
+"""In-memory columnar stats: a user's plays as NumPy arrays.
+
+``crud.get_user_stats`` loads every play as an ORM object (with its track,
+artist, album and station) on each request, which for a long history means
+hundreds of MB and most of the response time. With ``STATS_ENGINE=columnar``
+(the default) ``/api/stats`` is answered from compact per-user columns
+instead:
+
+- catalog ids are dictionary-encoded into dense int32 codes per user, so
+  counting is one ``np.bincount`` and the top 10 an ``argpartition``;
+- play times are int64 microseconds since the epoch, ratings uint8 and
+  durations int32: about 30 bytes a play, ~3 MB per 100k plays;
+- a resident user is refreshed by reading only plays with a higher id than
+  the last one loaded, in the same statement that counts the user's plays;
+  if the count does not add up (a play committed out of id order, or the user
+  moved shards) the user is reloaded;
+- the same statement reads the catalog generation, which the duplicate merge
+  bumps after repointing plays (``catalog.bump_generation``). Residents
+  loaded under an older generation hold merged-away ids and are reloaded, as
+  is a user whose top items include an id that no longer has a name.
+
+Residents are kept in an LRU bounded by ``COLUMNAR_MAX_BYTES`` per worker
+process. ``STATS_ENGINE=orm`` goes back to the ORM implementation.
+"""
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import os
+import threading
+
+import numpy as np
+from fastapi import HTTPException
+from sqlalchemy import select, func, literal, union_all, and_
+from sqlalchemy.orm import Session
+
+import catalog
+import crud
+import metrics
+import sharding
+from models import Artist, Album, Track, Station, Play, Rating
+
+STATS_ENGINE = os.getenv("STATS_ENGINE", "columnar")
+COLUMNAR_MAX_BYTES = int(os.getenv("COLUMNAR_MAX_BYTES", str(256 * 1024 * 1024)))  # per worker process
+TOP_K = 10
+
+RATINGS = list(Rating)
+DIMENSIONS = ("track", "artist", "album", "station")
+_NAME_COLUMNS = {'track': Track.title, 'artist': Artist.name, 'album': Album.title, 'station': Station.name}
+_EPOCH = datetime(1970, 1, 1)
+_RATING_CODES = {rating: code for code, rating in enumerate(RATINGS)}
+
+def _datetime(micros) -> datetime:
+    return _EPOCH + timedelta(microseconds=int(micros))
+
+class UserPlays:
+    """One user's plays as growable columns. ``lock`` guards refresh and reads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.size = 0
+        self.last_id = 0
+        self.generation = None  # catalog generation the columns were loaded under
+        self.codes = {dim: np.empty(0, dtype=np.int32) for dim in DIMENSIONS}
+        self.values = {dim: np.empty(0, dtype=np.int32) for dim in DIMENSIONS}  # code -> catalog id
+        self._code_of: dict[str, dict[int, int]] = {dim: {} for dim in DIMENSIONS}
+        self.played_at = np.empty(0, dtype=np.int64)
+        self.rating = np.empty(0, dtype=np.uint8)
+        self.duration = np.empty(0, dtype=np.int32)
+
+    @property
+    def nbytes(self) -> int:
+        arrays = [*self.codes.values(), *self.values.values(), self.played_at, self.rating, self.duration]
+        return sum(array.nbytes for array in arrays)
+
+    def _grow(self, array: np.ndarray, extra: int) -> np.ndarray:
+        if self.size + extra <= len(array):
+            return array
+        grown = np.empty(max(self.size + extra, 2 * len(array), 64), dtype=array.dtype)
+        grown[:self.size] = array[:self.size]
+        return grown
+
+    def append(self, rows: list[tuple]) -> None:
+        """Add (id, track_id, artist_id, album_id, station_id, created_at, rating, duration) rows."""
+        if not rows:
+            return
+        n, end = len(rows), self.size + len(rows)
+        columns = list(zip(*rows))
+        for position, dim in enumerate(DIMENSIONS, start=1):
+            code_of = self._code_of[dim]
+            distinct, inverse = np.unique(np.array(columns[position], dtype=np.int32), return_inverse=True)
+            new_values = [int(value) for value in distinct if int(value) not in code_of]
+            for value in new_values:
+                code_of[value] = len(code_of)
+            if new_values:
+                self.values[dim] = np.concatenate([self.values[dim], np.array(new_values, dtype=np.int32)])
+            self.codes[dim] = self._grow(self.codes[dim], n)
+            self.codes[dim][self.size:end] = np.array([code_of[int(value)] for value in distinct], dtype=np.int32)[inverse]
+        self.played_at = self._grow(self.played_at, n)
+        self.played_at[self.size:end] = np.array(columns[5], dtype="datetime64[us]").astype(np.int64)
+        self.rating = self._grow(self.rating, n)
+        self.rating[self.size:end] = [_RATING_CODES[value] for value in columns[6]]
+        self.duration = self._grow(self.duration, n)
+        self.duration[self.size:end] = [value or 0 for value in columns[7]]
+        self.size = end
+        self.last_id = max(self.last_id, max(columns[0]))
+
+    def column(self, name: str) -> np.ndarray:
+        if name in self.codes:
+            return self.codes[name][:self.size]
+        return getattr(self, name)[:self.size]
+
+    def top(self, dim: str, k: int = TOP_K) -> list[tuple[int, int, int]]:
+        """(catalog id, play count, last played micros) of the k most played, newest first on ties."""
+        codes = self.column(dim)
+        counts = np.bincount(codes, minlength=len(self.values[dim]))
+        if len(counts) > k:
+            # Everything tied with the k-th largest count is a candidate
+            threshold = counts[np.argpartition(counts, -k)[-k:]].min()
+            candidates = np.flatnonzero(counts >= threshold)
+        else:
+            candidates = np.arange(len(counts))
+        last = np.full(len(counts), np.iinfo(np.int64).min, dtype=np.int64)
+        mask = np.isin(codes, candidates)
+        np.maximum.at(last, codes[mask], self.column("played_at")[mask])
+        order = np.lexsort((last[candidates], counts[candidates]))[::-1][:k]
+        chosen = candidates[order]
+        return [(int(self.values[dim][c]), int(counts[c]), int(last[c])) for c in chosen]
+
+class ColumnStore:
+    """A bounded LRU of resident users, keyed by the database their plays are read from."""
+
+    def __init__(self, max_bytes: int = COLUMNAR_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._users: OrderedDict[tuple, UserPlays] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: tuple) -> tuple[UserPlays, bool]:
+        with self._lock:
+            user = self._users.get(key)
+            if user is not None:
+                self._users.move_to_end(key)
+                return user, True
+            user = self._users[key] = UserPlays()
+            return user, False
+
+    def _evict(self, keep: tuple) -> None:
+        with self._lock:
+            total = sum(user.nbytes for user in self._users.values())
+            for key in list(self._users):
+                if total <= self.max_bytes or key == keep:
+                    break
+                total -= self._users.pop(key).nbytes
+
+    def _key(self, user_id: int) -> tuple:
+        # Each shard numbers its plays separately, so residents are per shard
+        return (sharding.shard_for_user(user_id) if sharding.enabled() else None, user_id)
+
+    def discard(self, user_id: int) -> None:
+        """Drop the user's columns, so the next request loads them again."""
+        with self._lock:
+            self._users.pop(self._key(user_id), None)
+
+    def user_plays(self, db: Session, user_id: int) -> UserPlays:
+        """The user's resident columns, brought up to date. Returned with ``lock`` held."""
+        key = self._key(user_id)
+        user, hit = self._get(key)
+        metrics.record_cache_lookup("columnar", hit)
+        user.lock.acquire()
+        try:
+            if not _refresh(db, user_id, user):
+                fresh = UserPlays()
+                _, fresh.generation, rows = _delta(db, user_id, 0)
+                fresh.append(rows)
+                fresh.lock.acquire()
+                with self._lock:
+                    self._users[key] = fresh
+                user.lock.release()
+                user = fresh
+        except BaseException:
+            user.lock.release()
+            raise
+        self._evict(key)
+        return user
+
+def _delta(db: Session, user_id: int, after_id: int) -> tuple[int, int, list[tuple]]:
+    """The user's play count, the catalog generation and the plays with id > after_id, in one statement."""
+    total = select(
+        func.count().label("total"), func.coalesce(catalog.generation_query(), 0).label("generation")
+    ).where(Play.user_id == user_id).subquery()
+    plays = Play.__table__.join(Track.__table__, Track.id == Play.track_id)
+    rows = db.execute(
+        select(
+            total.c.total, total.c.generation, Play.id, Play.track_id, Track.artist_id, Track.album_id, Play.station_id,
+            Play.created_at, Play.rating, Play.duration
+        )
+        # No ORDER BY: nothing depends on play order, and sorting a whole history spills to disk
+        .select_from(total.outerjoin(plays, and_(Play.user_id == user_id, Play.id > after_id)))
+    ).all()
+    return rows[0][0], rows[0][1], [tuple(row[2:]) for row in rows if row[2] is not None]
+
+def _refresh(db: Session, user_id: int, user: UserPlays) -> bool:
+    """Append new plays. False if the resident columns can't be brought up to date."""
+    total, generation, rows = _delta(db, user_id, user.last_id)
+    if user.generation is None:
+        user.generation = generation
+    elif generation > user.generation:
+        return False  # plays were repointed by a catalog merge (an older generation is a lagging replica)
+    if total < user.size and not rows:
+        return True  # a lagging replica; what is resident is newer
+    if total != user.size + len(rows):
+        return False
+    user.append(rows)
+    return True
+
+def _names(db: Session, ids: dict[str, set[int]]) -> dict[tuple[str, int], str]:
+    """Display names for catalog ids, one statement for all four tables."""
+    queries = [
+        select(literal(dim).label("dim"), column.class_.id, column.label("name")).where(column.class_.id.in_(ids[dim]))
+        for dim, column in _NAME_COLUMNS.items() if ids[dim]
+    ]
+    if not queries:
+        return {}
+    return {(dim, id): name for dim, id, name in db.execute(union_all(*queries))}
+
+def get_user_stats(db: Session, user_id: int, reload: bool = True) -> dict:
+    """``crud.get_user_stats`` from resident columns."""
+    user = store.user_plays(db, user_id)
+    try:
+        if not user.size:
+            raise HTTPException(
+                status_code=404,
+                detail="No plays found"
+            )
+        played_at = user.column("played_at")
+        tops = {dim: user.top(dim) for dim in DIMENSIONS}
+        first_play, last_play = played_at.min(), played_at.max()
+        overall = {
+            'total_plays': user.size,
+            'unique_tracks': len(user.values['track']),
+            'unique_artists': len(user.values['artist']),
+            'total_time_seconds': int(user.column("duration").sum(dtype=np.int64)),
+            'first_play': _datetime(first_play),
+            'last_play': _datetime(last_play)
+        }
+        times = played_at.astype("datetime64[us]")
+        hours = (played_at // 3_600_000_000) % 24
+        days = (played_at // 86_400_000_000 + 3) % 7  # 1970-01-01 was a Thursday
+        months = times.astype("datetime64[M]").astype(np.int64) % 12 + 1
+        ratings = np.bincount(user.column("rating"), minlength=len(RATINGS))
+    finally:
+        user.lock.release()
+
+    names = _names(db, {dim: {id for id, _, _ in top} for dim, top in tops.items()})
+    if reload and any((dim, id) not in names for dim, top in tops.items() for id, _, _ in top):
+        # An id merged away since the columns were loaded, on a database whose generation hasn't caught up
+        store.discard(user_id)
+        return get_user_stats(db, user_id, reload=False)
+
+    def top_items(dim: str) -> list[dict]:
+        return [
+            {'id': id, 'name': names.get((dim, id)), 'play_count': count, 'last_played': _datetime(last)}
+            for id, count, last in tops[dim]
+        ]
+
+    def histogram(key: str, values: np.ndarray, size: int) -> list[dict]:
+        counts = np.bincount(values, minlength=size)
+        return [{key: int(value), 'play_count': int(counts[value])} for value in np.flatnonzero(counts)]
+
+    return {
+        'overall': overall,
+        'top_tracks': top_items("track"),
+        'top_artists': top_items("artist"),
+        'top_albums': top_items("album"),
+        'top_stations': top_items("station"),
+        'plays_by_hour': histogram('hour', hours, 24),
+        'plays_by_day': histogram('day', days, 7),
+        'plays_by_month': histogram('month', months, 13),
+        'rating_distribution': [
+            {'rating': rating, 'play_count': int(count)}
+            for rating, count in zip(RATINGS, ratings)
+        ]
+    }
+
+def user_stats(db: Session, user_id: int) -> dict:
+    """``/api/stats`` from the configured engine."""
+    with metrics.STATS_DURATION.labels("full").time():
+        if STATS_ENGINE == "columnar":
+            return get_user_stats(db, user_id)
+        return crud.get_user_stats(db, user_id)
+
+store = ColumnStore()
@@ -0,0 +1,225 @@
+"""``GET /api/stats/compare``: one period of a user's listening against another.
+
+Periods are UTC dates, written as:
+
+- ``2026`` (a year), ``2026-10`` (a month), ``2026-W42`` (an ISO week) or
+  ``2026-10-19`` (a day);
+- ``2026-09-01..2026-09-15``, a range with both ends included.
+
+``a`` defaults to the current month, and ``b`` defaults to the period of the
+same kind just before ``a`` (the previous month, week, ...). Deltas are ``a``
+minus ``b``.
+
+Both periods are answered by one statement. Each period's plays are one
+index-only range scan of ``idx_plays_user_created_at``, which includes
+``track_id`` and ``duration``. Those plays are grouped once by track and then
+by artist. Each artist's counts for ``a`` and ``b`` are conditional
+aggregates (``FILTER``). Window functions over the groups then rank the artists in each
+period, rank the rises and falls, and sum the period totals. Only the rows
+that make one of the lists leave the database.
+
+An artist is new when the user played them in ``a`` and never before ``a``
+started, which each artist of ``a`` checks by probing
+``idx_plays_user_track_created_at`` for the artist's tracks.
+"""
+from datetime import date, datetime, time, timedelta, UTC
+import re
+
+from fastapi import HTTPException
+from sqlalchemy import select, func, case, cast, literal, union_all, and_, or_, BigInteger, Integer
+from sqlalchemy.orm import Session
+
+from models import Artist, Track, Play
+
+TOP_K = 10
+MAX_DAYS = 366
+
+_RANGE = re.compile(r"^(\d{4}-\d{2}-\d{2})\.\.(\d{4}-\d{2}-\d{2})$")
+_WEEK = re.compile(r"^(\d{4})-W(\d{2})$")
+_MONTH = re.compile(r"^(\d{4})-(\d{2})$")
+_YEAR = re.compile(r"^(\d{4})$")
+
+class Period:
+    """Whole UTC days from ``start`` up to, but not including, ``end``."""
+
+    def __init__(self, kind: str, start: date, end: date):
+        self.kind = kind
+        self.start = start
+        self.end = end
+
+    @classmethod
+    def month_of(cls, day: date) -> "Period":
+        start = day.replace(day=1)
+        return cls("month", start, (start + timedelta(days=32)).replace(day=1))
+
+    def before(self) -> "Period":
+        """The period of the same kind that ends where this one starts."""
+        if self.kind == "month":
+            return Period.month_of(self.start - timedelta(days=1))
+        if self.kind == "year":
+            return Period("year", self.start.replace(year=self.start.year - 1), self.start)
+        return Period(self.kind, self.start - (self.end - self.start), self.start)
+
+def _invalid(value: str, reason: str = "expected YYYY, YYYY-MM, YYYY-Www, YYYY-MM-DD or YYYY-MM-DD..YYYY-MM-DD"):
+    return HTTPException(
+        status_code=400,
+        detail=f"Invalid period {value!r}: {reason}"
+    )
+
+def parse_period(value: str) -> Period:
+    try:
+        if match := _RANGE.match(value):
+            start, last = date.fromisoformat(match[1]), date.fromisoformat(match[2])
+            period = Period("range", start, last + timedelta(days=1))
+        elif match := _WEEK.match(value):
+            start = date.fromisocalendar(int(match[1]), int(match[2]), 1)
+            period = Period("week", start, start + timedelta(days=7))
+        elif match := _MONTH.match(value):
+            period = Period.month_of(date(int(match[1]), int(match[2]), 1))
+        elif match := _YEAR.match(value):
+            period = Period("year", date(int(match[1]), 1, 1), date(int(match[1]) + 1, 1, 1))
+        else:
+            period = Period("day", date.fromisoformat(value), date.fromisoformat(value) + timedelta(days=1))
+    except (ValueError, OverflowError):
+        raise _invalid(value)
+    if period.end <= period.start:
+        raise _invalid(value, "the range ends before it starts")
+    if (period.end - period.start).days > MAX_DAYS:
+        raise _invalid(value, f"periods are at most {MAX_DAYS} days")
+    return period
+
+def periods(a: str | None, b: str | None) -> tuple[Period, Period]:
+    """The periods to compare; ``a`` defaults to this month and ``b`` to the one before ``a``."""
+    period_a = parse_period(a) if a else Period.month_of(datetime.now(UTC).date())
+    period_b = parse_period(b) if b else period_a.before()
+    return period_a, period_b
+
+def _window(period: Period):
+    return and_(
+        Play.created_at >= datetime.combine(period.start, time()),
+        Play.created_at < datetime.combine(period.end, time())
+    )
+
+def _totals(period: Period, row, side: str) -> dict:
+    """A period's totals, which every row of the comparison carries."""
+    # Postgres sums bigints as numeric
+    total = lambda column: int(row[f"{column}_{side}"]) if row else 0
+    return {
+        'start': period.start,
+        'end': period.end - timedelta(days=1),
+        'total_plays': total("total_plays"),
+        'total_time_seconds': total("total_seconds"),
+        'unique_artists': total("artists")
+    }
+
+def compare(db: Session, user_id: int, a: Period, b: Period) -> dict:
+    """Totals for both periods plus the top artists, biggest risers and fallers, and new artists."""
+    # One index range per period (a play in both, when they overlap, is read twice)
+    plays = union_all(*(
+        select(Play.track_id, Play.duration, literal(side).label("period"))
+        .where(Play.user_id == user_id, _window(period))
+        for side, period in (("a", a), ("b", b))
+    )).subquery()
+    in_a, in_b = plays.c.period == "a", plays.c.period == "b"
+    # Count per track first, so each distinct track is looked up once rather than each play
+    tracks = (
+        select(
+            plays.c.track_id,
+            func.count().filter(in_a).label("plays_a"),
+            func.count().filter(in_b).label("plays_b"),
+            func.coalesce(func.sum(plays.c.duration).filter(in_a), 0).label("seconds_a"),
+            func.coalesce(func.sum(plays.c.duration).filter(in_b), 0).label("seconds_b")
+        )
+        .group_by(plays.c.track_id)
+        .subquery()
+    )
+    grouped = (
+        select(
+            Track.artist_id,
+            cast(func.sum(tracks.c.plays_a), Integer).label("plays_a"),
+            cast(func.sum(tracks.c.plays_b), Integer).label("plays_b"),
+            cast(func.sum(tracks.c.seconds_a), BigInteger).label("seconds_a"),
+            cast(func.sum(tracks.c.seconds_b), BigInteger).label("seconds_b")
+        )
+        .join(Track, Track.id == tracks.c.track_id)
+        .group_by(Track.artist_id)
+        .subquery()
+    )
+    # New to the user: no play of the artist before a started, not merely none in b
+    earlier = (
+        select(literal(1)).select_from(Play).join(Track, Track.id == Play.track_id)
+        .where(
+            Track.artist_id == grouped.c.artist_id,
+            Play.user_id == user_id,
+            Play.created_at < datetime.combine(a.start, time())
+        )
+        .exists()
+    )
+    flagged = select(grouped, case((grouped.c.plays_a > 0, ~earlier), else_=False).label("new")).subquery()
+    plays_a, plays_b = flagged.c.plays_a, flagged.c.plays_b
+    delta = plays_a - plays_b
+    ranked = select(
+        flagged,
+        case((plays_a > 0, func.rank().over(order_by=plays_a.desc())), else_=None).label("rank_a"),
+        case((plays_b > 0, func.rank().over(order_by=plays_b.desc())), else_=None).label("rank_b"),
+        func.row_number().over(order_by=(delta.desc(), plays_a.desc())).label("rise"),
+        func.row_number().over(order_by=(delta.asc(), plays_b.desc())).label("fall"),
+        func.row_number().over(partition_by=flagged.c.new, order_by=plays_a.desc()).label("novelty"),
+        func.sum(plays_a).over().label("total_plays_a"),
+        func.sum(plays_b).over().label("total_plays_b"),
+        func.sum(flagged.c.seconds_a).over().label("total_seconds_a"),
+        func.sum(flagged.c.seconds_b).over().label("total_seconds_b"),
+        func.sum(case((plays_a > 0, 1), else_=0)).over().label("artists_a"),
+        func.sum(case((plays_b > 0, 1), else_=0)).over().label("artists_b")
+    ).subquery()
+    # Names by primary key for the few rows kept, rather than a join against every artist
+    name = select(Artist.name).where(Artist.id == ranked.c.artist_id).scalar_subquery()
+    rows = db.execute(
+        select(ranked, name.label("name"))
+        .where(or_(
+            ranked.c.rank_a <= TOP_K,
+            ranked.c.rise <= TOP_K,
+            ranked.c.fall <= TOP_K,
+            and_(ranked.c.new, ranked.c.novelty <= TOP_K)
+        ))
+    ).mappings().all()
+
+    new = {row['artist_id'] for row in rows if row['new']}
+    entries = [
+        {
+            'id': row['artist_id'],
+            'name': row['name'],
+            'plays_a': row['plays_a'],
+            'plays_b': row['plays_b'],
+            'delta': row['plays_a'] - row['plays_b'],
+            'rank_a': row['rank_a'],
+            'rank_b': row['rank_b'],
+            # Positive when the artist moved up; None when it is unranked in either period
+            'rank_change': row['rank_b'] - row['rank_a'] if row['rank_a'] and row['rank_b'] else None
+        }
+        for row in rows
+    ]
+    first = rows[0] if rows else None
+    totals_a, totals_b = _totals(a, first, "a"), _totals(b, first, "b")
+    return {
+        'a': totals_a,
+        'b': totals_b,
+        'play_delta': totals_a['total_plays'] - totals_b['total_plays'],
+        'time_delta_seconds': totals_a['total_time_seconds'] - totals_b['total_time_seconds'],
+        'top_artists': sorted(
+            (entry for entry in entries if entry['rank_a'] and entry['rank_a'] <= TOP_K),
+            key=lambda entry: (entry['rank_a'], -entry['plays_b'])
+        )[:TOP_K],
+        'risers': sorted(
+            (entry for entry in entries if entry['delta'] > 0),
+            key=lambda entry: (-entry['delta'], -entry['plays_a'])
+        )[:TOP_K],
+        'fallers': sorted(
+            (entry for entry in entries if entry['delta'] < 0),
+            key=lambda entry: (entry['delta'], -entry['plays_b'])
+        )[:TOP_K],
+        'new_artists': sorted(
+            (entry for entry in entries if entry['id'] in new),
+            key=lambda entry: -entry['plays_a']
+        )[:TOP_K]
+    }
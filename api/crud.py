@@ -1,12 +1,16 @@
 from datetime import datetime, timedelta, UTC
 from sqlalchemy.orm import Session, selectinload, joinedload
-from sqlalchemy import select
+from sqlalchemy import select, update, or_
 from passlib.hash import bcrypt
 
 from fastapi import HTTPException
 
 from models import User, Artist, Album, Track, Station, Play, Rating, generate_verification_token
 from schemas import PlayCreate
+import hll
+import aggregates
+import webhooks
+from catalog import normalize_name, display_name
 
 def create_user(db: Session, email: str, password: str) -> User:
     """Create a new user with email and password."""
@@ -71,6 +75,16 @@ def resend_verification(db: Session, user_id: int) -> User:
     db.refresh(user)
     return user
 
+def expire_verification_tokens(db: Session) -> int:
+    """Clear verification tokens past their expiry. Returns users updated."""
+    result = db.execute(
+        update(User)
+        .where(User.verification_token.is_not(None), User.verification_token_expires < datetime.now(UTC))
+        .values(verification_token=None, verification_token_expires=None)
+    )
+    db.commit()
+    return result.rowcount
+
 def get_user_by_api_key(db: Session, api_key: str) -> User | None:
     """Get a user by their API key."""
     return db.query(User).filter(User.api_key == api_key).first()
@@ -80,41 +94,54 @@ def get_user_by_email(db: Session, email: str) -> User | None:
     return db.query(User).filter(User.email == email).first()
 
 def get_or_create_artist(db: Session, name: str) -> Artist:
-    """Get an artist by name or create if not exists."""
-    artist = db.query(Artist).filter(Artist.name == name).first()
+    """Get an artist by normalized name or create if not exists."""
+    key = normalize_name(name)
+    # Exact name match covers rows the merge job has not backfilled yet
+    artist = db.query(Artist).filter(
+        or_(Artist.name_normalized == key, Artist.name == name)
+    ).order_by(Artist.id).first()
     if not artist:
-        artist = Artist(name=name)
+        artist = Artist(name=display_name(name), name_normalized=key)
         db.add(artist)
         db.flush()
+    elif artist.name_normalized is None:
+        artist.name_normalized = key
     return artist
 
 def get_or_create_album(db: Session, title: str, artist_id: int) -> Album:
-    """Get an album by title and artist or create if not exists."""
+    """Get an album by normalized title and artist or create if not exists."""
+    key = normalize_name(title)
     album = db.query(Album).filter(
-        Album.title == title,
+        or_(Album.title_normalized == key, Album.title == title),
         Album.artist_id == artist_id
-    ).first()
+    ).order_by(Album.id).first()
     if not album:
-        album = Album(title=title, artist_id=artist_id)
+        album = Album(title=title, title_normalized=key, artist_id=artist_id)
         db.add(album)
         db.flush()
+    elif album.title_normalized is None:
+        album.title_normalized = key
     return album
 
 def get_or_create_track(db: Session, title: str, artist_id: int, album_id: int) -> Track:
-    """Get a track by title, artist, and album or create if not exists."""
+    """Get a track by normalized title, artist, and album or create if not exists."""
+    key = normalize_name(title)
     track = db.query(Track).filter(
-        Track.title == title,
+        or_(Track.title_normalized == key, Track.title == title),
         Track.artist_id == artist_id,
         Track.album_id == album_id
-    ).first()
+    ).order_by(Track.id).first()
     if not track:
         track = Track(
             title=title,
+            title_normalized=key,
             artist_id=artist_id,
             album_id=album_id
         )
         db.add(track)
         db.flush()
+    elif track.title_normalized is None:
+        track.title_normalized = key
     return track
 
 def get_or_create_station(db: Session, name: str) -> Station:
@@ -126,8 +153,8 @@ def get_or_create_station(db: Session, name: str) -> Station:
         db.flush()
     return station
 
-def get_user_plays(db: Session, user_id: int, limit: int = 50, offset: int = 0) -> list[Play]:
-    """Get a user's play history with all related entities."""
+def get_user_plays(db: Session, user_id: int, limit: int = 50, offset: int = 0, criteria: tuple = ()) -> list[Play]:
+    """Get a user's play history with all related entities, optionally narrowed by extra criteria on Play."""
     return db.query(Play).join(
         Play.track
     ).join(
@@ -138,7 +165,8 @@ def get_user_plays(db: Session, user_id: int, limit: int = 50, offset: int = 0)
         selectinload(Play.track).joinedload(Track.album),
         selectinload(Play.station)
     ).filter(
-        Play.user_id == user_id
+        Play.user_id == user_id,
+        *criteria
     ).order_by(
         Play.created_at.desc()
     ).offset(offset).limit(limit).all()
@@ -297,23 +325,68 @@ def get_user_stats(db: Session, user_id: int) -> dict:
         ]
     }
 
-def create_play(db: Session, play_data: PlayCreate, user_id: int) -> Play:
-    """Create a new play record with all related entities."""
-    # Get or create related entities
+def resolve_catalog(db: Session, play_data: PlayCreate) -> tuple[Artist, Album, Track, Station]:
+    """Get or create the artist, album, track and station a play refers to."""
     artist = get_or_create_artist(db, play_data.artist)
     album = get_or_create_album(db, play_data.album, artist.id)
     track = get_or_create_track(db, play_data.title, artist.id, album.id)
     station = get_or_create_station(db, play_data.station)
+    return artist, album, track, station
 
-    # Create the play record
+def _rating(value: int | None) -> Rating:
+    return {0: Rating.UNRATED, 1: Rating.LIKE, 2: Rating.BAN, 3: Rating.TIRED}.get(value, Rating.UNRATED)
+
+def add_play(db: Session, play_data: PlayCreate, user_id: int, track_id: int, artist_id: int, station_id: int) -> Play:
+    """Add a play and its derived rows to the session without committing."""
     play = Play(
         user_id=user_id,
-        track_id=track.id,
-        station_id=station.id,
-        rating={0: Rating.UNRATED, 1: Rating.LIKE, 2: Rating.BAN, 3: Rating.TIRED}.get(play_data.rating, Rating.UNRATED),
+        track_id=track_id,
+        station_id=station_id,
+        rating=_rating(play_data.rating),
         duration=play_data.duration,
         created_at=datetime.now(UTC)
     )
     db.add(play)
+    hll.record_play(db, user_id, track_id, artist_id, play.created_at)
+    aggregates.record_play(db, user_id, play.created_at, play.duration)
+    webhooks.enqueue_play(db, play, play_data, artist_id)
+    return play
+
+def add_plays(db: Session, plays: list[tuple[int, PlayCreate, int, int, int, datetime]]) -> list[Play]:
+    """Batch ``add_play`` for (user_id, play_data, track_id, artist_id, station_id, played_at) tuples.
+
+    The plays go in one multi-row insert and each derived table gets one
+    statement for the whole batch. Caller commits."""
+    rows = [
+        Play(
+            user_id=user_id,
+            track_id=track_id,
+            station_id=station_id,
+            rating=_rating(play_data.rating),
+            duration=play_data.duration,
+            created_at=played_at
+        )
+        for user_id, play_data, track_id, _, station_id, played_at in plays
+    ]
+    db.add_all(rows)
+    db.flush()
+    hll.record_plays(db, [
+        (user_id, track_id, artist_id, played_at) for user_id, _, track_id, artist_id, _, played_at in plays
+    ])
+    aggregates.record_plays(db, [(play.user_id, play.created_at, play.duration) for play in rows])
+    webhooks.enqueue_plays(db, [(play, item[1], item[3]) for play, item in zip(rows, plays)])
+    return rows
+
+def mark_write(db: Session, user_ids) -> None:
+    """Record that the users just stored plays, so their reads skip lagging replicas. Caller commits.
+
+    The users table is on the primary, which every worker reads the current
+    user from, so the mark holds whichever client reads next."""
+    db.execute(update(User).where(User.id.in_(list(user_ids))).values(last_write_at=datetime.now(UTC)))
+
+def create_play(db: Session, play_data: PlayCreate, user_id: int) -> Play:
+    """Create a new play record with all related entities."""
+    artist, album, track, station = resolve_catalog(db, play_data)
+    play = add_play(db, play_data, user_id, track.id, artist.id, station.id)
     db.commit()
     return play
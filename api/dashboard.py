@@ -0,0 +1,79 @@
+"""``GET /api/dashboard``: recent plays, stats and now playing in one response.
+
+Each section is computed in its own thread on its own pooled session and
+written as one NDJSON line as soon as it is ready, so the client can render
+the recent plays while the stats are still being computed:
+
+    {"section": "now_playing", "data": {...} | null}
+    {"section": "plays", "data": [...]}
+    {"section": "stats", "data": {...}}
+
+A section that fails is sent as ``{"section": ..., "error": {"status", "detail"}}``
+and the others still arrive. Lines come in completion order.
+"""
+import asyncio
+from datetime import datetime, timedelta, UTC
+import json
+import threading
+import traceback
+
+from fastapi import HTTPException
+from pydantic import TypeAdapter
+from sqlalchemy.orm import Session
+
+import columnar
+import crud
+import sharding
+from schemas import PlayResponse, StatsResponse
+
+NOW_PLAYING_WINDOW = timedelta(minutes=10)  # plays are recorded when a song ends; older means nothing is on
+
+_plays = TypeAdapter(list[PlayResponse])
+
+def recent_plays(db: Session, user_id: int, limit: int) -> list:
+    return _plays.dump_python(crud.get_user_plays(db, user_id, limit), mode="json")
+
+def now_playing(db: Session, user_id: int) -> dict | None:
+    """The latest play, if it was recorded recently enough that the listener is still playing."""
+    latest = crud.get_user_plays(db, user_id, 1)
+    if not latest or latest[0].created_at.replace(tzinfo=UTC) < datetime.now(UTC) - NOW_PLAYING_WINDOW:
+        return None
+    return PlayResponse.model_validate(latest[0]).model_dump(mode="json")
+
+def stats(db: Session, user_id: int) -> dict:
+    return StatsResponse.model_validate(columnar.user_stats(db, user_id)).model_dump(mode="json")
+
+def _section(name: str, fn, user_id: int, written_at: datetime | None, cancelled: threading.Event, *args) -> str:
+    """One NDJSON line, computed on a session of its own. Empty if the stream was cancelled before it started."""
+    if cancelled.is_set():
+        return ""
+    db = sharding.user_read_session(user_id, written_at)
+    try:
+        line = {'section': name, 'data': fn(db, user_id, *args)}
+    except HTTPException as e:
+        line = {'section': name, 'error': {'status': e.status_code, 'detail': e.detail}}
+    except Exception:
+        traceback.print_exc()
+        line = {'section': name, 'error': {'status': 500, 'detail': "Internal Server Error"}}
+    finally:
+        db.close()
+    return json.dumps(line, separators=(",", ":")) + "\n"
+
+async def stream(user_id: int, written_at: datetime | None, limit: int = 50):
+    """Yield each section's line as it finishes."""
+    cancelled = threading.Event()
+    tasks = [
+        asyncio.create_task(asyncio.to_thread(_section, "now_playing", now_playing, user_id, written_at, cancelled)),
+        asyncio.create_task(asyncio.to_thread(_section, "plays", recent_plays, user_id, written_at, cancelled, limit)),
+        asyncio.create_task(asyncio.to_thread(_section, "stats", stats, user_id, written_at, cancelled)),
+    ]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        # A client that disconnects early doesn't wait for the rest. Cancelling a task only stops the
+        # waiting: a section already running keeps its thread and pooled session until its query
+        # returns. Sections still queued for a thread see the flag and skip their queries.
+        cancelled.set()
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,93 @@
+"""Drill-downs into one artist, album, track or station of a user's history.
+
+``GET /{kind}s/{id}/plays`` pages through the user's plays of one catalog item
+and ``GET /{kind}s/{id}/stats`` summarizes them: totals, first and last play and
+top tracks. Both read only that item's plays, through composite indexes led by
+the user:
+
+- ``idx_plays_user_track_created_at`` (user_id, track_id, created_at) INCLUDE
+  (duration). A track is one range scan, already in play order. An artist or
+  album is one range scan per track of theirs, found through
+  ``idx_tracks_artist_album_title_normalized`` or ``idx_tracks_album_id``.
+- ``idx_plays_user_station_created_at`` (user_id, station_id, created_at)
+  INCLUDE (track_id, duration) for stations.
+
+The included columns let Postgres answer the stats with index-only scans.
+"""
+from fastapi import HTTPException
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+import crud
+from models import Artist, Album, Track, Station, Play
+
+KINDS = {"artist": Artist.name, "album": Album.title, "track": Track.title, "station": Station.name}
+TOP_K = 10
+
+def _criteria(kind: str, item_id: int) -> tuple:
+    """Conditions on Play selecting the plays of one catalog item."""
+    if kind == "track":
+        return (Play.track_id == item_id,)
+    if kind == "station":
+        return (Play.station_id == item_id,)
+    column = Track.artist_id if kind == "artist" else Track.album_id
+    return (Play.track_id.in_(select(Track.id).where(column == item_id)),)
+
+def plays(db: Session, user_id: int, kind: str, item_id: int, limit: int = 50, offset: int = 0) -> list[Play]:
+    """The user's plays of one item, newest first."""
+    return crud.get_user_plays(db, user_id, limit, offset, _criteria(kind, item_id))
+
+def stats(db: Session, user_id: int, kind: str, item_id: int) -> dict:
+    """Totals, first and last play and top tracks for the user's plays of one item."""
+    name_column = KINDS[kind]
+    name = db.scalar(select(name_column).where(name_column.class_.id == item_id))
+    if name is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"{kind.capitalize()} not found"
+        )
+
+    criteria = _criteria(kind, item_id)
+    total_plays, unique_tracks, total_time, first_play, last_play = db.execute(
+        select(
+            func.count(),
+            func.count(Play.track_id.distinct()),
+            func.coalesce(func.sum(Play.duration), 0),
+            func.min(Play.created_at),
+            func.max(Play.created_at)
+        ).where(Play.user_id == user_id, *criteria)
+    ).one()
+    if not total_plays:
+        raise HTTPException(
+            status_code=404,
+            detail="No plays found"
+        )
+
+    # Rank on the index alone, then look up titles for the top tracks only
+    play_count, last_played = func.count().label("play_count"), func.max(Play.created_at).label("last_played")
+    top = (
+        select(Play.track_id, play_count, last_played)
+        .where(Play.user_id == user_id, *criteria)
+        .group_by(Play.track_id)
+        .order_by(play_count.desc(), last_played.desc())
+        .limit(TOP_K)
+        .subquery()
+    )
+    rows = db.execute(
+        select(Track.id, Track.title, top.c.play_count, top.c.last_played)
+        .join(top, top.c.track_id == Track.id)
+        .order_by(top.c.play_count.desc(), top.c.last_played.desc())
+    )
+    return {
+        'id': item_id,
+        'name': name,
+        'total_plays': total_plays,
+        'unique_tracks': unique_tracks,
+        'total_time_seconds': total_time,
+        'first_play': first_play,
+        'last_play': last_play,
+        'top_tracks': [
+            {'id': track_id, 'name': title, 'play_count': count, 'last_played': played}
+            for track_id, title, count, played in rows
+        ]
+    }
@@ -0,0 +1,338 @@
+"""MusicBrainz enrichment worker.
+
+Unvalidated artists, albums and tracks are queued in ``enrichment_jobs`` and
+claimed with ``FOR UPDATE SKIP LOCKED``, so any number of workers can share
+the queue. Lookups fill ``mbid``, ``Track.duration`` and
+``Album.cover_art_url`` and stamp ``validated``:
+
+- a track lookup also resolves its artist and album, whose own jobs then
+  finish without another call;
+- artist jobs are batched into a single OR-query per claim;
+- every response is kept in an on-disk cache, so re-runs cost nothing.
+
+All calls, from every worker, go through one limiter honouring MusicBrainz's
+1 request/second rule: each call reserves the next free slot in a
+``rate_limit_slots`` row. Point ``MUSICBRAINZ_HOST`` (and ``MUSICBRAINZ_HTTPS=false``) at a local
+fake server for tests, such as ``tests/fake_musicbrainz.py``.
+
+    python enrichment.py enqueue
+    python enrichment.py work [--once]
+"""
+import argparse
+from datetime import datetime, timedelta, UTC
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import musicbrainzngs
+from sqlalchemy import select, update, literal, case
+from sqlalchemy.orm import Session
+
+from catalog import normalize_name
+from database import insert
+from models import Artist, Album, Track, EnrichmentJob, RateLimitSlot
+
+MUSICBRAINZ_HOST = os.getenv("MUSICBRAINZ_HOST", "musicbrainz.org")
+MUSICBRAINZ_HTTPS = os.getenv("MUSICBRAINZ_HTTPS", "true").lower() == "true"
+MUSICBRAINZ_RATE = float(os.getenv("MUSICBRAINZ_RATE", "1.0"))  # requests per second
+CACHE_DIR = os.getenv("MUSICBRAINZ_CACHE_DIR", os.path.join(os.path.dirname(__file__), ".cache", "musicbrainz"))
+COVER_ART_URL = os.getenv("COVER_ART_URL", "https://coverartarchive.org")
+
+MIN_SCORE = 90  # MusicBrainz search score (0-100) required to accept a match
+MAX_ATTEMPTS = 5
+STALE_AFTER = timedelta(minutes=10)  # running jobs older than this were abandoned by a dead worker
+KIND_ORDER = {"track": 0, "album": 1, "artist": 2}  # tracks first: they resolve the other two
+RATE_LIMIT_NAME = "musicbrainz"
+
+class RateLimiter:
+    """Spaces calls at least 1/rate seconds apart across threads."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if now < self._next:
+                time.sleep(self._next - now)
+            self._next = max(now, self._next) + self.interval
+
+class SharedRateLimiter:
+    """Spaces calls at least 1/rate seconds apart across every worker sharing a database.
+
+    Each call reserves the next free slot with one UPDATE on the limit's row
+    and sleeps until it, so no lock is held while waiting. Slots are in Unix
+    time, so workers' clocks should be roughly in sync.
+    """
+
+    def __init__(self, session_factory, name: str, rate: float):
+        self.session_factory = session_factory
+        self.name = name
+        self.interval = 1.0 / rate
+
+    def _reserve(self, db: Session) -> float | None:
+        now = time.time()
+        next_at = db.scalar(
+            update(RateLimitSlot).where(RateLimitSlot.name == self.name)
+            .values(next_at=case((RateLimitSlot.next_at > now, RateLimitSlot.next_at), else_=now) + self.interval)
+            .returning(RateLimitSlot.next_at)
+        )
+        return None if next_at is None else next_at - self.interval
+
+    def wait(self) -> None:
+        db = self.session_factory()
+        try:
+            slot = self._reserve(db)
+            if slot is None:
+                db.execute(insert(RateLimitSlot).values(name=self.name, next_at=0.0).on_conflict_do_nothing())
+                slot = self._reserve(db)
+            db.commit()
+        finally:
+            db.close()
+        delay = slot - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+class ResponseCache:
+    """JSON responses on disk, keyed by a hash of the request."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _path(self, key: str) -> str:
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], f"{digest}.json")
+
+    def get(self, key: str) -> dict | None:
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def put(self, key: str, value: dict) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "w") as f:
+            json.dump(value, f)
+        os.replace(tmp, path)
+
+class MusicBrainzClient:
+    """musicbrainzngs behind the response cache and the shared rate limiter."""
+
+    def __init__(self, cache: ResponseCache, limiter: RateLimiter | SharedRateLimiter, host: str = MUSICBRAINZ_HOST,
+                 https: bool = MUSICBRAINZ_HTTPS):
+        self.cache = cache
+        self.limiter = limiter
+        self.calls = 0
+        musicbrainzngs.set_useragent("track.haus", "0.1", "https://github.com/michaelseiter/track.haus")
+        musicbrainzngs.set_hostname(host, use_https=https)
+        # We do our own limiting so cache hits don't wait for a slot
+        musicbrainzngs.set_rate_limit(False)
+
+    def search(self, entity: str, **params) -> dict:
+        key = json.dumps([entity, params], sort_keys=True)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        self.limiter.wait()
+        self.calls += 1
+        result = getattr(musicbrainzngs, f"search_{entity}")(**params)
+        self.cache.put(key, result)
+        return result
+
+def _quote(value: str) -> str:
+    """Quote a value as a Lucene phrase."""
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+def _best(results: list[dict]) -> dict | None:
+    matches = [r for r in results if int(r.get("ext:score", 0)) >= MIN_SCORE]
+    return max(matches, key=lambda r: int(r["ext:score"]), default=None)
+
+def _claim_mbid(db: Session, row, mbid: str | None) -> None:
+    """Set mbid unless another row already owns it (left for the merge job)."""
+    if not mbid or row.mbid:
+        return
+    model = type(row)
+    if db.scalar(select(model.id).where(model.mbid == mbid, model.id != row.id)) is None:
+        row.mbid = mbid
+
+def _cover_art(album: Album) -> None:
+    if album.mbid and not album.cover_art_url:
+        album.cover_art_url = f"{COVER_ART_URL}/release/{album.mbid}/front-500"
+
+def enqueue_unvalidated(db: Session) -> int:
+    """Queue every artist, album and track that was never validated. Returns jobs added."""
+    added = 0
+    now = datetime.now(UTC)
+    for kind, model in (("track", Track), ("album", Album), ("artist", Artist)):
+        result = db.execute(
+            insert(EnrichmentJob).from_select(
+                ["kind", "entity_id", "status", "attempts", "run_after", "created_at", "updated_at"],
+                select(literal(kind), model.id, literal("pending"), literal(0), literal(now), literal(now), literal(now))
+                .where(model.validated.is_(None))
+            ).on_conflict_do_nothing(index_elements=["kind", "entity_id"])
+        )
+        added += result.rowcount
+    db.commit()
+    return added
+
+def claim_jobs(db: Session, limit: int = 25) -> list[EnrichmentJob]:
+    """Claim pending jobs, skipping rows other workers hold locks on."""
+    now = datetime.now(UTC)
+    db.execute(
+        update(EnrichmentJob)
+        .where(EnrichmentJob.status == "running", EnrichmentJob.locked_at < now - STALE_AFTER)
+        .values(status="pending")
+        # locked_at is stored naive, so the session can't evaluate this against loaded jobs
+        .execution_options(synchronize_session=False)
+    )
+    jobs = db.scalars(
+        select(EnrichmentJob)
+        .where(EnrichmentJob.status == "pending", EnrichmentJob.run_after <= now)
+        .order_by(EnrichmentJob.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    ).all()
+    for job in jobs:
+        job.status = "running"
+        job.locked_at = now
+        job.attempts += 1
+    db.commit()
+    return sorted(jobs, key=lambda job: (KIND_ORDER[job.kind], job.id))
+
+def enrich_track(db: Session, client: MusicBrainzClient, track: Track) -> None:
+    result = client.search(
+        "recordings",
+        recording=track.title,
+        artist=track.artist.name,
+        release=track.album.title,
+        limit=5
+    )
+    now = datetime.now(UTC)
+    match = _best(result.get("recording-list", []))
+    if match:
+        _claim_mbid(db, track, match["id"])
+        if not track.duration and match.get("length"):
+            track.duration = int(match["length"]) // 1000
+        credits = [c for c in match.get("artist-credit", []) if isinstance(c, dict)]
+        if credits and not track.artist.validated:
+            _claim_mbid(db, track.artist, credits[0]["artist"]["id"])
+            track.artist.validated = now
+        releases = match.get("release-list", [])
+        if releases and not track.album.validated:
+            _claim_mbid(db, track.album, releases[0]["id"])
+            _cover_art(track.album)
+            track.album.validated = now
+    track.validated = now
+
+def enrich_album(db: Session, client: MusicBrainzClient, album: Album) -> None:
+    result = client.search("releases", release=album.title, artist=album.artist.name, limit=5)
+    match = _best(result.get("release-list", []))
+    if match:
+        _claim_mbid(db, album, match["id"])
+        _cover_art(album)
+    album.validated = datetime.now(UTC)
+
+def enrich_artists(db: Session, client: MusicBrainzClient, artists: list[Artist]) -> None:
+    """Resolve several artists with one OR-query."""
+    query = " OR ".join(f"artist:{_quote(artist.name)}" for artist in artists)
+    result = client.search("artists", query=query, limit=100)
+    best: dict[str, dict] = {}
+    for candidate in result.get("artist-list", []):
+        key = normalize_name(candidate["name"])
+        if int(candidate.get("ext:score", 0)) >= MIN_SCORE and key not in best:
+            best[key] = candidate
+    now = datetime.now(UTC)
+    for artist in artists:
+        match = best.get(normalize_name(artist.name))
+        if match:
+            _claim_mbid(db, artist, match["id"])
+        artist.validated = now
+
+def process_jobs(db: Session, client: MusicBrainzClient, jobs: list[EnrichmentJob]) -> None:
+    models = {"track": Track, "album": Album, "artist": Artist}
+    pending_artists: list[tuple[EnrichmentJob, Artist]] = []
+    for job in jobs:
+        entity = db.get(models[job.kind], job.entity_id)
+        try:
+            # Entities deleted by a merge or resolved by an earlier track lookup need no call
+            if entity is not None and not entity.validated:
+                if job.kind == "artist":
+                    pending_artists.append((job, entity))
+                    continue
+                elif job.kind == "track":
+                    enrich_track(db, client, entity)
+                else:
+                    enrich_album(db, client, entity)
+            job.status = "done"
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            _retry_later(db, job, e)
+
+    if pending_artists:
+        try:
+            enrich_artists(db, client, [artist for _, artist in pending_artists])
+            for job, _ in pending_artists:
+                job.status = "done"
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            for job, _ in pending_artists:
+                _retry_later(db, job, e)
+
+def _retry_later(db: Session, job: EnrichmentJob, error: Exception) -> None:
+    job = db.merge(job)
+    job.last_error = str(error)[:500]
+    if job.attempts >= MAX_ATTEMPTS:
+        job.status = "failed"
+    else:
+        job.status = "pending"
+        job.run_after = datetime.now(UTC) + timedelta(minutes=2 ** job.attempts)
+    db.commit()
+
+def run_worker(session_factory, batch_size: int = 25, idle_sleep: float = 30.0, once: bool = False) -> None:
+    client = MusicBrainzClient(
+        ResponseCache(CACHE_DIR), SharedRateLimiter(session_factory, RATE_LIMIT_NAME, MUSICBRAINZ_RATE)
+    )
+    while True:
+        db = session_factory()
+        try:
+            jobs = claim_jobs(db, batch_size)
+            if not jobs:
+                enqueue_unvalidated(db)
+                jobs = claim_jobs(db, batch_size)
+            if jobs:
+                process_jobs(db, client, jobs)
+                print(f"Processed {len(jobs)} enrichment jobs ({client.calls} MusicBrainz calls so far)")
+        finally:
+            db.close()
+        if once and not jobs:
+            return
+        if not jobs:
+            time.sleep(idle_sleep)
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="MusicBrainz enrichment worker")
+    parser.add_argument("command", choices=["enqueue", "work"])
+    parser.add_argument("--batch-size", type=int, default=25)
+    parser.add_argument("--once", action="store_true", help="exit when the queue is empty")
+    args = parser.parse_args()
+
+    if args.command == "enqueue":
+        db = SessionLocal()
+        try:
+            print(f"Queued {enqueue_unvalidated(db)} enrichment jobs")
+        finally:
+            db.close()
+    else:
+        run_worker(SessionLocal, args.batch_size, once=args.once)
@@ -0,0 +1,399 @@
+"""Write-behind ingest: acknowledge plays once they are safe on local disk.
+
+With ``INGEST_WRITE_BEHIND=true``, ``POST /track/play`` validates the play,
+appends it to an append-only log and answers 202 as soon as the log is
+fsynced, without touching the catalog. Appends that arrive while an fsync is
+running share the next one, so a burst costs one fsync rather than one per
+play.
+
+A drainer thread in the same process reads the durable records in order and
+writes them in batches through ``sharding.create_plays``: each catalog entry
+is resolved once per batch and the plays go in one multi-row insert. The
+last sequence number written is stored in ``job_watermarks`` in the same
+transaction as the plays, so after a crash the log is replayed from there and
+nothing is written twice. Fully written segments are deleted. With replicas,
+each batch also marks its users as having just written (``users.last_write_at``),
+so their reads go to the primary once the plays are stored.
+
+Every worker process writes its own log: it takes an ``flock`` on the first
+free ``slot-N`` directory under ``INGEST_LOG_DIR``. Slots left behind when
+workers are scaled down are drained with ``python ingest_log.py drain``.
+
+``ingest_log_pending`` and ``ingest_log_lag_seconds`` show how far the
+database is behind the log.
+"""
+import argparse
+import asyncio
+from datetime import datetime, UTC
+import fcntl
+import json
+import os
+import secrets
+import threading
+import zlib
+
+from sqlalchemy import select
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.orm import Session
+
+import metrics
+import sharding
+from crud import mark_write
+from database import SessionLocal, insert, replica_sessions
+from models import JobWatermark
+from schemas import PlayCreate
+
+WRITE_BEHIND = os.getenv("INGEST_WRITE_BEHIND", "false").lower() == "true"
+INGEST_LOG_DIR = os.getenv("INGEST_LOG_DIR", os.path.join(os.path.dirname(__file__), ".ingest"))
+SEGMENT_BYTES = 64 * 1024 * 1024
+DRAIN_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "1000"))
+DRAIN_INTERVAL = float(os.getenv("INGEST_DRAIN_INTERVAL", "0.2"))  # seconds to let a batch build up
+RETRY_INTERVAL = 5.0  # seconds between attempts while the database is unavailable
+MAX_SLOTS = 64
+
+def _encode(record: dict) -> bytes:
+    body = json.dumps(record, separators=(",", ":")).encode()
+    return b"%08x %s\n" % (zlib.crc32(body), body)
+
+def _decode(line: bytes) -> dict | None:
+    """The record on a complete line, or None if the line is torn or corrupt."""
+    if not line.endswith(b"\n"):
+        return None
+    checksum, _, body = line[:-1].partition(b" ")
+    try:
+        if int(checksum, 16) != zlib.crc32(body):
+            return None
+        return json.loads(body)
+    except ValueError:
+        return None
+
+def _log_id(base_dir: str) -> str:
+    """A random id for this log directory, so watermarks never match another directory's records."""
+    path = os.path.join(base_dir, "ID")
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        log_id = secrets.token_hex(8)
+        with open(path, "x") as f:
+            f.write(log_id)
+        return log_id
+
+class IngestLog:
+    """Segmented append-only log of plays in one slot directory.
+
+    Segments are named after their first sequence number. Each line is a
+    CRC32 and a JSON record, so a write torn by a crash is detected and cut
+    off on open.
+    """
+
+    def __init__(self, directory: str, name: str, lock_fd: int, segment_bytes: int = SEGMENT_BYTES):
+        self.directory = directory
+        self.name = name  # job_watermarks key
+        self.segment_bytes = segment_bytes
+        self._lock_fd = lock_fd
+        self._fd: int | None = None
+        self._segment_size = 0
+        self._cursor: tuple[str, int, int] | None = None  # (segment, offset, sequence read up to)
+        self._pending: list[tuple[int, bytes, asyncio.Future]] = []
+        self._flush_task: asyncio.Task | None = None
+        self.durable = threading.Condition()  # notified when durable_seq advances
+        self.durable_seq = self._recover()
+        self.next_seq = self.durable_seq + 1
+
+    def segments(self) -> list[tuple[int, str]]:
+        """(first sequence number, path) of each segment, oldest first."""
+        return sorted(
+            (int(name[:-4]), os.path.join(self.directory, name))
+            for name in os.listdir(self.directory) if name.endswith(".log")
+        )
+
+    def _recover(self) -> int:
+        """Cut off a torn tail left by a crash. Returns the last sequence number on disk."""
+        segments = self.segments()
+        if not segments:
+            return 0
+        first, path = segments[-1]
+        last, offset = first - 1, 0
+        with open(path, "rb") as f:
+            for line in f:
+                record = _decode(line)
+                if record is None:
+                    break
+                last, offset = record["seq"], offset + len(line)
+        if offset < os.path.getsize(path):
+            print(f"Truncating torn ingest log tail in {path} at byte {offset}")
+            os.truncate(path, offset)
+        return last
+
+    async def append(self, record: dict) -> int:
+        """Add a record and wait until it is on disk. Returns its sequence number."""
+        seq = self.next_seq
+        self.next_seq += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((seq, _encode({**record, 'seq': seq}), future))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush())
+        await future
+        return seq
+
+    async def _flush(self) -> None:
+        # Everything appended while one fsync runs goes out with the next
+        while self._pending:
+            batch, self._pending = self._pending, []
+            try:
+                await asyncio.to_thread(self._write, batch[0][0], b"".join(line for _, line, _ in batch))
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            with self.durable:
+                self.durable_seq = batch[-1][0]
+                self.durable.notify_all()
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_result(None)
+
+    def _write(self, first_seq: int, data: bytes) -> None:
+        if self._fd is None or self._segment_size >= self.segment_bytes:
+            self._open_segment(first_seq)
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(self._fd, view):]
+            os.fsync(self._fd)
+        except OSError:
+            # Don't leave a partial record in front of the next append
+            os.ftruncate(self._fd, self._segment_size)
+            raise
+        self._segment_size += len(data)
+
+    def _open_segment(self, first_seq: int) -> None:
+        segments = self.segments()
+        if self._fd is None and segments and os.path.getsize(segments[-1][1]) < self.segment_bytes:
+            path = segments[-1][1]  # continue the segment from before a restart
+        else:
+            path = os.path.join(self.directory, f"{first_seq:020d}.log")
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._segment_size = os.path.getsize(path)
+        directory = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory)  # make the new file's directory entry durable too
+        finally:
+            os.close(directory)
+
+    def read(self, after_seq: int, limit: int) -> list[dict]:
+        """Up to limit durable records with sequence numbers above after_seq, in order."""
+        records = []
+        segments = self.segments()
+        for i, (_, path) in enumerate(segments):
+            if i + 1 < len(segments) and segments[i + 1][0] <= after_seq + 1:
+                continue
+            resume = self._cursor and self._cursor[0] == path and self._cursor[2] == after_seq
+            offset = self._cursor[1] if resume else 0
+            with open(path, "rb") as f:
+                f.seek(offset)
+                for line in f:
+                    record = _decode(line)
+                    if record is None or record["seq"] > self.durable_seq:
+                        return records
+                    offset += len(line)
+                    if record["seq"] <= after_seq:
+                        continue
+                    records.append(record)
+                    self._cursor = (path, offset, record["seq"])
+                    if len(records) >= limit:
+                        return records
+        return records
+
+    def drop_segments(self, upto_seq: int) -> None:
+        """Delete segments whose records are all at or below upto_seq, except the one being written."""
+        segments = self.segments()
+        for (_, path), (next_first, _) in zip(segments, segments[1:]):
+            if next_first <= upto_seq + 1:
+                os.remove(path)
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        os.close(self._lock_fd)  # releases the slot
+
+def open_slot(base_dir: str = INGEST_LOG_DIR) -> IngestLog | None:
+    """Lock the first free slot under base_dir and open its log, or None if all are taken."""
+    os.makedirs(base_dir, exist_ok=True)
+    log_id = _log_id(base_dir)
+    for n in range(MAX_SLOTS):
+        directory = os.path.join(base_dir, f"slot-{n}")
+        os.makedirs(directory, exist_ok=True)
+        lock_fd = os.open(os.path.join(directory, "LOCK"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(lock_fd)
+            continue
+        return IngestLog(directory, f"ingest_log:{log_id}/slot-{n}", lock_fd)
+    return None
+
+def _checkpoint(name: str, records: list[dict], skip: bool = False):
+    """``before_write`` for ``sharding.create_plays``: drop records a database already has
+    and advance its watermark past the rest in the same transaction."""
+
+    def before_write(db: Session, indexes: list[int]) -> list[int]:
+        written = db.scalar(select(JobWatermark.last_id).where(JobWatermark.name == name).with_for_update()) or 0
+        keep = [] if skip else [i for i in indexes if records[i]["seq"] > written]
+        last = max(records[i]["seq"] for i in indexes)
+        if last > written:
+            db.execute(
+                insert(JobWatermark).values(name=name, last_id=last, updated_at=datetime.now(UTC))
+                .on_conflict_do_update(index_elements=[JobWatermark.name], set_={'last_id': last, 'updated_at': datetime.now(UTC)})
+            )
+        return keep
+
+    return before_write
+
+def write_batch(name: str, records: list[dict], skip: bool = False) -> int:
+    """Write log records to the database(s) exactly once. Returns plays written."""
+    plays = [
+        (record["user_id"], PlayCreate(**record["play"]), datetime.fromisoformat(record["played_at"]))
+        for record in records
+    ]
+    db = SessionLocal()
+    try:
+        if replica_sessions and not skip:
+            # Committed with the plays on one database, or with the directory just before the shards
+            mark_write(db, {record["user_id"] for record in records})
+        return sharding.create_plays(db, plays, _checkpoint(name, records, skip))
+    finally:
+        db.close()
+
+class Drainer(threading.Thread):
+    """Writes a log's durable records to the database in order, in batches."""
+
+    def __init__(self, log: IngestLog, batch_size: int = DRAIN_BATCH_SIZE, interval: float = DRAIN_INTERVAL):
+        super().__init__(name="ingest-drainer", daemon=True)
+        self.log = log
+        self.batch_size = batch_size
+        self.interval = interval
+        segments = log.segments()
+        self.drained_seq = segments[0][0] - 1 if segments else log.durable_seq
+        self._stopping = threading.Event()
+
+    def drain_available(self) -> int:
+        """Write everything durable so far. Returns plays written; database errors propagate."""
+        written = 0
+        while records := self.log.read(self.drained_seq, self.batch_size):
+            self._report(records[0])
+            written += self._write(records)
+            self.drained_seq = records[-1]["seq"]
+            self.log.drop_segments(self.drained_seq)
+        self._report(None)
+        return written
+
+    def _write(self, records: list[dict]) -> int:
+        try:
+            written = write_batch(self.log.name, records)
+        except (IntegrityError, DataError):
+            # A record the database refuses (say, its user was deleted) must not block the rest
+            written = 0
+            for record in records:
+                try:
+                    written += write_batch(self.log.name, [record])
+                except (IntegrityError, DataError) as e:
+                    self._reject(record, e)
+        metrics.PLAYS_INGESTED.inc(written)
+        return written
+
+    def _reject(self, record: dict, error: Exception) -> None:
+        print(f"Rejecting ingest log record {record['seq']}: {error}")
+        with open(os.path.join(self.log.directory, "rejected.jsonl"), "a") as f:
+            f.write(json.dumps({**record, 'error': str(error)[:500]}) + "\n")
+        write_batch(self.log.name, [record], skip=True)
+
+    def _report(self, oldest: dict | None) -> None:
+        metrics.INGEST_LOG_PENDING.set(max(self.log.durable_seq - self.drained_seq, 0))
+        lag = (datetime.now(UTC) - datetime.fromisoformat(oldest["played_at"])).total_seconds() if oldest else 0
+        metrics.INGEST_LOG_LAG.set(lag)
+
+    def run(self) -> None:
+        while True:
+            try:
+                self.drain_available()
+            except Exception as e:
+                print(f"Ingest log drain failed, retrying in {RETRY_INTERVAL:g}s: {e}")
+                if self._stopping.wait(RETRY_INTERVAL):
+                    return
+                continue
+            if self._stopping.is_set():
+                return
+            with self.log.durable:
+                if self.log.durable_seq <= self.drained_seq:
+                    self.log.durable.wait(1.0)
+            # Let a few more plays arrive so they share the batch
+            self._stopping.wait(self.interval)
+
+    def stop(self, timeout: float | None = None) -> None:
+        """Finish writing what is durable, then stop."""
+        self._stopping.set()
+        with self.log.durable:
+            self.log.durable.notify_all()
+        self.join(timeout)
+
+log: IngestLog | None = None
+drainer: Drainer | None = None
+
+def _written_seq(name: str) -> int:
+    """The highest watermark any database holds for a log."""
+    return max(sharding.scatter(
+        lambda db: db.scalar(select(JobWatermark.last_id).where(JobWatermark.name == name)) or 0,
+        read_only=False
+    ))
+
+def start() -> None:
+    """Claim a log slot for this process and start draining it (replaying anything left from a crash)."""
+    global log, drainer
+    log = open_slot()
+    if log is None:
+        print(f"Warning: all {MAX_SLOTS} ingest log slots are taken; writing plays directly")
+        return
+    # A log directory that was wiped starts over at 1, behind the watermarks
+    log.durable_seq = max(log.durable_seq, _written_seq(log.name))
+    log.next_seq = log.durable_seq + 1
+    drainer = Drainer(log)
+    drainer.start()
+
+def stop(timeout: float = 30.0) -> None:
+    global log, drainer
+    if drainer:
+        drainer.stop(timeout)
+    if log:
+        log.close()
+    log = drainer = None
+
+async def append(user_id: int, play_data: PlayCreate) -> int:
+    """Log a play for the drainer. Returns its sequence number once durable."""
+    return await log.append({
+        'user_id': user_id,
+        'played_at': datetime.now(UTC).isoformat(),
+        'play': play_data.model_dump()
+    })
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write-behind ingest log")
+    parser.add_argument("command", choices=["drain"], help="write out every slot no process holds, then exit")
+    parser.add_argument("--dir", default=INGEST_LOG_DIR)
+    args = parser.parse_args()
+
+    total = 0
+    claimed = []
+    while (slot := open_slot(args.dir)) is not None:
+        claimed.append(slot)
+        written = Drainer(slot).drain_available()
+        print(f"{os.path.basename(slot.directory)}: wrote {written} plays")
+        total += written
+    for slot in claimed:
+        slot.close()
+    print(f"Wrote {total} plays")
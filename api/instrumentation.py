@@ -0,0 +1,154 @@
+"""Per-request SQL instrumentation.
+
+Engine events count every statement a request runs, with the total database
+time and the slowest statement. ``QueryStatsMiddleware`` reports them as a
+``Server-Timing`` header and one JSON log line per request, and warns when
+the same statement runs over and over (the usual N+1 shape).
+
+Endpoints declare how many statements they may issue with ``@query_budget``.
+With ``QUERY_BUDGET_ENFORCE=true`` (set it in tests) exceeding the budget
+raises ``QueryBudgetExceeded`` once the endpoint has finished without an
+error of its own; otherwise it is only logged. The response has been sent
+by then, so the error reaches the server (or the test client), not the
+caller.
+"""
+from collections import Counter
+from contextvars import ContextVar
+import json
+import logging
+import os
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+ENFORCE_BUDGETS = os.getenv("QUERY_BUDGET_ENFORCE", "false").lower() == "true"
+REPEAT_THRESHOLD = int(os.getenv("QUERY_REPEAT_THRESHOLD", "5"))  # same statement this often => likely N+1
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "500"))
+
+logger = logging.getLogger("trackhaus.requests")
+if not logger.handlers:
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(os.getenv("REQUEST_LOG_LEVEL", "INFO"))
+    logger.propagate = False
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+class QueryStats:
+    """Statements executed on behalf of one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.db_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement: str | None = None
+        self.statements: Counter[str] = Counter()
+
+    def record(self, statement: str, elapsed: float) -> None:
+        self.count += 1
+        self.db_time += elapsed
+        self.statements[statement] += 1
+        if elapsed > self.slowest_time:
+            self.slowest_time = elapsed
+            self.slowest_statement = statement
+
+    def repeated(self, threshold: int = REPEAT_THRESHOLD) -> list[tuple[str, int]]:
+        return [(statement, n) for statement, n in self.statements.most_common() if n >= threshold]
+
+_current: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+def current_stats() -> QueryStats | None:
+    return _current.get()
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats = _current.get()
+    if stats is not None:
+        stats.record(statement, elapsed)
+
+def install(engine: Engine) -> None:
+    """Attach the timing hooks to an engine (idempotent)."""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+def query_budget(limit: int):
+    """Declare the most statements an endpoint may issue per request."""
+    def decorate(endpoint):
+        endpoint.query_budget = limit
+        return endpoint
+    return decorate
+
+def _shorten(statement: str | None, length: int = 200) -> str | None:
+    return " ".join(statement.split())[:length] if statement else None
+
+class QueryStatsMiddleware:
+    """Collects ``QueryStats`` for each HTTP request and reports them."""
+
+    def __init__(self, app, enforce_budgets: bool = ENFORCE_BUDGETS):
+        self.app = app
+        self.enforce_budgets = enforce_budgets
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = QueryStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                total_ms = (time.perf_counter() - started) * 1000
+                timing = (f'db;dur={stats.db_time * 1000:.1f};desc="{stats.count} queries", '
+                          f'app;dur={total_ms:.1f}')
+                message.setdefault("headers", []).append((b"server-timing", timing.encode()))
+            await send(message)
+
+        completed = False
+        try:
+            await self.app(scope, receive, send_with_timing)
+            completed = True
+        finally:
+            _current.reset(token)
+            # Never mask the endpoint's own exception with a budget error
+            self._report(scope, stats, status, time.perf_counter() - started, enforce=completed)
+
+    def _report(self, scope, stats: QueryStats, status: int, elapsed: float, enforce: bool = True) -> None:
+        route = scope.get("route")
+        endpoint = scope.get("endpoint")
+        budget = getattr(endpoint, "query_budget", None)
+        repeated = stats.repeated()
+        record = {
+            "method": scope["method"],
+            "path": scope["path"],
+            "route": getattr(route, "path", None),
+            "status": status,
+            "duration_ms": round(elapsed * 1000, 2),
+            "queries": stats.count,
+            "db_ms": round(stats.db_time * 1000, 2),
+            "slowest_query_ms": round(stats.slowest_time * 1000, 2),
+            "slowest_query": _shorten(stats.slowest_statement),
+        }
+        over_budget = budget is not None and stats.count > budget
+        if over_budget:
+            record["query_budget"] = budget
+        if repeated:
+            record["repeated_queries"] = [{"query": _shorten(s), "count": n} for s, n in repeated]
+
+        slow = elapsed * 1000 >= SLOW_REQUEST_MS
+        logger.log(logging.WARNING if over_budget or repeated or slow else logging.INFO, json.dumps(record))
+
+        if over_budget and enforce and self.enforce_budgets:
+            raise QueryBudgetExceeded(
+                f"{scope['method']} {record['route']} ran {stats.count} queries, budget is {budget}"
+            )
@@ -0,0 +1,92 @@
+"""Replay a request trace written by ``seed.py --trace`` against a running API.
+
+    python loadgen.py trace.jsonl --base-url http://localhost:8000 --speed 2
+
+Requests are sent on the trace's schedule (divided by ``--speed``) and the
+latency percentiles per endpoint are printed at the end.
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import defaultdict
+
+import httpx
+import numpy as np
+
+async def replay(path: str, base_url: str, speed: float, concurrency: int, limit: int | None) -> dict:
+    with open(path) as f:
+        records = [json.loads(line) for line in f]
+    if limit:
+        records = records[:limit]
+
+    latencies: dict[str, list[float]] = defaultdict(list)
+    statuses: dict[str, dict[int, int]] = defaultdict(lambda: defaultdict(int))
+    slots = asyncio.Semaphore(concurrency)
+    late = 0
+
+    async with httpx.AsyncClient(
+        base_url=base_url,
+        timeout=60.0,
+        limits=httpx.Limits(max_connections=concurrency)
+    ) as client:
+        started = time.perf_counter()
+
+        async def send(record: dict) -> None:
+            nonlocal late
+            delay = record["t"] / speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            async with slots:
+                if time.perf_counter() - started > record["t"] / speed + 1.0:
+                    late += 1
+                endpoint = f"{record['method']} {record['path'].split('?')[0]}"
+                sent = time.perf_counter()
+                try:
+                    response = await client.request(
+                        record["method"],
+                        record["path"],
+                        json=record.get("body"),
+                        headers={"X-API-Key": record["api_key"]}
+                    )
+                    status = response.status_code
+                except httpx.HTTPError:
+                    status = 0
+                latencies[endpoint].append(time.perf_counter() - sent)
+                statuses[endpoint][status] += 1
+
+        await asyncio.gather(*(send(record) for record in records))
+        elapsed = time.perf_counter() - started
+
+    report = {"requests": len(records), "elapsed_seconds": elapsed, "late_requests": late, "endpoints": {}}
+    for endpoint, values in sorted(latencies.items()):
+        ms = np.array(values) * 1000
+        report["endpoints"][endpoint] = {
+            "count": len(values),
+            "p50_ms": float(np.percentile(ms, 50)),
+            "p95_ms": float(np.percentile(ms, 95)),
+            "p99_ms": float(np.percentile(ms, 99)),
+            "max_ms": float(ms.max()),
+            "statuses": dict(statuses[endpoint])
+        }
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay this many times faster than recorded")
+    parser.add_argument("--concurrency", type=int, default=100, help="maximum requests in flight")
+    parser.add_argument("--limit", type=int, help="only replay the first N requests")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(replay(args.trace, args.base_url, args.speed, args.concurrency, args.limit))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{report['requests']} requests in {report['elapsed_seconds']:.1f}s "
+              f"({report['late_requests']} started >1s late)")
+        for endpoint, stats in report["endpoints"].items():
+            print(f"{endpoint:<22} n={stats['count']:<7} p50={stats['p50_ms']:7.1f}ms "
+                  f"p95={stats['p95_ms']:7.1f}ms p99={stats['p99_ms']:7.1f}ms statuses={stats['statuses']}")
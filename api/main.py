@@ -1,15 +1,39 @@
-from datetime import datetime, UTC
+import asyncio
+from contextlib import asynccontextmanager
+import math
+from datetime import date, datetime, UTC
+from typing import Literal
 from fastapi import FastAPI, Depends, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
-from database import get_db
+from database import SessionLocal, get_db, get_read_db, read_session, engine, replica_engines, replica_sessions
 import schemas
-import crud
+import hll
+import similarity
+import search
+import instrumentation
+import metrics
+import profiler
+import ratelimit
+import sharding
+import aggregates
+import artcache
+import columnar
+import compare
+import dashboard
+import drilldown
+import ingest_log
+import webhooks
+import scheduler
+from instrumentation import query_budget
 from schemas import PlayCreate, UserCreate, UserResponse, PlayResponse, VerifyEmailRequest, VerifyEmailResponse, StatsResponse
-from crud import get_user_by_api_key, create_play, create_user, get_user_plays, get_user_by_email, verify_email, resend_verification
-from models import User
+from crud import (
+    get_user_by_api_key, create_user, get_user_plays, get_user_by_email, verify_email, resend_verification, mark_write
+)
+from models import Album, User, WebhookSubscription
 from passlib.hash import bcrypt
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
@@ -17,7 +41,31 @@ import smtplib
 import os
 
 
-app = FastAPI(title="Track.haus API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if ingest_log.WRITE_BEHIND:
+        await asyncio.to_thread(ingest_log.start)
+    if scheduler.SCHEDULER_ENABLED:
+        scheduler.start()
+    autocomplete_cache.warm()
+    yield
+    await asyncio.to_thread(scheduler.stop)
+    await asyncio.to_thread(art_cache.close)
+    # Write out whatever is logged before the process exits
+    await asyncio.to_thread(ingest_log.stop)
+
+app = FastAPI(title="Track.haus API", lifespan=lifespan)
+profile_lock = asyncio.Lock()
+instrumentation.install(engine)
+metrics.install(engine, "primary")
+for index, replica in enumerate(replica_engines):
+    instrumentation.install(replica)
+    metrics.install(replica, f"replica{index}")
+for index, shard in enumerate(sharding.shard_engines):
+    instrumentation.install(shard)
+    metrics.install(shard, f"shard{index}")
+autocomplete_cache = search.PrefixCache(read_session)
+art_cache = artcache.ArtCache(artcache.ART_CACHE_DIR, artcache.ART_CACHE_MAX_BYTES)
 
 async def get_current_user(
     request: Request,
@@ -40,19 +88,69 @@ async def get_current_user(
         )
     return user
 
+async def get_admin_user(current_user: User = Depends(get_current_user)):
+    """Require the current user to be an admin."""
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=403,
+            detail="Admin access required"
+        )
+    return current_user
+
+async def get_user_db(current_user: User = Depends(get_current_user)):
+    """Session on the database holding the current user's plays (a replica where possible)."""
+    # The user row comes from the primary, so its last write is current whichever client wrote
+    db = sharding.user_read_session(current_user.id, current_user.last_write_at)
+    try:
+        yield db
+    finally:
+        db.close()
+
+async def get_user_write_db(current_user: User = Depends(get_current_user)):
+    """Read-write session on the database holding the current user's plays."""
+    db = sharding.user_session(current_user.id)
+    try:
+        yield db
+    finally:
+        db.close()
+
 class APIKeyMiddleware:
-    def __init__(self, app, public_paths: set[str]):
+    def __init__(
+        self, app, public_paths: set[str], public_prefixes: tuple[str, ...] = (),
+        admission: ratelimit.Admission | None = None
+    ):
         self.app = app
         self.public_paths = public_paths
+        self.public_prefixes = public_prefixes
+        self.admission = admission
+
+    async def _reject(self, rejection: tuple[int, str, float], scope, receive, send) -> None:
+        status_code, detail, retry_after = rejection
+        response = JSONResponse(
+            status_code=status_code,
+            content={"detail": detail},
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+        await response(scope, receive, send)
 
     async def __call__(self, scope, receive, send):
         if scope["type"] != "http":
             return await self.app(scope, receive, send)
 
         request = Request(scope, receive=receive)
+        client = ratelimit.client_address(
+            request.client.host if request.client else "", ",".join(request.headers.getlist("X-Forwarded-For"))
+        )
         # Always allow OPTIONS requests for CORS
         if scope["method"] == "OPTIONS" or request.url.path in self.public_paths:
             return await self.app(scope, receive, send)
+        if request.url.path.startswith(self.public_prefixes):
+            # No key to charge, so these are limited per client address
+            rejection = self.admission.admit_public(client) if self.admission else None
+            if rejection:
+                await self._reject(rejection, scope, receive, send)
+                return
+            return await self.app(scope, receive, send)
 
         api_key = request.headers.get('X-API-Key')
         if not api_key:
@@ -63,18 +161,35 @@ class APIKeyMiddleware:
             await response(scope, receive, send)
             return
         
-        # Validate API key here to fail fast before hitting the endpoint
-        db = next(get_db())
-        user = get_user_by_api_key(db, api_key)
-        if not user:
-            response = JSONResponse(
-                status_code=401,
-                content={"detail": "Invalid API key"}
-            )
-            await response(scope, receive, send)
+        # Shed load before the key lookup takes a connection
+        path = request.url.path
+        rejection = self.admission.admit(api_key, path, client) if self.admission else None
+        if rejection:
+            await self._reject(rejection, scope, receive, send)
             return
-        
-        await self.app(scope, receive, send)
+
+        try:
+            # Validate API key here to fail fast before hitting the endpoint
+            db = SessionLocal()
+            try:
+                user = get_user_by_api_key(db, api_key)
+            finally:
+                # Give the connection back before the endpoint runs, not when the session is collected
+                db.close()
+            if not user:
+                response = JSONResponse(
+                    status_code=401,
+                    content={"detail": "Invalid API key"}
+                )
+                await response(scope, receive, send)
+                return
+            if self.admission:
+                self.admission.verified(api_key, path)
+
+            await self.app(scope, receive, send)
+        finally:
+            if self.admission:
+                self.admission.release(path)
 
 
 # Configure middleware
@@ -94,14 +209,28 @@ app.add_middleware(APIKeyMiddleware, public_paths=set([
     "/openapi.json",
     "/auth/register",
     "/auth/login",
-    "/auth/verify"
-]))
+    "/auth/verify",
+    "/metrics"
+]), public_prefixes=(
+    "/art/",  # Loaded by <img> tags, which can't send the key
+), admission=ratelimit.Admission.from_env() if ratelimit.RATE_LIMIT_ENABLED else None)
+
+# Outermost, so the API key lookup is counted too
+app.add_middleware(instrumentation.QueryStatsMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(profiler.SlowRequestProfiler)
 
 @app.get("/")
 async def root():
     """Root endpoint requires API key like all other endpoints."""
     return {"message": "Welcome to Track.haus API"}
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus scrape endpoint."""
+    payload, content_type = metrics.render()
+    return Response(payload, media_type=content_type)
+
 def send_verification_email(to_email: str, token: str):
     """Send verification email to user."""
     smtp_host = os.getenv("SMTP_HOST", "smtp.gmail.com")
@@ -142,6 +271,7 @@ def send_verification_email(to_email: str, token: str):
         print(f"Verification token for {to_email}: {token}")
 
 @app.post("/auth/register", response_model=UserResponse)
+@query_budget(7)  # 4, plus placing the user on a shard and copying the row there
 async def register_user(
     user_data: UserCreate,
     db: Session = Depends(get_db)
@@ -154,10 +284,12 @@ async def register_user(
         )
     
     user = create_user(db, user_data.email, user_data.password)
+    sharding.assign_shard(db, user)
     send_verification_email(user.email, user.verification_token)
     return user
 
 @app.post("/auth/login", response_model=UserResponse)
+@query_budget(3)
 async def login_user(
     user_data: UserCreate,
     db: Session = Depends(get_db)
@@ -181,6 +313,7 @@ async def login_user(
     return user
 
 @app.post("/auth/verify", response_model=VerifyEmailResponse)
+@query_budget(3)
 async def verify_user_email(
     verify_data: VerifyEmailRequest,
     db: Session = Depends(get_db)
@@ -193,6 +326,7 @@ async def verify_user_email(
     )
 
 @app.post("/auth/resend-verification", response_model=UserResponse)
+@query_budget(4)
 async def resend_verification_email(
     request: Request,
     db: Session = Depends(get_db)
@@ -203,23 +337,266 @@ async def resend_verification_email(
     send_verification_email(user.email, user.verification_token)
     return user
 
+# The capped analytics endpoints are plain functions so they run in the threadpool:
+# a long history scan then holds one of their slots, not the whole event loop
 @app.get("/api/stats", response_model=schemas.StatsResponse)
-async def get_stats(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+@query_budget(4)
+def get_stats(current_user: User = Depends(get_current_user), db: Session = Depends(get_user_db)):
     """Get comprehensive stats for the current user."""
-    return crud.get_user_stats(db, current_user.id)
+    return columnar.user_stats(db, current_user.id)
+
+@app.get("/api/stats/unique", response_model=schemas.UniqueCountsResponse)
+@query_budget(4)
+def get_unique_counts(
+    start: date | None = None,
+    end: date | None = None,
+    exact: bool = False,
+    scope: Literal["user", "site"] = "user",
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_user_db)
+):
+    """Distinct tracks/artists played between two UTC dates (inclusive).
+
+    Answered by merging daily HyperLogLog sketches unless exact=true."""
+    with metrics.STATS_DURATION.labels("unique_exact" if exact else "unique").time():
+        if scope == "site":
+            if not exact:
+                return sharding.site_unique(start, end)
+            # A COUNT(DISTINCT) over every user's plays: an admin-only query
+            if not current_user.is_admin:
+                raise HTTPException(
+                    status_code=403,
+                    detail="Exact site-wide counts require admin access"
+                )
+            if sharding.enabled():
+                raise HTTPException(
+                    status_code=400,
+                    detail="Exact site-wide counts are not available on a sharded deployment"
+                )
+        user_id = current_user.id if scope == "user" else None
+        if exact:
+            return hll.exact_unique(db, user_id, start, end)
+        return hll.estimate_unique(db, user_id, start, end)
+
+@app.get("/api/stats/compare", response_model=schemas.CompareResponse)
+@query_budget(3)  # 2 key lookups and the comparison
+def get_stats_comparison(
+    a: str | None = None,
+    b: str | None = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_user_db)
+):
+    """Period a against period b (default: this month against last month), in one pass over both."""
+    period_a, period_b = compare.periods(a, b)
+    with metrics.STATS_DURATION.labels("compare").time():
+        return compare.compare(db, current_user.id, period_a, period_b)
+
+@app.get("/api/stats/heatmap", response_model=schemas.HeatmapResponse)
+@query_budget(3)
+async def get_heatmap(current_user: User = Depends(get_current_user), db: Session = Depends(get_user_db)):
+    """Plays by UTC weekday (rows, Monday first) and hour (columns)."""
+    cells = aggregates.heatmap(db, current_user.id)
+    return {'cells': cells, 'max_count': max(max(row) for row in cells)}
+
+@app.get("/api/stats/calendar", response_model=schemas.CalendarResponse)
+@query_budget(3)
+async def get_calendar(
+    year: int | None = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_user_db)
+):
+    """Plays and listening time for every UTC day of a year (default: this year)."""
+    year = year or datetime.now(UTC).year
+    if not 1970 <= year <= 9999:
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid year"
+        )
+    counts, seconds = aggregates.calendar(db, current_user.id, year)
+    return {
+        'year': year,
+        'start': date(year, 1, 1),
+        'counts': counts,
+        'seconds': seconds,
+        'total_plays': sum(counts),
+        'max_count': max(counts)
+    }
+
+@app.get("/api/charts/top", response_model=list[schemas.ChartEntry])
+@query_budget(4)
+def get_top_charts(
+    kind: Literal["artist", "track"] = "artist",
+    days: int = 7,
+    limit: int = 20,
+    current_user: User = Depends(get_current_user)
+):
+    """Site-wide most played artists or tracks, gathered from every shard and cached for a few minutes."""
+    return sharding.top_charts(kind, days, min(limit, sharding.CHARTS_MAX_LIMIT))
+
+@app.get("/artists/{artist_id}/similar", response_model=list[schemas.SimilarItemResponse])
+@query_budget(3)
+async def get_similar_artists(artist_id: int, limit: int = 10, db: Session = Depends(get_read_db)):
+    """Artists that listeners also played, from the precomputed neighbour table."""
+    return similarity.get_similar(db, "artist", artist_id, limit)
+
+@app.get("/tracks/{track_id}/similar", response_model=list[schemas.SimilarItemResponse])
+@query_budget(3)
+async def get_similar_tracks(track_id: int, limit: int = 10, db: Session = Depends(get_read_db)):
+    """Tracks that listeners also played, from the precomputed neighbour table."""
+    return similarity.get_similar(db, "track", track_id, limit)
+
+@app.get("/art/{album_id}")
+@query_budget(1)
+async def get_cover_art(request: Request, album_id: int, size: int = 256, db: Session = Depends(get_read_db)):
+    """Album cover art resized to fit ``size`` pixels, served from the local thumbnail cache."""
+    url = db.scalar(select(Album.cover_art_url).where(Album.id == album_id))
+    # Give the connection back before waiting on the origin or the workers
+    db.close()
+    if not url:
+        raise HTTPException(
+            status_code=404,
+            detail="Cover art not found"
+        )
+
+    size, ext = artcache.snap(size), artcache.negotiate(request.headers.get("Accept"))
+    headers = {"Cache-Control": f"public, max-age={artcache.ART_MAX_AGE}", "Vary": "Accept"}
+    # Revalidating a thumbnail of an original we have seen needs neither the file nor a render
+    etag = await art_cache.etag(url, size, ext)
+    if etag and etag in request.headers.get("If-None-Match", ""):
+        return Response(status_code=304, headers={**headers, "ETag": etag})
+
+    thumbnail = await art_cache.thumbnail(url, size, ext)
+    return FileResponse(thumbnail.path, media_type=thumbnail.media_type, headers={**headers, "ETag": thumbnail.etag})
+
+@app.get("/search", response_model=list[schemas.SearchResult])
+@query_budget(7)
+def search_catalog(
+    q: str,
+    limit: int = 20,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_read_db)
+):
+    """Search artists, albums, tracks and stations, ranked by your own plays."""
+    return search.search_catalog(db, current_user.id, q, min(limit, 50))
+
+@app.get("/search/autocomplete", response_model=list[schemas.SearchResult])
+@query_budget(1)  # the key lookup; loads run in the cache's own thread
+async def autocomplete(q: str, limit: int = 10):
+    """Prefix suggestions for the most played catalog names, served from memory."""
+    results = autocomplete_cache.lookup(q, min(limit, autocomplete_cache.max_results))
+    metrics.record_cache_lookup("autocomplete", bool(results))
+    return results
+
+@app.get("/api/dashboard")
+@query_budget(10)  # 2 key lookups, 3 for recent plays, 3 for now playing, 2 for resident stats
+async def get_dashboard(limit: int = 50, current_user: User = Depends(get_current_user)):
+    """Recent plays, stats and now playing as NDJSON lines, each sent as soon as it is ready."""
+    return StreamingResponse(
+        dashboard.stream(current_user.id, current_user.last_write_at, min(limit, 200)),
+        media_type="application/x-ndjson"
+    )
 
 @app.get("/plays", response_model=list[PlayResponse])
+@query_budget(6)
 async def get_plays(
-    request: Request,
     limit: int = 50,
     offset: int = 0,
-    db: Session = Depends(get_db)
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_user_db)
 ):
     """Get the authenticated user's play history."""
-    user = await get_current_user(request, db)
-    return get_user_plays(db, user.id, limit, offset)
+    return get_user_plays(db, current_user.id, limit, offset)
+
+@app.get("/artists/{artist_id}/plays", response_model=list[PlayResponse])
+@query_budget(5)  # 2 key lookups, plays, their tracks and stations
+async def get_artist_plays(
+    artist_id: int,
+    limit: int = 50,
+    offset: int = 0,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_user_db)
+):
+    """Your plays of one artist, newest first."""
+    return drilldown.plays(db, current_user.id, "artist", artist_id, min(limit, 200), offset)
+
+@app.get("/artists/{artist_id}/stats", response_model=schemas.DrilldownStatsResponse)
+@query_budget(5)  # 2 key lookups, name, totals and top tracks
+async def get_artist_stats(
+    artist_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_user_db)
+):
+    """Your total plays and listening time, first and last play and top tracks for one artist."""
+    return drilldown.stats(db, current_user.id, "artist", artist_id)
+
+@app.get("/albums/{album_id}/plays", response_model=list[PlayResponse])
+@query_budget(5)  # 2 key lookups, plays, their tracks and stations
+async def get_album_plays(
+    album_id: int,
+    limit: int = 50,
+    offset: int = 0,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_user_db)
+):
+    """Your plays of one album, newest first."""
+    return drilldown.plays(db, current_user.id, "album", album_id, min(limit, 200), offset)
+
+@app.get("/albums/{album_id}/stats", response_model=schemas.DrilldownStatsResponse)
+@query_budget(5)  # 2 key lookups, name, totals and top tracks
+async def get_album_stats(
+    album_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_user_db)
+):
+    """Your total plays and listening time, first and last play and top tracks for one album."""
+    return drilldown.stats(db, current_user.id, "album", album_id)
+
+@app.get("/tracks/{track_id}/plays", response_model=list[PlayResponse])
+@query_budget(5)  # 2 key lookups, plays, their tracks and stations
+async def get_track_plays(
+    track_id: int,
+    limit: int = 50,
+    offset: int = 0,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_user_db)
+):
+    """Your plays of one track, newest first."""
+    return drilldown.plays(db, current_user.id, "track", track_id, min(limit, 200), offset)
+
+@app.get("/tracks/{track_id}/stats", response_model=schemas.DrilldownStatsResponse)
+@query_budget(5)  # 2 key lookups, name, totals and top tracks
+async def get_track_stats(
+    track_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_user_db)
+):
+    """Your total plays and listening time, first and last play and top tracks for one track."""
+    return drilldown.stats(db, current_user.id, "track", track_id)
+
+@app.get("/stations/{station_id}/plays", response_model=list[PlayResponse])
+@query_budget(5)  # 2 key lookups, plays, their tracks and stations
+async def get_station_plays(
+    station_id: int,
+    limit: int = 50,
+    offset: int = 0,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_user_db)
+):
+    """Your plays of one station, newest first."""
+    return drilldown.plays(db, current_user.id, "station", station_id, min(limit, 200), offset)
+
+@app.get("/stations/{station_id}/stats", response_model=schemas.DrilldownStatsResponse)
+@query_budget(5)  # 2 key lookups, name, totals and top tracks
+async def get_station_stats(
+    station_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_user_db)
+):
+    """Your total plays and listening time, first and last play and top tracks for one station."""
+    return drilldown.stats(db, current_user.id, "station", station_id)
 
 @app.post("/track/play")
+@query_budget(22)  # 2 key lookups, 4 catalog lookups (+4 inserts when new), play, 4 sketch (+2 site-wide), 2 aggregate, 1 webhook and 1 write mark
 async def record_play(
     request: Request,
     play: PlayCreate,
@@ -227,8 +604,21 @@ async def record_play(
 ):
     """Record a track play from Pianobar."""
     user = await get_current_user(request, db)
+    if ingest_log.log is not None:
+        # Write-behind: acknowledge once the play is in the local log; the drainer stores it
+        db.close()  # don't hold a connection while waiting for the fsync
+        sequence = await ingest_log.append(user.id, play)
+        return JSONResponse(
+            status_code=202,
+            content={"message": "Play queued", "sequence": sequence}
+        )
     try:
-        play_record = create_play(db, play, user.id)
+        play_record = sharding.create_play(db, play, user.id)
+        metrics.PLAYS_INGESTED.inc()
+        if replica_sessions:
+            # The browser reading this user's plays isn't the client that recorded them
+            mark_write(db, [user.id])
+            db.commit()
         return {
             "message": "Play recorded successfully",
             "id": play_record.id
@@ -238,3 +628,118 @@ async def record_play(
             status_code=500,
             detail=f"Failed to record play: {str(e)}"
         )
+
+@app.post("/webhooks", response_model=schemas.WebhookResponse)
+@query_budget(5)
+async def create_webhook(
+    webhook: schemas.WebhookCreate,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_user_write_db)
+):
+    """Subscribe a URL to your play events. Deliveries are signed with the returned secret."""
+    if webhooks.count_subscriptions(db, current_user.id) >= webhooks.MAX_SUBSCRIPTIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {webhooks.MAX_SUBSCRIPTIONS} webhooks per user"
+        )
+    try:
+        await webhooks.resolve_destination(str(webhook.url))
+    except webhooks.UnsafeDestination as e:
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
+    subscription = WebhookSubscription(user_id=current_user.id, url=str(webhook.url))
+    db.add(subscription)
+    db.commit()
+    return subscription
+
+@app.get("/webhooks", response_model=list[schemas.WebhookResponse])
+@query_budget(3)
+async def list_webhooks(current_user: User = Depends(get_current_user), db: Session = Depends(get_user_write_db)):
+    """Your webhook subscriptions."""
+    return webhooks.get_subscriptions(db, current_user.id)
+
+async def get_webhook(
+    webhook_id: int,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_user_write_db)
+):
+    """The current user's subscription from the path, or 404."""
+    subscription = webhooks.get_subscription(db, current_user.id, webhook_id)
+    if not subscription:
+        raise HTTPException(
+            status_code=404,
+            detail="Webhook not found"
+        )
+    return subscription
+
+@app.delete("/webhooks/{webhook_id}")
+@query_budget(5)
+async def delete_webhook(
+    subscription: WebhookSubscription = Depends(get_webhook),
+    db: Session = Depends(get_user_write_db)
+):
+    """Unsubscribe, dropping any undelivered events."""
+    db.delete(subscription)
+    db.commit()
+    return {"message": "Webhook deleted"}
+
+@app.get("/webhooks/{webhook_id}/deliveries", response_model=list[schemas.WebhookDeliveryResponse])
+@query_budget(4)
+async def list_webhook_deliveries(
+    status: Literal["pending", "sending", "delivered", "dead"] | None = None,
+    limit: int = 50,
+    subscription: WebhookSubscription = Depends(get_webhook),
+    db: Session = Depends(get_user_write_db)
+):
+    """Recent events for a subscription, newest first."""
+    return webhooks.get_deliveries(db, subscription.id, status, min(limit, 200))
+
+@app.post("/webhooks/{webhook_id}/redeliver")
+@query_budget(4)
+async def redeliver_webhook(
+    subscription: WebhookSubscription = Depends(get_webhook),
+    db: Session = Depends(get_user_write_db)
+):
+    """Queue a subscription's dead events for another round of attempts."""
+    return {"requeued": webhooks.redeliver(db, subscription.id)}
+
+@app.post("/admin/profile")
+async def capture_profile(
+    seconds: float = 10,
+    interval_ms: float = 5,
+    format: Literal["speedscope", "collapsed"] = "speedscope",
+    admin: User = Depends(get_admin_user)
+):
+    """Sample this worker for a few seconds and return the profile."""
+    if not 0 < seconds <= 120 or not 1 <= interval_ms <= 1000:
+        raise HTTPException(
+            status_code=400,
+            detail="seconds must be in (0, 120] and interval_ms in [1, 1000]"
+        )
+    if profile_lock.locked():
+        raise HTTPException(
+            status_code=409,
+            detail="A profile is already being captured"
+        )
+
+    async with profile_lock:
+        sampler = profiler.Sampler(interval_ms / 1000).start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            sampler.stop()
+
+    samples = list(sampler.samples)
+    stamp = datetime.now(UTC).strftime("%Y%m%dT%H%M%S")
+    if format == "collapsed":
+        return Response(
+            profiler.to_collapsed(samples),
+            media_type="text/plain",
+            headers={"Content-Disposition": f'attachment; filename="profile-{stamp}.folded"'}
+        )
+    return JSONResponse(
+        profiler.to_speedscope(samples, sampler.interval, f"worker {os.getpid()} for {seconds:g}s"),
+        headers={"Content-Disposition": f'attachment; filename="profile-{stamp}.speedscope.json"'}
+    )
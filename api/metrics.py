@@ -0,0 +1,125 @@
+"""Prometheus metrics served at ``/metrics``.
+
+Covers request latency per route, connection pool saturation (checked out,
+overflow, time spent waiting for a connection, timeouts), plays ingested,
+stats computation time, cache hit/miss counts, requests shed by admission
+control, write-behind ingest lag and scheduled job durations.
+
+Under several uvicorn workers set ``PROMETHEUS_MULTIPROC_DIR`` to an empty,
+writable directory before starting them; each worker then writes its samples
+there and ``/metrics`` aggregates all of them, whichever worker answers.
+"""
+import os
+import time
+
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, REGISTRY, generate_latest, multiprocess
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Request latency by route",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+POOL_SIZE = Gauge("db_pool_size", "Configured pool size", ["engine"], multiprocess_mode="livesum")
+POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Connections in use", ["engine"], multiprocess_mode="livesum")
+POOL_OVERFLOW = Gauge("db_pool_overflow", "Connections open beyond pool_size", ["engine"], multiprocess_mode="livesum")
+POOL_WAIT = Histogram(
+    "db_pool_wait_seconds", "Time spent waiting for a pooled connection", ["engine"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30, 60)
+)
+POOL_TIMEOUTS = Counter("db_pool_timeouts_total", "Checkouts that gave up after pool_timeout", ["engine"])
+PLAYS_INGESTED = Counter("plays_ingested_total", "Plays recorded")
+STATS_DURATION = Histogram(
+    "stats_duration_seconds", "Time to compute a stats response", ["kind"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+CACHE_LOOKUPS = Counter("cache_lookups_total", "Cache lookups by outcome", ["cache", "result"])
+INGEST_LOG_PENDING = Gauge(
+    "ingest_log_pending", "Plays in the write-behind log not yet written to the database", multiprocess_mode="livesum"
+)
+INGEST_LOG_LAG = Gauge(
+    "ingest_log_lag_seconds", "Age of the oldest play in the write-behind log not yet written", multiprocess_mode="livemax"
+)
+REQUESTS_SHED = Counter("requests_shed_total", "Requests turned away before reaching the database", ["reason"])
+JOB_DURATION = Histogram(
+    "job_duration_seconds", "Scheduled job run time by outcome", ["job", "status"],
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 1800, 3600)
+)
+
+def install(engine: Engine, name: str = "primary") -> None:
+    """Track pool occupancy and checkout wait time for an engine."""
+    pool = engine.pool
+    checked_out, overflow, wait, timeouts = (
+        POOL_CHECKED_OUT.labels(name), POOL_OVERFLOW.labels(name), POOL_WAIT.labels(name), POOL_TIMEOUTS.labels(name)
+    )
+    POOL_SIZE.labels(name).set(pool.size())
+
+    def update_gauges(*_):
+        checked_out.set(pool.checkedout())
+        overflow.set(max(pool.overflow(), 0))
+
+    event.listen(pool, "checkout", update_gauges)
+    event.listen(pool, "checkin", update_gauges)
+
+    # There is no "before checkout" event, so time the call that blocks on the queue
+    connect = pool.connect
+
+    def timed_connect():
+        started = time.perf_counter()
+        try:
+            return connect()
+        except PoolTimeoutError:
+            timeouts.inc()
+            raise
+        finally:
+            wait.observe(time.perf_counter() - started)
+
+    pool.connect = timed_connect
+
+def record_cache_lookup(cache: str, hit: bool) -> None:
+    CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
+
+def render() -> tuple[bytes, str]:
+    """The exposition payload and its content type."""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+class MetricsMiddleware:
+    """Observes request latency, labelled by route template rather than raw path."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            REQUEST_DURATION.labels(
+                scope["method"],
+                # Unmatched paths share one label so scanners can't blow up cardinality
+                getattr(route, "path", "unmatched"),
+                str(status)
+            ).observe(time.perf_counter() - started)
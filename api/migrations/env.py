@@ -1,5 +1,5 @@
 from logging.config import fileConfig
-from sqlalchemy import engine_from_config
+from sqlalchemy import create_engine
 from sqlalchemy import pool
 from alembic import context
 import os
@@ -24,6 +24,7 @@ if config.config_file_name is not None:
 # Import all models here
 from models import Base
 from database import SQLALCHEMY_DATABASE_URL
+from sharding import SHARD_URLS
 
 # Set the database URL in the alembic.ini file
 config.set_main_option("sqlalchemy.url", SQLALCHEMY_DATABASE_URL)
@@ -40,28 +41,34 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        render_as_batch=url.startswith("sqlite")
     )
 
     with context.begin_transaction():
         context.run_migrations()
 
 
+def database_urls() -> list[str]:
+    """The primary followed by every shard that isn't the primary itself."""
+    urls = [config.get_main_option("sqlalchemy.url")]
+    urls.extend(url for url in SHARD_URLS if url not in urls)
+    return urls
+
 def run_migrations_online() -> None:
-    """Run migrations in 'online' mode."""
-    connectable = engine_from_config(
-        config.get_section(config.config_ini_section, {}),
-        prefix="sqlalchemy.",
-        poolclass=pool.NullPool,
-    )
+    """Run migrations in 'online' mode, on the primary and then on each shard."""
+    for url in database_urls():
+        connectable = create_engine(url, poolclass=pool.NullPool)
 
-    with connectable.connect() as connection:
-        context.configure(
-            connection=connection, 
-            target_metadata=target_metadata
-        )
+        with connectable.connect() as connection:
+            context.configure(
+                connection=connection, 
+                target_metadata=target_metadata,
+                # SQLite can't ALTER most things, so autogenerate table-rebuilding batch operations
+                render_as_batch=connection.dialect.name == "sqlite"
+            )
 
-        with context.begin_transaction():
-            context.run_migrations()
+            with context.begin_transaction():
+                context.run_migrations()
 
 
 if context.is_offline_mode():
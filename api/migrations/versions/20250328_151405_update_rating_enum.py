@@ -21,6 +21,11 @@ old_enum = postgresql.ENUM('LIKE', 'DISLIKE', 'UNRATED', name='rating')
 new_enum = postgresql.ENUM('UNRATED', 'LIKE', 'BAN', 'TIRED', name='rating')
 
 def upgrade() -> None:
+    if op.get_bind().dialect.name == "sqlite":
+        # SQLite stores enums as plain strings, so only the values change
+        op.execute("UPDATE plays SET rating = 'BAN' WHERE rating = 'DISLIKE'")
+        return
+
     # Create the new enum type
     op.execute('CREATE TYPE rating_new AS ENUM (\'UNRATED\', \'LIKE\', \'BAN\', \'TIRED\')')
     
@@ -46,6 +51,10 @@ def upgrade() -> None:
 
 
 def downgrade() -> None:
+    if op.get_bind().dialect.name == "sqlite":
+        op.execute("UPDATE plays SET rating = 'DISLIKE' WHERE rating IN ('BAN', 'TIRED')")
+        return
+
     # Create the old enum type
     op.execute('CREATE TYPE rating_old AS ENUM (\'LIKE\', \'DISLIKE\', \'UNRATED\')')
     
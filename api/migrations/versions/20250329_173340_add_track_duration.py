@@ -19,6 +19,9 @@ depends_on: Union[str, Sequence[str], None] = None
 
 
 def upgrade() -> None:
+    if op.get_bind().dialect.name == "sqlite":
+        return  # no enum types; the column is already a non-null string
+
     # ### commands auto generated by Alembic - please adjust! ###
     # Create the new enum type first
     rating_enum = postgresql.ENUM('UNRATED', 'LIKE', 'BAN', 'TIRED', name='rating')
@@ -31,6 +34,9 @@ def upgrade() -> None:
 
 
 def downgrade() -> None:
+    if op.get_bind().dialect.name == "sqlite":
+        return
+
     # ### commands auto generated by Alembic - please adjust! ###
     # First alter the column back
     op.alter_column('plays', 'rating',
@@ -19,12 +19,14 @@ depends_on: Union[str, Sequence[str], None] = None
 
 
 def upgrade() -> None:
-    # ### commands auto generated by Alembic - please adjust! ###
-    op.add_column('plays', sa.Column('duration', sa.Integer(), nullable=True, comment='Duration in seconds'))
-    # ### end Alembic commands ###
+    # a177b40308fa already added the column; this revision only documents it.
+    # SQLite has no column comments.
+    if op.get_bind().dialect.name != "sqlite":
+        op.alter_column('plays', 'duration', existing_type=sa.Integer(), existing_nullable=True,
+                        comment='Duration in seconds')
 
 
 def downgrade() -> None:
-    # ### commands auto generated by Alembic - please adjust! ###
-    op.drop_column('plays', 'duration')
-    # ### end Alembic commands ###
+    if op.get_bind().dialect.name != "sqlite":
+        op.alter_column('plays', 'duration', existing_type=sa.Integer(), existing_nullable=True,
+                        comment=None, existing_comment='Duration in seconds')
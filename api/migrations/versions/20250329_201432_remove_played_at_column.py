@@ -23,7 +23,10 @@ def upgrade() -> None:
     op.create_index('idx_plays_user_created_at', 'plays', ['user_id', 'created_at'])
     op.create_index('idx_plays_track_created_at', 'plays', ['track_id', 'created_at'])
 
-    # Drop the played_at column
+    # Drop the played_at column and its indexes (Postgres would drop the indexes
+    # with the column, SQLite refuses to drop an indexed column)
+    op.drop_index('idx_plays_user_played_at', table_name='plays')
+    op.drop_index('idx_plays_track_played_at', table_name='plays')
     op.drop_column('plays', 'played_at')
 
 
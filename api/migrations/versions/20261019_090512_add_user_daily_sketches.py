@@ -0,0 +1,36 @@
+"""add_user_daily_sketches
+
+Revision ID: 5b1e8c0f2a47
+Revises: 9374e5a21110
+Create Date: 2026-10-19 09:05:12.418302+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b1e8c0f2a47'
+down_revision: Union[str, None] = '9374e5a21110'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Daily HyperLogLog sketches; populate with `python hll.py rebuild`
+    op.create_table('user_daily_sketches',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('track_sketch', sa.LargeBinary(), nullable=False),
+    sa.Column('artist_sketch', sa.LargeBinary(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'day')
+    )
+    op.create_index('idx_user_daily_sketches_day', 'user_daily_sketches', ['day'])
+
+
+def downgrade() -> None:
+    op.drop_index('idx_user_daily_sketches_day', table_name='user_daily_sketches')
+    op.drop_table('user_daily_sketches')
@@ -0,0 +1,48 @@
+"""add_similarity_tables
+
+Revision ID: e3c4a9d17b52
+Revises: 5b1e8c0f2a47
+Create Date: 2026-10-19 10:17:33.902114+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e3c4a9d17b52'
+down_revision: Union[str, None] = '5b1e8c0f2a47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('job_watermarks',
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('last_id', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.create_table('cooccurrence_counts',
+    sa.Column('kind', sa.String(length=16), nullable=False),
+    sa.Column('item_a', sa.Integer(), nullable=False),
+    sa.Column('item_b', sa.Integer(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('kind', 'item_a', 'item_b')
+    )
+    op.create_table('similar_items',
+    sa.Column('kind', sa.String(length=16), nullable=False),
+    sa.Column('item_id', sa.Integer(), nullable=False),
+    sa.Column('rank', sa.Integer(), nullable=False),
+    sa.Column('similar_id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('kind', 'item_id', 'rank')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('similar_items')
+    op.drop_table('cooccurrence_counts')
+    op.drop_table('job_watermarks')
@@ -0,0 +1,38 @@
+"""add_catalog_trigram_indexes
+
+Revision ID: 0c9f6e2d8a13
+Revises: e3c4a9d17b52
+Create Date: 2026-10-19 11:39:50.274661+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0c9f6e2d8a13'
+down_revision: Union[str, None] = 'e3c4a9d17b52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TRIGRAM_INDEXES = [
+    ('idx_artists_name_trgm', 'artists', 'name'),
+    ('idx_albums_title_trgm', 'albums', 'title'),
+    ('idx_tracks_title_trgm', 'tracks', 'title'),
+    ('idx_stations_name_trgm', 'stations', 'name'),
+]
+
+
+def upgrade() -> None:
+    # On SQLite these are plain b-tree indexes, which still serve prefix matches
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, column in TRIGRAM_INDEXES:
+        op.create_index(name, table, [column], postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'})
+
+
+def downgrade() -> None:
+    for name, table, _ in TRIGRAM_INDEXES:
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,47 @@
+"""add_catalog_normalization
+
+Revision ID: 71d2f5b9c0e8
+Revises: 0c9f6e2d8a13
+Create Date: 2026-10-19 12:44:08.655120+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '71d2f5b9c0e8'
+down_revision: Union[str, None] = '0c9f6e2d8a13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Normalized keys are backfilled by `python catalog.py merge`
+    op.add_column('artists', sa.Column('name_normalized', sa.String(), nullable=True, comment='Matching key, see catalog.normalize_name'))
+    op.add_column('albums', sa.Column('title_normalized', sa.String(), nullable=True, comment='Matching key, see catalog.normalize_name'))
+    op.add_column('tracks', sa.Column('title_normalized', sa.String(), nullable=True, comment='Matching key, see catalog.normalize_name'))
+    op.create_index('idx_artists_name_normalized', 'artists', ['name_normalized'])
+    op.create_index('idx_albums_artist_title_normalized', 'albums', ['artist_id', 'title_normalized'])
+    op.create_index('idx_tracks_artist_album_title_normalized', 'tracks', ['artist_id', 'album_id', 'title_normalized'])
+
+    op.create_table('catalog_aliases',
+    sa.Column('kind', sa.String(length=16), nullable=False),
+    sa.Column('alias_id', sa.Integer(), nullable=False),
+    sa.Column('canonical_id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('kind', 'alias_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('catalog_aliases')
+    op.drop_index('idx_tracks_artist_album_title_normalized', table_name='tracks')
+    op.drop_index('idx_albums_artist_title_normalized', table_name='albums')
+    op.drop_index('idx_artists_name_normalized', table_name='artists')
+    op.drop_column('tracks', 'title_normalized')
+    op.drop_column('albums', 'title_normalized')
+    op.drop_column('artists', 'name_normalized')
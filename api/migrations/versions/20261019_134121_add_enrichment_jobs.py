@@ -0,0 +1,41 @@
+"""add_enrichment_jobs
+
+Revision ID: 2a8d4e6f1b93
+Revises: 71d2f5b9c0e8
+Create Date: 2026-10-19 13:41:21.037745+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2a8d4e6f1b93'
+down_revision: Union[str, None] = '71d2f5b9c0e8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('enrichment_jobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=16), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('run_after', sa.DateTime(), nullable=False),
+    sa.Column('locked_at', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('kind', 'entity_id', name='uq_enrichment_jobs_kind_entity')
+    )
+    op.create_index('idx_enrichment_jobs_status_run_after', 'enrichment_jobs', ['status', 'run_after'])
+
+
+def downgrade() -> None:
+    op.drop_index('idx_enrichment_jobs_status_run_after', table_name='enrichment_jobs')
+    op.drop_table('enrichment_jobs')
@@ -0,0 +1,26 @@
+"""add_user_is_admin
+
+Revision ID: 6d3b8f1e4c27
+Revises: 2a8d4e6f1b93
+Create Date: 2026-10-19 14:12:06.418305+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6d3b8f1e4c27'
+down_revision: Union[str, None] = '2a8d4e6f1b93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('is_admin', sa.Boolean(), server_default=sa.text('false'), nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'is_admin')
@@ -0,0 +1,34 @@
+"""add_user_shards
+
+Revision ID: 9e2a5c7d3f18
+Revises: 6d3b8f1e4c27
+Create Date: 2026-10-19 14:33:18.205114+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e2a5c7d3f18'
+down_revision: Union[str, None] = '6d3b8f1e4c27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('user_shards',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('shard', sa.Integer(), nullable=False),
+    sa.Column('assigned_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    op.create_index('idx_user_shards_shard', 'user_shards', ['shard'])
+
+
+def downgrade() -> None:
+    op.drop_index('idx_user_shards_shard', table_name='user_shards')
+    op.drop_table('user_shards')
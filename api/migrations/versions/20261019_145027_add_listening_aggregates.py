@@ -0,0 +1,72 @@
+"""add_listening_aggregates
+
+Revision ID: 4f7c1a9e2b65
+Revises: 9e2a5c7d3f18
+Create Date: 2026-10-19 14:50:27.731902+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4f7c1a9e2b65'
+down_revision: Union[str, None] = '9e2a5c7d3f18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('user_daily_plays',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('play_count', sa.Integer(), nullable=False),
+    sa.Column('total_seconds', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'day')
+    )
+    op.create_table('user_hourly_plays',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('weekday', sa.Integer(), nullable=False),
+    sa.Column('hour', sa.Integer(), nullable=False),
+    sa.Column('play_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'weekday', 'hour')
+    )
+
+    if op.get_bind().dialect.name == "sqlite":
+        # Same backfill; strftime's %w is Sunday = 0
+        op.execute("""
+            INSERT INTO user_daily_plays (user_id, day, play_count, total_seconds)
+            SELECT user_id, date(created_at), count(*), COALESCE(sum(duration), 0)
+            FROM plays
+            GROUP BY user_id, date(created_at)
+        """)
+        op.execute("""
+            INSERT INTO user_hourly_plays (user_id, weekday, hour, play_count)
+            SELECT user_id, (CAST(strftime('%w', created_at) AS INTEGER) + 6) % 7, CAST(strftime('%H', created_at) AS INTEGER), count(*)
+            FROM plays
+            GROUP BY 1, 2, 3
+        """)
+        return
+
+    # Backfill from existing plays (created_at is UTC; ISODOW is Monday = 1)
+    op.execute("""
+        INSERT INTO user_daily_plays (user_id, day, play_count, total_seconds)
+        SELECT user_id, created_at::date, count(*), COALESCE(sum(duration), 0)
+        FROM plays
+        GROUP BY user_id, created_at::date
+    """)
+    op.execute("""
+        INSERT INTO user_hourly_plays (user_id, weekday, hour, play_count)
+        SELECT user_id, EXTRACT(ISODOW FROM created_at)::int - 1, EXTRACT(HOUR FROM created_at)::int, count(*)
+        FROM plays
+        GROUP BY 1, 2, 3
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('user_hourly_plays')
+    op.drop_table('user_daily_plays')
@@ -0,0 +1,57 @@
+"""add_webhooks
+
+Revision ID: b83e5d0a7c41
+Revises: 4f7c1a9e2b65
+Create Date: 2026-10-19 15:22:14.208316+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b83e5d0a7c41'
+down_revision: Union[str, None] = '4f7c1a9e2b65'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('webhook_subscriptions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('url', sa.String(), nullable=False),
+    sa.Column('secret', sa.String(), nullable=False),
+    sa.Column('is_active', sa.Boolean(), server_default=sa.text('true'), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('idx_webhook_subscriptions_user_id', 'webhook_subscriptions', ['user_id'])
+    op.create_table('webhook_outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('subscription_id', sa.Integer(), nullable=False),
+    sa.Column('event', sa.String(length=32), nullable=False),
+    sa.Column('payload', sa.JSON(), nullable=False),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('run_after', sa.DateTime(), nullable=False),
+    sa.Column('locked_at', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('delivered_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['subscription_id'], ['webhook_subscriptions.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('idx_webhook_outbox_status_run_after', 'webhook_outbox', ['status', 'run_after'])
+    op.create_index('idx_webhook_outbox_subscription_id', 'webhook_outbox', ['subscription_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('idx_webhook_outbox_subscription_id', table_name='webhook_outbox')
+    op.drop_index('idx_webhook_outbox_status_run_after', table_name='webhook_outbox')
+    op.drop_table('webhook_outbox')
+    op.drop_index('idx_webhook_subscriptions_user_id', table_name='webhook_subscriptions')
+    op.drop_table('webhook_subscriptions')
@@ -0,0 +1,29 @@
+"""add_plays_created_at_index
+
+Revision ID: 6d2f9c4e1a83
+Revises: b83e5d0a7c41
+Create Date: 2026-10-19 18:30:05.114270+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6d2f9c4e1a83'
+down_revision: Union[str, None] = 'b83e5d0a7c41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Built concurrently so ingest keeps writing to plays meanwhile
+    with op.get_context().autocommit_block():
+        op.create_index('idx_plays_created_at', 'plays', ['created_at'], unique=False,
+                        postgresql_include=['track_id'], postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('idx_plays_created_at', table_name='plays', postgresql_concurrently=True)
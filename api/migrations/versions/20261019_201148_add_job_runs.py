@@ -0,0 +1,38 @@
+"""add_job_runs
+
+Revision ID: e41b7a9c05d2
+Revises: 6d2f9c4e1a83
+Create Date: 2026-10-19 20:11:48.530912+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e41b7a9c05d2'
+down_revision: Union[str, None] = '6d2f9c4e1a83'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('job_runs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('job', sa.String(length=64), nullable=False),
+    sa.Column('status', sa.String(length=16), nullable=False),
+    sa.Column('host', sa.String(), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=False),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.Column('duration_seconds', sa.Float(), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('idx_job_runs_job_started_at', 'job_runs', ['job', 'started_at'])
+
+
+def downgrade() -> None:
+    op.drop_index('idx_job_runs_job_started_at', table_name='job_runs')
+    op.drop_table('job_runs')
@@ -0,0 +1,34 @@
+"""add_drilldown_indexes
+
+Revision ID: 3f8a1d6c92b4
+Revises: e41b7a9c05d2
+Create Date: 2026-10-19 21:34:07.528413+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f8a1d6c92b4'
+down_revision: Union[str, None] = 'e41b7a9c05d2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Built concurrently so ingest keeps writing to plays meanwhile
+    with op.get_context().autocommit_block():
+        op.create_index('idx_plays_user_track_created_at', 'plays', ['user_id', 'track_id', 'created_at'], unique=False,
+                        postgresql_include=['duration'], postgresql_concurrently=True)
+        op.create_index('idx_plays_user_station_created_at', 'plays', ['user_id', 'station_id', 'created_at'],
+                        unique=False, postgresql_include=['track_id', 'duration'], postgresql_concurrently=True)
+        op.create_index('idx_tracks_album_id', 'tracks', ['album_id'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('idx_tracks_album_id', table_name='tracks', postgresql_concurrently=True)
+        op.drop_index('idx_plays_user_station_created_at', table_name='plays', postgresql_concurrently=True)
+        op.drop_index('idx_plays_user_track_created_at', table_name='plays', postgresql_concurrently=True)
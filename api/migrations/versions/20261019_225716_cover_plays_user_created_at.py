@@ -0,0 +1,37 @@
+"""cover_plays_user_created_at
+
+Revision ID: 9c07e2b5d18f
+Revises: 3f8a1d6c92b4
+Create Date: 2026-10-19 22:57:16.084529+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c07e2b5d18f'
+down_revision: Union[str, None] = '3f8a1d6c92b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _replace(include: list[str]) -> None:
+    # The new index is built beside the old one, so play history never loses its index
+    with op.get_context().autocommit_block():
+        op.create_index('idx_plays_user_created_at_new', 'plays', ['user_id', 'created_at'], unique=False,
+                        postgresql_include=include, postgresql_concurrently=True)
+        op.drop_index('idx_plays_user_created_at', table_name='plays', postgresql_concurrently=True)
+        op.execute('ALTER INDEX idx_plays_user_created_at_new RENAME TO idx_plays_user_created_at')
+
+
+def upgrade() -> None:
+    # INCLUDE is Postgres only; elsewhere the index is unchanged
+    if op.get_context().dialect.name == 'postgresql':
+        _replace(['track_id', 'duration'])
+
+
+def downgrade() -> None:
+    if op.get_context().dialect.name == 'postgresql':
+        _replace([])
@@ -0,0 +1,30 @@
+"""add_cooccurrence_item_b_index
+
+Revision ID: 6b2e94d07a1c
+Revises: 9c07e2b5d18f
+Create Date: 2026-10-20 09:15:32.118904+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6b2e94d07a1c'
+down_revision: Union[str, None] = '9c07e2b5d18f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Built concurrently so a running similarity refresh can keep upserting counts
+    with op.get_context().autocommit_block():
+        op.create_index('idx_cooccurrence_counts_kind_item_b', 'cooccurrence_counts', ['kind', 'item_b'],
+                        unique=False, postgresql_include=['count'], postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('idx_cooccurrence_counts_kind_item_b', table_name='cooccurrence_counts',
+                      postgresql_concurrently=True)
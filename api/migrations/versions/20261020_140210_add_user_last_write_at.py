@@ -0,0 +1,27 @@
+"""add_user_last_write_at
+
+Revision ID: 3f8a1c6d92b4
+Revises: 6b2e94d07a1c
+Create Date: 2026-10-20 14:02:10.274519+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f8a1c6d92b4'
+down_revision: Union[str, None] = '6b2e94d07a1c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('last_write_at', sa.DateTime(), nullable=True,
+                                     comment='Last play stored, for read-your-writes routing'))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'last_write_at')
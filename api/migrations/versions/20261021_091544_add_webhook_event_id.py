@@ -0,0 +1,30 @@
+"""add_webhook_event_id
+
+Revision ID: 9d41e7b0c5a3
+Revises: 3f8a1c6d92b4
+Create Date: 2026-10-21 09:15:44.602318+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d41e7b0c5a3'
+down_revision: Union[str, None] = '3f8a1c6d92b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('webhook_outbox', sa.Column('event_id', sa.String(length=36), nullable=True))
+    # Events already queued keep the id receivers may have seen on an earlier attempt
+    op.execute("UPDATE webhook_outbox SET event_id = CAST(id AS VARCHAR)")
+    with op.batch_alter_table('webhook_outbox') as batch_op:
+        batch_op.alter_column('event_id', existing_type=sa.String(length=36), nullable=False)
+
+
+def downgrade() -> None:
+    op.drop_column('webhook_outbox', 'event_id')
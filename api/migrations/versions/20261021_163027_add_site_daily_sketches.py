@@ -0,0 +1,32 @@
+"""add_site_daily_sketches
+
+Revision ID: 5e7c20a9f3d6
+Revises: 9d41e7b0c5a3
+Create Date: 2026-10-21 16:30:27.118406+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e7c20a9f3d6'
+down_revision: Union[str, None] = '9d41e7b0c5a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Site-wide daily HyperLogLog sketches; populate with `python hll.py rebuild-site`
+    op.create_table('site_daily_sketches',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('track_sketch', sa.LargeBinary(), nullable=False),
+    sa.Column('artist_sketch', sa.LargeBinary(), nullable=False),
+    sa.PrimaryKeyConstraint('day')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('site_daily_sketches')
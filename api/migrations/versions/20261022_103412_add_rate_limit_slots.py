@@ -0,0 +1,30 @@
+"""add_rate_limit_slots
+
+Revision ID: b3f9d6a17e20
+Revises: 5e7c20a9f3d6
+Create Date: 2026-10-22 10:34:12.540913+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3f9d6a17e20'
+down_revision: Union[str, None] = '5e7c20a9f3d6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('rate_limit_slots',
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('next_at', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('rate_limit_slots')
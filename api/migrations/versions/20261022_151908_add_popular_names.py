@@ -0,0 +1,33 @@
+"""add_popular_names
+
+Revision ID: 0c6e8f24b917
+Revises: b3f9d6a17e20
+Create Date: 2026-10-22 15:19:08.337160+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0c6e8f24b917'
+down_revision: Union[str, None] = 'b3f9d6a17e20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Filled by the refresh_popular_names job
+    op.create_table('popular_names',
+    sa.Column('kind', sa.String(length=16), nullable=False),
+    sa.Column('item_id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('play_count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('kind', 'item_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('popular_names')
@@ -1,7 +1,7 @@
 """add email verification
 
 Revision ID: add_email_verification
-Revises: init
+Revises: a949d2d8c37b
 Create Date: 2025-03-29 11:56:20
 
 """
@@ -13,20 +13,25 @@ import sqlalchemy as sa
 
 # revision identifiers, used by Alembic.
 revision: str = 'add_email_verification'
-down_revision: Union[str, None] = None
+down_revision: Union[str, None] = 'a949d2d8c37b'
 branch_labels: Union[str, Sequence[str], None] = None
 depends_on: Union[str, Sequence[str], None] = None
 
 
 def upgrade() -> None:
-    # Add email verification columns
-    op.add_column('users', sa.Column('is_verified', sa.Boolean(), server_default=sa.text('false'), nullable=False))
-    op.add_column('users', sa.Column('verification_token', sa.String(), unique=True, nullable=True))
-    op.add_column('users', sa.Column('verification_token_expires', sa.DateTime(), nullable=True))
+    # Add email verification columns (batch mode so SQLite can add the unique constraint)
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('is_verified', sa.Boolean(), server_default=sa.text('false'), nullable=False))
+        batch_op.add_column(sa.Column('verification_token', sa.String(), nullable=True))
+        batch_op.add_column(sa.Column('verification_token_expires', sa.DateTime(), nullable=True))
+        # Postgres' default name for a column's unique constraint
+        batch_op.create_unique_constraint('users_verification_token_key', ['verification_token'])
 
 
 def downgrade() -> None:
     # Remove email verification columns
-    op.drop_column('users', 'verification_token_expires')
-    op.drop_column('users', 'verification_token')
-    op.drop_column('users', 'is_verified')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('verification_token_expires')
+        batch_op.drop_constraint('users_verification_token_key', type_='unique')
+        batch_op.drop_column('verification_token')
+        batch_op.drop_column('is_verified')
@@ -1,10 +1,11 @@
 from datetime import datetime, UTC
 from typing import Optional
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum, Boolean, Index
+from sqlalchemy import Column, Integer, String, Text, DateTime, Date, ForeignKey, Enum, Boolean, Index, LargeBinary, Float, UniqueConstraint, JSON
 from sqlalchemy.orm import relationship, DeclarativeBase
 from sqlalchemy.sql import expression
 import enum
 import secrets
+import uuid
 
 class Base(DeclarativeBase):
     pass
@@ -28,11 +29,13 @@ class User(Base):
     api_key = Column(String, unique=True, nullable=False, default=generate_api_key)
     is_active = Column(Boolean, server_default=expression.true(), nullable=False)
     is_verified = Column(Boolean, server_default=expression.false(), nullable=False)
+    is_admin = Column(Boolean, server_default=expression.false(), nullable=False)
     verification_token = Column(String, unique=True, nullable=True)
     verification_token_expires = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=lambda: datetime.now(UTC), nullable=False)
     updated_at = Column(DateTime, default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC), nullable=False)
     last_login_at = Column(DateTime, nullable=True)
+    last_write_at = Column(DateTime, nullable=True, comment="Last play stored, for read-your-writes routing")
 
     # Relationships
     plays = relationship("Play", back_populates="user")
@@ -45,9 +48,16 @@ class Rating(enum.Enum):
 
 class Artist(Base):
     __tablename__ = "artists"
+    __table_args__ = (
+        # Trigram index for catalog search (requires pg_trgm)
+        Index('idx_artists_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        # Index for ingest lookups on the canonical name
+        Index('idx_artists_name_normalized', 'name_normalized'),
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
+    name_normalized = Column(String, nullable=True, comment="Matching key, see catalog.normalize_name")
     mbid = Column(String(36), unique=True, nullable=True, comment="MusicBrainz Artist ID")
     created_at = Column(DateTime, default=lambda: datetime.now(UTC), nullable=False)
     updated_at = Column(DateTime, default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC), nullable=False)
@@ -59,9 +69,16 @@ class Artist(Base):
 
 class Album(Base):
     __tablename__ = "albums"
+    __table_args__ = (
+        # Trigram index for catalog search (requires pg_trgm)
+        Index('idx_albums_title_trgm', 'title', postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'}),
+        # Index for ingest lookups on the canonical title
+        Index('idx_albums_artist_title_normalized', 'artist_id', 'title_normalized'),
+    )
 
     id = Column(Integer, primary_key=True)
     title = Column(String, nullable=False)
+    title_normalized = Column(String, nullable=True, comment="Matching key, see catalog.normalize_name")
     artist_id = Column(Integer, ForeignKey("artists.id"), nullable=False)
     mbid = Column(String(36), unique=True, nullable=True, comment="MusicBrainz Release ID")
     cover_art_url = Column(String)
@@ -75,6 +92,10 @@ class Album(Base):
 
 class Station(Base):
     __tablename__ = "stations"
+    __table_args__ = (
+        # Trigram index for catalog search (requires pg_trgm)
+        Index('idx_stations_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+    )
 
     id = Column(Integer, primary_key=True)
     name = Column(String, unique=True, nullable=False)
@@ -86,9 +107,18 @@ class Station(Base):
 
 class Track(Base):
     __tablename__ = "tracks"
+    __table_args__ = (
+        # Trigram index for catalog search (requires pg_trgm)
+        Index('idx_tracks_title_trgm', 'title', postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'}),
+        # Index for ingest lookups on the canonical title
+        Index('idx_tracks_artist_album_title_normalized', 'artist_id', 'album_id', 'title_normalized'),
+        # Index for an album's tracks (drill-downs)
+        Index('idx_tracks_album_id', 'album_id'),
+    )
 
     id = Column(Integer, primary_key=True)
     title = Column(String, nullable=False)
+    title_normalized = Column(String, nullable=True, comment="Matching key, see catalog.normalize_name")
     artist_id = Column(Integer, ForeignKey("artists.id"), nullable=False)
     album_id = Column(Integer, ForeignKey("albums.id"), nullable=False)
     mbid = Column(String(36), unique=True, nullable=True, comment="MusicBrainz Recording ID")
@@ -107,10 +137,17 @@ class Play(Base):
     """Represents a single play/listen of a track"""
     __tablename__ = "plays"
     __table_args__ = (
-        # Index for user's play history
-        Index('idx_plays_user_created_at', 'user_id', 'created_at'),
+        # Index for user's play history, index-only for period comparisons
+        Index('idx_plays_user_created_at', 'user_id', 'created_at', postgresql_include=['track_id', 'duration']),
         # Index for track play counts
         Index('idx_plays_track_created_at', 'track_id', 'created_at'),
+        # Index for site-wide charts over a time window, index-only for track charts
+        Index('idx_plays_created_at', 'created_at', postgresql_include=['track_id']),
+        # Indexes for a user's plays of one track (or an artist's or album's tracks) and of one station,
+        # index-only for drill-down stats
+        Index('idx_plays_user_track_created_at', 'user_id', 'track_id', 'created_at', postgresql_include=['duration']),
+        Index('idx_plays_user_station_created_at', 'user_id', 'station_id', 'created_at',
+              postgresql_include=['track_id', 'duration']),
     )
 
     id = Column(Integer, primary_key=True)
@@ -125,3 +162,184 @@ class Play(Base):
     user = relationship("User", back_populates="plays")
     track = relationship("Track", back_populates="plays")
     station = relationship("Station", back_populates="plays")
+
+class UserDailySketch(Base):
+    """HyperLogLog sketches of the distinct tracks/artists a user played on a UTC day"""
+    __tablename__ = "user_daily_sketches"
+    __table_args__ = (
+        # Index for site-wide date range merges
+        Index('idx_user_daily_sketches_day', 'day'),
+    )
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    track_sketch = Column(LargeBinary, nullable=False)
+    artist_sketch = Column(LargeBinary, nullable=False)
+
+class SiteDailySketch(Base):
+    """HyperLogLog sketches of the distinct tracks/artists anyone (on this database) played on a UTC day"""
+    __tablename__ = "site_daily_sketches"
+
+    day = Column(Date, primary_key=True)
+    track_sketch = Column(LargeBinary, nullable=False)
+    artist_sketch = Column(LargeBinary, nullable=False)
+
+class JobWatermark(Base):
+    """Highest row id a batch job has processed, for incremental refreshes"""
+    __tablename__ = "job_watermarks"
+
+    name = Column(String, primary_key=True)
+    last_id = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC), nullable=False)
+
+class JobRun(Base):
+    """One run of a scheduled job, for history and durations"""
+    __tablename__ = "job_runs"
+    __table_args__ = (
+        # Index for a job's most recent runs
+        Index('idx_job_runs_job_started_at', 'job', 'started_at'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    job = Column(String(64), nullable=False)
+    status = Column(String(16), default="running", nullable=False)  # running, ok, failed, timeout, abandoned
+    host = Column(String, nullable=False)  # hostname:pid of the leader that ran it
+    started_at = Column(DateTime, default=lambda: datetime.now(UTC), nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+    duration_seconds = Column(Float, nullable=True)
+    error = Column(Text, nullable=True)
+
+class CooccurrenceCount(Base):
+    """How often two artists/tracks were played close together (item_a < item_b)"""
+    __tablename__ = "cooccurrence_counts"
+    __table_args__ = (
+        # Index for the pairs an item is the larger side of (incremental refreshes)
+        Index('idx_cooccurrence_counts_kind_item_b', 'kind', 'item_b', postgresql_include=['count']),
+    )
+
+    kind = Column(String(16), primary_key=True)  # "artist" or "track"
+    item_a = Column(Integer, primary_key=True)
+    item_b = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False)
+
+class SimilarItem(Base):
+    """Precomputed top-N neighbours of an artist/track"""
+    __tablename__ = "similar_items"
+
+    kind = Column(String(16), primary_key=True)
+    item_id = Column(Integer, primary_key=True)
+    rank = Column(Integer, primary_key=True)
+    similar_id = Column(Integer, nullable=False)
+    score = Column(Float, nullable=False)
+
+class CatalogAlias(Base):
+    """An artist/album/track id that was merged into a canonical row"""
+    __tablename__ = "catalog_aliases"
+
+    kind = Column(String(16), primary_key=True)  # "artist", "album" or "track"
+    alias_id = Column(Integer, primary_key=True)
+    canonical_id = Column(Integer, nullable=False)
+    name = Column(String, nullable=False)  # Name the merged row carried
+    created_at = Column(DateTime, default=lambda: datetime.now(UTC), nullable=False)
+
+class PopularName(Base):
+    """A most played catalog name across every shard, counted by a scheduled job for autocomplete"""
+    __tablename__ = "popular_names"
+
+    kind = Column(String(16), primary_key=True)  # artist, album, track, station
+    item_id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    play_count = Column(Integer, nullable=False)
+
+class RateLimitSlot(Base):
+    """The next free slot of a rate limit every worker shares, in Unix time"""
+    __tablename__ = "rate_limit_slots"
+
+    name = Column(String, primary_key=True)
+    next_at = Column(Float, nullable=False, default=0.0)
+
+class EnrichmentJob(Base):
+    """A catalog row waiting for a MusicBrainz lookup"""
+    __tablename__ = "enrichment_jobs"
+    __table_args__ = (
+        UniqueConstraint('kind', 'entity_id', name='uq_enrichment_jobs_kind_entity'),
+        # Index for claiming the next pending jobs
+        Index('idx_enrichment_jobs_status_run_after', 'status', 'run_after'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(16), nullable=False)  # "artist", "album" or "track"
+    entity_id = Column(Integer, nullable=False)
+    status = Column(String(16), default="pending", nullable=False)  # pending, running, done, failed
+    attempts = Column(Integer, default=0, nullable=False)
+    run_after = Column(DateTime, default=lambda: datetime.now(UTC), nullable=False)
+    locked_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(UTC), nullable=False)
+    updated_at = Column(DateTime, default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC), nullable=False)
+
+class UserShard(Base):
+    """Which shard database holds a user's plays (kept on the primary only)"""
+    __tablename__ = "user_shards"
+    __table_args__ = (
+        Index('idx_user_shards_shard', 'shard'),
+    )
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    shard = Column(Integer, nullable=False)
+    assigned_at = Column(DateTime, default=lambda: datetime.now(UTC), onupdate=lambda: datetime.now(UTC), nullable=False)
+
+class UserDailyPlays(Base):
+    """Plays and listening time per user per UTC day, maintained on insert"""
+    __tablename__ = "user_daily_plays"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    play_count = Column(Integer, nullable=False, default=0)
+    total_seconds = Column(Integer, nullable=False, default=0)
+
+class UserHourlyPlays(Base):
+    """Plays per user per UTC weekday (Monday = 0) and hour, maintained on insert"""
+    __tablename__ = "user_hourly_plays"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    weekday = Column(Integer, primary_key=True)
+    hour = Column(Integer, primary_key=True)
+    play_count = Column(Integer, nullable=False, default=0)
+
+class WebhookSubscription(Base):
+    """An HTTPS endpoint that receives a user's play events (stored beside the user's plays)"""
+    __tablename__ = "webhook_subscriptions"
+    __table_args__ = (
+        Index('idx_webhook_subscriptions_user_id', 'user_id'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    url = Column(String, nullable=False)
+    secret = Column(String, nullable=False, default=generate_api_key)  # HMAC key for signing deliveries
+    is_active = Column(Boolean, server_default=expression.true(), nullable=False)
+    created_at = Column(DateTime, default=lambda: datetime.now(UTC), nullable=False)
+
+class WebhookOutbox(Base):
+    """An event waiting to be delivered to one subscription, written with the play itself"""
+    __tablename__ = "webhook_outbox"
+    __table_args__ = (
+        # Index for claiming the next pending deliveries
+        Index('idx_webhook_outbox_status_run_after', 'status', 'run_after'),
+        Index('idx_webhook_outbox_subscription_id', 'subscription_id'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    # What receivers dedupe on. Row ids repeat across shards; this is unique and moves with the event
+    event_id = Column(String(36), nullable=False, default=lambda: str(uuid.uuid4()))
+    subscription_id = Column(Integer, ForeignKey("webhook_subscriptions.id", ondelete="CASCADE"), nullable=False)
+    event = Column(String(32), nullable=False)  # "play.created"
+    payload = Column(JSON, nullable=False)
+    status = Column(String(16), default="pending", nullable=False)  # pending, sending, delivered, dead
+    attempts = Column(Integer, default=0, nullable=False)
+    run_after = Column(DateTime, default=lambda: datetime.now(UTC), nullable=False)
+    locked_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(UTC), nullable=False)
+    delivered_at = Column(DateTime, nullable=True)
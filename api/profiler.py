@@ -0,0 +1,185 @@
+"""In-process sampling profiler.
+
+A background thread snapshots every thread's stack with
+``sys._current_frames()`` at a fixed interval, so the profiled code runs
+unmodified and the cost is one stack walk per interval, not per call.
+
+- ``POST /admin/profile?seconds=N`` samples the worker for N seconds and
+  returns a speedscope file (https://www.speedscope.app) or folded stacks for
+  flamegraph.pl.
+- ``SlowRequestProfiler``, when ``SLOW_PROFILE_MS`` is set, keeps a rolling
+  window of low-rate samples. When a request takes longer than that it writes
+  the samples taken while the request ran to ``PROFILE_DIR``, from a thread so
+  the event loop doesn't wait on the disk. Those samples include every busy
+  thread, so concurrent requests show up too.
+"""
+import asyncio
+from collections import deque
+from datetime import datetime, UTC
+import json
+import os
+import sys
+import threading
+import time
+
+# Off by default: while on, every worker walks every thread's stack at 1/SLOW_PROFILE_INTERVAL Hz
+SLOW_PROFILE_MS = float(os.getenv("SLOW_PROFILE_MS", "0"))  # 0 disables slow-request capture
+SLOW_PROFILE_INTERVAL = float(os.getenv("SLOW_PROFILE_INTERVAL", "0.05"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(__file__), ".profiles"))
+MAX_PROFILE_FILES = 200
+DUMP_COOLDOWN = 60.0  # seconds between automatic dumps for the same route
+
+# Leaf frames of threads that are parked rather than working
+_IDLE = {("selectors.py", "select"), ("threading.py", "wait"), ("queue.py", "get"), ("thread.py", "_worker")}
+
+class Sampler:
+    """Samples the stacks of all other threads until stopped.
+
+    With ``maxlen`` only the most recent samples are kept, for continuous use.
+    """
+
+    def __init__(self, interval: float = 0.005, maxlen: int | None = None):
+        self.interval = interval
+        self.samples: deque[tuple[float, int, tuple]] = deque(maxlen=maxlen)
+        self._frames: dict[tuple, tuple] = {}
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _stack(self, frame) -> tuple:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            key = (code.co_filename, code.co_firstlineno, code.co_name)
+            # Intern frame keys so the ring buffer holds shared tuples
+            stack.append(self._frames.setdefault(key, key))
+            frame = frame.f_back
+        stack.reverse()
+        return tuple(stack)
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = self._stack(frame)
+                leaf = stack[-1] if stack else None
+                if leaf and (os.path.basename(leaf[0]), leaf[2]) in _IDLE:
+                    continue
+                self.samples.append((now, thread_id, stack))
+
+    def start(self) -> "Sampler":
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def between(self, start: float, end: float) -> list[tuple[float, int, tuple]]:
+        return [sample for sample in list(self.samples) if start <= sample[0] <= end]
+
+def _short_file(filename: str) -> str:
+    for path in sorted(sys.path, key=len, reverse=True):
+        if path and filename.startswith(path + os.sep):
+            return filename[len(path) + 1:]
+    return filename
+
+def to_speedscope(samples: list[tuple[float, int, tuple]], interval: float, name: str) -> dict:
+    """A speedscope "sampled" profile; each thread becomes its own profile."""
+    frame_index: dict[tuple, int] = {}
+    frames = []
+    by_thread: dict[int, list[list[int]]] = {}
+    for _, thread_id, stack in samples:
+        indexes = []
+        for key in stack:
+            if key not in frame_index:
+                frame_index[key] = len(frames)
+                frames.append({'name': key[2], 'file': _short_file(key[0]), 'line': key[1]})
+            indexes.append(frame_index[key])
+        by_thread.setdefault(thread_id, []).append(indexes)
+
+    profiles = []
+    for thread_id, stacks in by_thread.items():
+        profiles.append({
+            'type': 'sampled',
+            'name': f"{name} (thread {thread_id})",
+            'unit': 'seconds',
+            'startValue': 0,
+            'endValue': len(stacks) * interval,
+            'samples': stacks,
+            'weights': [interval] * len(stacks)
+        })
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': name,
+        'exporter': 'track.haus profiler',
+        'shared': {'frames': frames},
+        'profiles': profiles
+    }
+
+def to_collapsed(samples: list[tuple[float, int, tuple]]) -> str:
+    """Folded stacks ("a;b;c count" per line), the input format of flamegraph.pl."""
+    counts: dict[str, int] = {}
+    for _, _, stack in samples:
+        line = ";".join(f"{key[2]} ({_short_file(key[0])}:{key[1]})" for key in stack)
+        counts[line] = counts.get(line, 0) + 1
+    return "".join(f"{line} {count}\n" for line, count in sorted(counts.items()))
+
+class SlowRequestProfiler:
+    """ASGI middleware writing a profile for every request slower than ``threshold_ms``."""
+
+    def __init__(self, app, threshold_ms: float = SLOW_PROFILE_MS, interval: float = SLOW_PROFILE_INTERVAL,
+                 directory: str = PROFILE_DIR, window: float = 120.0,
+                 exclude: frozenset[str] = frozenset({"/admin/profile"})):
+        self.app = app
+        self.exclude = exclude
+        self.threshold = threshold_ms / 1000
+        self.directory = directory
+        self.sampler = None
+        if threshold_ms > 0:
+            self.sampler = Sampler(interval, maxlen=int(window / interval) * 4).start()
+        self._last_dump: dict[str, float] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.sampler is None or scope["path"] in self.exclude:
+            return await self.app(scope, receive, send)
+
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            elapsed = time.monotonic() - started
+            if elapsed >= self.threshold:
+                await self._dump(scope, started, started + elapsed)
+
+    async def _dump(self, scope, start: float, end: float) -> None:
+        route = getattr(scope.get("route"), "path", scope["path"])
+        key = f"{scope['method']} {route}"
+        if time.monotonic() - self._last_dump.get(key, 0.0) < DUMP_COOLDOWN:
+            return
+        samples = self.sampler.between(start, end)
+        if not samples:
+            return
+        self._last_dump[key] = time.monotonic()
+
+        slug = route.strip("/").replace("/", "_").replace("{", "").replace("}", "") or "root"
+        stamp = datetime.now(UTC).strftime("%Y%m%dT%H%M%S")
+        name = f"{stamp}-{scope['method']}-{slug}-{int((end - start) * 1000)}ms.speedscope.json"
+        await asyncio.to_thread(self._write, name, samples, key)
+
+    def _write(self, name: str, samples: list[tuple[float, int, tuple]], key: str) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as f:
+            json.dump(to_speedscope(samples, self.sampler.interval, key), f)
+        print(f"Slow request profile written to {path}")
+        self._prune()
+
+    def _prune(self) -> None:
+        files = sorted(os.listdir(self.directory))
+        for name in files[:-MAX_PROFILE_FILES]:
+            os.remove(os.path.join(self.directory, name))
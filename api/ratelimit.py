@@ -0,0 +1,200 @@
+"""Admission control: per-API-key rate limits and per-route concurrency caps.
+
+``APIKeyMiddleware`` asks ``Admission`` before it looks the key up, so a
+rejected request never checks out a database connection:
+
+- every API key has a token bucket refilling at ``RATE_LIMIT_PER_SECOND``
+  with room for bursts of ``RATE_LIMIT_BURST``, and a separate one for
+  ``/track/play`` (``INGEST_RATE_PER_SECOND`` / ``INGEST_BURST``); an empty
+  bucket answers 429 with ``Retry-After``;
+- a key gets its own bucket only once a lookup has found it (``verified``).
+  Until then its requests, like ones with a made-up key, spend the client
+  address's bucket, so inventing keys neither escapes the limit nor pushes
+  real keys' buckets out;
+- public prefixes that take no key (``/art/``) have a bucket per client
+  address (``PUBLIC_RATE_PER_SECOND`` / ``PUBLIC_BURST``), since each miss
+  there can cost an origin fetch and a render;
+- expensive routes admit a fixed number of requests at a time
+  (``ROUTE_CONCURRENCY="/api/stats=4,/search=8"`` overrides the defaults);
+  the rest get 503 with ``Retry-After`` at once instead of queueing for a
+  pooled connection for up to ``pool_timeout``.
+
+Client addresses come from ``client_address``: behind proxies listed in
+``TRUSTED_PROXIES``, the last ``X-Forwarded-For`` hop a trusted proxy added.
+
+State is per worker process, so with N uvicorn workers a key can reach N
+times its rate. Set ``RATE_LIMIT_ENABLED=false`` to turn both off.
+"""
+from collections import OrderedDict
+import ipaddress
+import os
+import time
+
+import metrics
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_PER_SECOND = float(os.getenv("RATE_LIMIT_PER_SECOND", "10"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "50"))
+INGEST_RATE_PER_SECOND = float(os.getenv("INGEST_RATE_PER_SECOND", "1"))  # a player reports one play per song
+INGEST_BURST = float(os.getenv("INGEST_BURST", "30"))  # room to flush a backlog after an outage
+PUBLIC_RATE_PER_SECOND = float(os.getenv("PUBLIC_RATE_PER_SECOND", "20"))
+PUBLIC_BURST = float(os.getenv("PUBLIC_BURST", "100"))  # a page of album covers loads at once
+# Networks of the reverse proxies in front of the API, e.g. "10.0.0.0/8,127.0.0.1"
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(network.strip(), strict=False)
+    for network in os.getenv("TRUSTED_PROXIES", "").split(",") if network.strip()
+]
+BUSY_RETRY_AFTER = 1  # seconds suggested to clients turned away by a concurrency cap
+MAX_TRACKED_KEYS = 100_000
+
+DEFAULT_ROUTE_CONCURRENCY = {
+    "/api/stats": 4,  # loads the user's whole history
+    "/api/dashboard": 4,  # includes /api/stats
+    "/api/stats/unique": 8,
+    "/api/charts/top": 2,  # a query on every shard
+    "/search": 8
+}
+
+def parse_route_limits(value: str) -> dict[str, int]:
+    """"/path=n,/other=m" -> {"/path": n, "/other": m}."""
+    limits = {}
+    for item in value.split(","):
+        if item.strip():
+            path, _, limit = item.partition("=")
+            limits[path.strip()] = int(limit)
+    return limits
+
+def _trusted(address: str, proxies: list) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in proxies)
+
+def client_address(peer: str, forwarded_for: str | None, proxies: list | None = None) -> str:
+    """The address to charge a request to.
+
+    ``X-Forwarded-For`` is read from the right, skipping hops added by trusted
+    proxies; the first untrusted hop is the client. Anything left of it was
+    sent by the client and could be made up, so it is never used.
+    """
+    proxies = TRUSTED_PROXIES if proxies is None else proxies
+    if not forwarded_for or not _trusted(peer, proxies):
+        return peer
+    address = peer
+    for hop in reversed([hop.strip() for hop in forwarded_for.split(",")]):
+        if not hop:
+            break
+        address = hop
+        if not _trusted(hop, proxies):
+            break
+    return address
+
+class TokenBuckets:
+    """One token bucket per key, refilled lazily when it is next used.
+
+    Buckets are kept in least recently used order, and past ``max_keys`` the
+    oldest is dropped. Only touched from the event loop, so there is no locking.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = MAX_TRACKED_KEYS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()  # key -> (tokens, updated at)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._buckets
+
+    def add(self, key: str) -> None:
+        """Start a full bucket for key, unless it has one."""
+        if key not in self._buckets:
+            self._set(key, self.burst, time.monotonic())
+
+    def take(self, key: str, cost: float = 1.0) -> float:
+        """Spend cost tokens. Returns 0 if allowed, else seconds until enough have refilled."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens < cost:
+            self._set(key, tokens, now)
+            return (cost - tokens) / self.rate
+        self._set(key, tokens - cost, now)
+        return 0.0
+
+    def _set(self, key: str, tokens: float, now: float) -> None:
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        # The least recently used bucket is the one most likely to have refilled, which is the same as no bucket
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+
+class ConcurrencyLimits:
+    """In-flight request counts for routes with a cap."""
+
+    def __init__(self, limits: dict[str, int]):
+        self.limits = limits
+        self.in_flight = dict.fromkeys(limits, 0)
+
+    def acquire(self, path: str) -> bool:
+        limit = self.limits.get(path)
+        if limit is None:
+            return True
+        if self.in_flight[path] >= limit:
+            return False
+        self.in_flight[path] += 1
+        return True
+
+    def release(self, path: str) -> None:
+        if path in self.limits:
+            self.in_flight[path] -= 1
+
+class Admission:
+    """Decides whether a request may proceed, before it touches the database."""
+
+    def __init__(self, buckets: TokenBuckets, route_buckets: dict[str, TokenBuckets], concurrency: ConcurrencyLimits,
+                 public_buckets: TokenBuckets | None = None):
+        self.buckets = buckets
+        self.route_buckets = route_buckets
+        self.concurrency = concurrency
+        self.public_buckets = public_buckets or TokenBuckets(PUBLIC_RATE_PER_SECOND, PUBLIC_BURST)
+
+    @classmethod
+    def from_env(cls) -> "Admission":
+        return cls(
+            TokenBuckets(RATE_LIMIT_PER_SECOND, RATE_LIMIT_BURST),
+            {"/track/play": TokenBuckets(INGEST_RATE_PER_SECOND, INGEST_BURST)},
+            ConcurrencyLimits({**DEFAULT_ROUTE_CONCURRENCY, **parse_route_limits(os.getenv("ROUTE_CONCURRENCY", ""))}),
+            TokenBuckets(PUBLIC_RATE_PER_SECOND, PUBLIC_BURST)
+        )
+
+    def admit(self, api_key: str, path: str, client: str) -> tuple[int, str, float] | None:
+        """None to let the request through (call ``release`` when it finishes),
+        else the (status, detail, retry after) to reject it with.
+
+        Keys that haven't been ``verified`` are charged to the client address.
+        """
+        buckets = self.route_buckets.get(path, self.buckets)
+        wait = buckets.take(api_key if api_key in buckets else f"client:{client}")
+        if wait:
+            metrics.REQUESTS_SHED.labels("rate_limited").inc()
+            return 429, "Rate limit exceeded", wait
+        if not self.concurrency.acquire(path):
+            metrics.REQUESTS_SHED.labels("overloaded").inc()
+            return 503, "Server busy, please retry", BUSY_RETRY_AFTER
+        return None
+
+    def admit_public(self, client: str) -> tuple[int, str, float] | None:
+        """``admit`` for a public prefix, charged to the client address. Nothing to release."""
+        wait = self.public_buckets.take(client)
+        if wait:
+            metrics.REQUESTS_SHED.labels("rate_limited").inc()
+            return 429, "Rate limit exceeded", wait
+        return None
+
+    def verified(self, api_key: str, path: str) -> None:
+        """Give a key that a lookup found its own bucket for this path's limit."""
+        self.route_buckets.get(path, self.buckets).add(api_key)
+
+    def release(self, path: str) -> None:
+        self.concurrency.release(path)
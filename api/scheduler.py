@@ -0,0 +1,476 @@
+"""In-process scheduler for periodic maintenance jobs.
+
+Every API worker starts a ``Scheduler`` thread from the app lifespan, but only
+the one holding the leader lock runs jobs: a Postgres session advisory lock
+on the primary, or on SQLite an ``flock`` beside the database file. The lock
+goes with its connection (or process), so when the leader dies another
+worker takes over within ``LEADER_RETRY`` seconds.
+
+Jobs are registered with ``@job("<cron>")``. Schedules are five-field cron
+expressions in UTC.
+
+- **Where jobs run.** Thread jobs run in a small pool, and their session has a
+  ``statement_timeout`` equal to the job's timeout. Jobs marked ``process=True``
+  (CPU-heavy ones) run in a spawned process, which is killed at its timeout.
+- **Jitter.** Each run starts up to ``jitter`` seconds after it is due.
+- **Overlap.** A run is skipped while the previous one is still going.
+- **History.** Every run is recorded in ``job_runs`` with its status and
+  duration. A new leader schedules each job from its last recorded start, so
+  a run missed during failover happens once, straight away.
+
+Set ``SCHEDULER_ENABLED=false`` to leave the API workers out and run the
+scheduler on its own:
+
+    python scheduler.py work
+    python scheduler.py list
+    python scheduler.py run JOB
+"""
+import argparse
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta, UTC
+import fcntl
+import multiprocessing
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+
+from sqlalchemy import select, update, delete, func, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+import crud
+import metrics
+import search
+import sharding
+import similarity
+import webhooks
+from database import SessionLocal, engine
+from models import JobRun
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() == "true"
+SCHEDULER_THREADS = int(os.getenv("SCHEDULER_THREADS", "2"))
+LEADER_RETRY = 10.0  # seconds between attempts to become (or confirm being) leader
+TICK = 1.0
+LOCK_KEY = 0x747261636B686175  # "trackhau"
+JOB_RUN_RETENTION = timedelta(days=30)
+
+ALIASES = {
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+}
+_FIELDS = (("minute", 0, 59), ("hour", 0, 23), ("day of month", 1, 31), ("month", 1, 12), ("day of week", 0, 7))
+
+def _parse_field(field: str, name: str, low: int, high: int) -> set[int]:
+    values = set()
+    for part in field.split(","):
+        spec, _, step = part.partition("/")
+        if spec == "*":
+            first, last = low, high
+        elif "-" in spec:
+            first, last = (int(bound) for bound in spec.split("-", 1))
+        else:
+            first = int(spec)
+            last = high if step else first
+        step = int(step) if step else 1
+        if not low <= first <= last <= high or step < 1:
+            raise ValueError(f"Invalid {name} field: {field!r}")
+        values.update(range(first, last + 1, step))
+    return values
+
+class Cron:
+    """A cron expression: minute, hour, day of month, month, day of week (0 or 7 is Sunday)."""
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        fields = ALIASES.get(expression, expression).split()
+        if len(fields) != 5:
+            raise ValueError(f"Expected 5 cron fields, got {expression!r}")
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            _parse_field(field, name, low, high) for field, (name, low, high) in zip(fields, _FIELDS)
+        )
+        self.weekdays = {day % 7 for day in weekdays}
+        # As in cron, when both day fields are restricted either one may match
+        self._any_day, self._any_weekday = fields[2] == "*", fields[4] == "*"
+        self.next_after(datetime(2000, 1, 1, tzinfo=UTC))  # rejects "0 0 31 2 *"
+
+    def _day_matches(self, t: datetime) -> bool:
+        day, weekday = t.day in self.days, (t.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, after: datetime) -> datetime:
+        """The first matching minute strictly after `after`."""
+        t = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t + timedelta(days=366 * 5)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError(f"Cron expression never matches: {self.expression!r}")
+
+class Job:
+    def __init__(self, name: str, schedule: str, fn, timeout: float, jitter: float, process: bool):
+        self.name = name
+        self.cron = Cron(schedule)
+        self.fn = fn
+        self.timeout = timeout
+        self.jitter = jitter
+        self.process = process
+
+JOBS: dict[str, Job] = {}
+
+def job(schedule: str, timeout: float = 300.0, jitter: float = 30.0, process: bool = False):
+    """Register fn(db) to run on a cron schedule. Names must be unique."""
+    def register(fn):
+        JOBS[fn.__name__] = Job(fn.__name__, schedule, fn, timeout, jitter, process)
+        return fn
+    return register
+
+@job("17 * * * *")
+def expire_verification_tokens(db: Session) -> None:
+    expired = crud.expire_verification_tokens(db)
+    if expired:
+        print(f"Expired {expired} verification tokens")
+
+@job("5 * * * *", timeout=1800.0, jitter=120.0, process=True)
+def refresh_similarity(db: Session) -> None:
+    for kind in similarity.KINDS:
+        similarity.refresh(db, kind)
+
+@job("*/10 * * * *", timeout=600.0, jitter=60.0)
+def refresh_popular_names(db: Session) -> None:
+    # One count across every shard for all workers' autocomplete caches
+    search.refresh_popular(db)
+
+@job("40 3 * * *")
+def prune_webhook_deliveries(db: Session) -> None:
+    # The outbox lives beside each user's plays
+    sharding.scatter(webhooks.prune_delivered, read_only=False)
+
+@job("50 3 * * *")
+def prune_job_runs(db: Session) -> None:
+    db.execute(delete(JobRun).where(JobRun.started_at < datetime.now(UTC) - JOB_RUN_RETENTION))
+    db.commit()
+
+def _run(job: Job) -> None:
+    """Run a job in this thread with a session limited to its timeout."""
+    # One connection for the whole job, so the timeout applies to every transaction it commits
+    conn = engine.connect()
+    postgres = conn.dialect.name == "postgresql"
+    try:
+        if postgres:
+            conn.execute(text(f"SET statement_timeout = {int(job.timeout * 1000)}"))
+            conn.commit()
+        with SessionLocal(bind=conn) as db:
+            job.fn(db)
+    finally:
+        if postgres:
+            try:
+                conn.rollback()
+                conn.execute(text("RESET statement_timeout"))
+                conn.commit()
+            except Exception:
+                conn.invalidate()  # don't return the connection with the setting to the pool
+        conn.close()
+
+def _run_in_process(name: str) -> None:
+    try:
+        _run(JOBS[name])
+    except BaseException:
+        traceback.print_exc()
+        raise SystemExit(1)
+
+class LeaderLock:
+    """The scheduler's leader lock: a Postgres advisory lock, or an flock beside an SQLite file."""
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self._conn = None
+        self._fd: int | None = None
+
+    def acquire(self) -> bool:
+        if self.engine.dialect.name == "sqlite":
+            path = self.engine.url.database
+            if not path or path == ":memory:":
+                return True  # only this process can see the database
+            fd = os.open(f"{path}.scheduler.lock", os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return False
+            self._fd = fd
+            return True
+        conn = self.engine.connect()
+        try:
+            acquired = conn.scalar(text("SELECT pg_try_advisory_lock(:key)"), {'key': LOCK_KEY})
+            conn.commit()  # the lock is held by the session, not the transaction
+        except Exception:
+            conn.close()
+            raise
+        if not acquired:
+            conn.close()
+            return False
+        self._conn = conn
+        return True
+
+    def held(self) -> bool:
+        """Whether the lock is still ours; a dropped connection has released it."""
+        if self._conn is None:
+            return self._fd is not None or self.engine.dialect.name == "sqlite"
+        try:
+            self._conn.scalar(text("SELECT 1"))
+            self._conn.commit()
+            return True
+        except Exception:
+            self.release()
+            return False
+
+    def release(self) -> None:
+        if self._conn is not None:
+            try:
+                self._conn.invalidate()  # closes the session, which releases the lock
+            finally:
+                self._conn = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+class ActiveRun:
+    def __init__(self, job: Job, run_id: int, task: Future | multiprocessing.Process):
+        self.job = job
+        self.run_id = run_id
+        self.task = task
+        self.started = time.monotonic()
+        self.timed_out = False
+
+    def done(self) -> bool:
+        return self.task.done() if isinstance(self.task, Future) else not self.task.is_alive()
+
+    def error(self) -> str | None:
+        if isinstance(self.task, Future):
+            error = self.task.exception()
+            return f"{type(error).__name__}: {error}" if error else None
+        return f"exit code {self.task.exitcode}" if self.task.exitcode else None
+
+def _host() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _now() -> datetime:
+    return datetime.now(UTC)
+
+def last_started(db: Session) -> dict[str, datetime]:
+    """When each job last started, from the run history."""
+    return {
+        name: started.replace(tzinfo=UTC)
+        for name, started in db.execute(select(JobRun.job, func.max(JobRun.started_at)).group_by(JobRun.job))
+    }
+
+class Scheduler(threading.Thread):
+    """Runs due jobs while this process holds the leader lock."""
+
+    def __init__(self, jobs: dict[str, Job] = JOBS, lock: LeaderLock | None = None, threads: int = SCHEDULER_THREADS):
+        super().__init__(name="scheduler", daemon=True)
+        self.jobs = jobs
+        self.lock = lock or LeaderLock(engine)
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="job")
+        self.next_run: dict[str, datetime] = {}
+        self.active: dict[str, ActiveRun] = {}
+        self.leader = False
+        self._checked_at = 0.0
+        self._stopping = threading.Event()
+
+    def _check_leadership(self) -> None:
+        if time.monotonic() - self._checked_at < LEADER_RETRY:
+            return
+        self._checked_at = time.monotonic()
+        if self.leader:
+            if not self.lock.held():
+                print("Scheduler lost the leader lock")
+                self.leader = False
+            return
+        if self.lock.acquire():
+            try:
+                self._take_over()
+            except Exception:
+                # Let another worker (or the next retry) take over rather than lead without a schedule
+                self.lock.release()
+                raise
+            self.leader = True
+
+    def _take_over(self) -> None:
+        """Close out runs a previous leader left open and schedule from the history."""
+        db = SessionLocal()
+        try:
+            db.execute(
+                update(JobRun).where(JobRun.status == "running", JobRun.job.not_in(self.active))
+                .values(status="abandoned", finished_at=_now())
+            )
+            db.commit()
+            last = last_started(db)
+        finally:
+            db.close()
+        now = _now()
+        for name, job in self.jobs.items():
+            due = job.cron.next_after(last[name]) if name in last else job.cron.next_after(now)
+            self.next_run[name] = max(due, now) + timedelta(seconds=random.uniform(0, job.jitter))
+        print(f"Scheduler leader is {_host()}, running {len(self.jobs)} jobs")
+
+    def _record_start(self, job: Job) -> int:
+        db = SessionLocal()
+        try:
+            run = JobRun(job=job.name, status="running", host=_host(), started_at=_now())
+            db.add(run)
+            db.commit()
+            return run.id
+        finally:
+            db.close()
+
+    def _record_finish(self, run: ActiveRun, status: str, error: str | None) -> None:
+        duration = time.monotonic() - run.started
+        values = {'finished_at': _now(), 'duration_seconds': duration}
+        if not run.timed_out:
+            values.update(status=status, error=error[:2000] if error else None)
+        db = SessionLocal()
+        try:
+            db.execute(update(JobRun).where(JobRun.id == run.run_id).values(**values))
+            db.commit()
+        finally:
+            db.close()
+        metrics.JOB_DURATION.labels(run.job.name, "timeout" if run.timed_out else status).observe(duration)
+        if status != "ok":
+            print(f"Job {run.job.name} {status}: {error}")
+
+    def _record_timeout(self, run: ActiveRun, error: str) -> None:
+        db = SessionLocal()
+        try:
+            db.execute(update(JobRun).where(JobRun.id == run.run_id).values(status="timeout", error=error))
+            db.commit()
+        finally:
+            db.close()
+        run.timed_out = True
+        print(f"Job {run.job.name} timeout: {error}")
+
+    def start_job(self, job: Job) -> None:
+        run_id = self._record_start(job)
+        if job.process:
+            # spawn, not fork: the child must not inherit this process's pools and threads
+            task = multiprocessing.get_context("spawn").Process(
+                target=_run_in_process, args=(job.name,), name=f"job-{job.name}", daemon=True
+            )
+            task.start()
+        else:
+            task = self.pool.submit(_run, job)
+        self.active[job.name] = ActiveRun(job, run_id, task)
+
+    def _reap(self) -> None:
+        for name, run in list(self.active.items()):
+            if run.done():
+                error = run.error()
+                self._record_finish(run, "failed" if error else "ok", error)
+                del self.active[name]
+            elif not run.timed_out and time.monotonic() - run.started > run.job.timeout:
+                error = f"still running after {run.job.timeout:g}s"
+                if isinstance(run.task, Future):
+                    # A thread can't be killed: its statements hit statement_timeout, and it stays active until it returns
+                    self._record_timeout(run, error)
+                else:
+                    run.task.kill()
+                    run.task.join(5)
+                    self._record_finish(run, "timeout", error)
+                    del self.active[name]
+
+    def _start_due(self) -> None:
+        now = _now()
+        for name, job in self.jobs.items():
+            if self.next_run[name] > now:
+                continue
+            self.next_run[name] = job.cron.next_after(now) + timedelta(seconds=random.uniform(0, job.jitter))
+            if name in self.active:
+                print(f"Skipping {name}: the previous run is still going")
+                continue
+            self.start_job(job)
+
+    def run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                self._check_leadership()
+                if self.leader:
+                    self._reap()
+                    self._start_due()
+            except Exception as e:
+                print(f"Scheduler tick failed: {e}")
+            self._stopping.wait(TICK)
+
+    def stop(self, timeout: float | None = None) -> None:
+        """Stop scheduling, and give running jobs until timeout to finish."""
+        self._stopping.set()
+        self.join(timeout)
+        deadline = time.monotonic() + (timeout or 0)
+        while self.active and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for run in self.active.values():
+            if not isinstance(run.task, Future):
+                run.task.kill()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.lock.release()
+        self.leader = False
+
+scheduler: Scheduler | None = None
+
+def start() -> None:
+    global scheduler
+    scheduler = Scheduler()
+    scheduler.start()
+
+def stop(timeout: float = 10.0) -> None:
+    global scheduler
+    if scheduler:
+        scheduler.stop(timeout)
+    scheduler = None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scheduled maintenance jobs")
+    parser.add_argument("command", choices=["work", "list", "run"])
+    parser.add_argument("job", nargs="?", choices=list(JOBS), help="job to run now (with run)")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        db = SessionLocal()
+        try:
+            last = last_started(db)
+        finally:
+            db.close()
+        for name, job in JOBS.items():
+            started = last[name].strftime("%Y-%m-%d %H:%M") if name in last else "never"
+            print(f"{name:28} {job.cron.expression:16} last {started}, next {job.cron.next_after(_now()):%Y-%m-%d %H:%M}")
+    elif args.command == "run":
+        if not args.job:
+            parser.error("run needs a job name")
+        runner = Scheduler()
+        runner.start_job(JOBS[args.job])
+        while runner.active:
+            runner._reap()
+            time.sleep(0.2)
+    else:
+        runner = Scheduler()
+        runner.start()
+        try:
+            while runner.is_alive():
+                runner.join(1.0)
+        except KeyboardInterrupt:
+            runner.stop(30.0)
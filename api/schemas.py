@@ -1,6 +1,6 @@
-from datetime import datetime
-from pydantic import BaseModel, ConfigDict, EmailStr, Field, field_validator
-from typing import Optional
+from datetime import date, datetime
+from pydantic import AnyUrl, BaseModel, ConfigDict, EmailStr, Field, UrlConstraints, field_validator
+from typing import Annotated, Optional
 from models import Rating
 
 class UserCreate(BaseModel):
@@ -138,6 +138,104 @@ class StatsResponse(BaseModel):
     plays_by_month: list[TimeStats]
     rating_distribution: list[RatingStats]
 
+class DrilldownStatsResponse(BaseModel):
+    id: int
+    name: str
+    total_plays: int
+    unique_tracks: int
+    total_time_seconds: int
+    first_play: datetime
+    last_play: datetime
+    top_tracks: list[TopItemStats]
+
+class PeriodTotals(BaseModel):
+    start: date
+    end: date  # inclusive
+    total_plays: int
+    total_time_seconds: int
+    unique_artists: int
+
+class ArtistComparison(BaseModel):
+    id: int
+    name: str
+    plays_a: int
+    plays_b: int
+    delta: int
+    rank_a: int | None
+    rank_b: int | None
+    rank_change: int | None  # positive when the artist moved up
+
+class CompareResponse(BaseModel):
+    a: PeriodTotals
+    b: PeriodTotals
+    play_delta: int
+    time_delta_seconds: int
+    top_artists: list[ArtistComparison]  # period a's top artists, with their movement since b
+    risers: list[ArtistComparison]
+    fallers: list[ArtistComparison]
+    new_artists: list[ArtistComparison]  # played in a and never before it
+
+class UniqueCountsResponse(BaseModel):
+    unique_tracks: int
+    unique_artists: int
+    approximate: bool
+    relative_error: float
+
+class SimilarItemResponse(BaseModel):
+    id: int
+    name: str
+    score: float
+
+class HeatmapResponse(BaseModel):
+    cells: list[list[int]]  # 7 weekdays (Monday first) x 24 hours, UTC
+    max_count: int
+
+class CalendarResponse(BaseModel):
+    year: int
+    start: date
+    counts: list[int]  # plays per day from `start`
+    seconds: list[int]  # listening time per day from `start`
+    total_plays: int
+    max_count: int
+
+class ChartEntry(BaseModel):
+    id: int
+    name: str
+    play_count: int
+
+class WebhookCreate(BaseModel):
+    url: Annotated[AnyUrl, UrlConstraints(allowed_schemes=['https'], host_required=True)]
+
+class WebhookResponse(BaseModel):
+    id: int
+    url: str
+    secret: str  # HMAC key for verifying X-Trackhaus-Signature
+    is_active: bool
+    created_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+class WebhookDeliveryResponse(BaseModel):
+    id: int
+    event_id: str
+    event: str
+    status: str
+    attempts: int
+    run_after: datetime
+    last_error: str | None
+    created_at: datetime
+    delivered_at: datetime | None
+
+    model_config = ConfigDict(from_attributes=True)
+
+class SearchResult(BaseModel):
+    type: str
+    id: int
+    name: str
+    context: str | None = None
+    play_count: int
+    score: float | None = None
+
 class PlayCreate(BaseModel):
     title: str
     artist: str
@@ -0,0 +1,247 @@
+"""Catalog search and autocomplete.
+
+``search_catalog`` matches artists, albums, tracks and stations by prefix or
+trigram similarity (``pg_trgm`` GIN indexes; on SQLite, by prefix or
+substring) and ranks candidates by how often the searching user played them. ``PrefixCache`` keeps the most played names in
+memory so autocomplete never has to touch the database.
+
+The most played names are counted on every shard by one scheduled job
+(``refresh_popular``) into ``popular_names``, which every worker's cache loads.
+"""
+from bisect import bisect_left
+import threading
+import time
+
+from sqlalchemy import select, delete, insert, func, literal, case, desc
+from sqlalchemy.orm import Session, aliased
+
+from models import Artist, Album, Track, Station, Play, PopularName
+
+KINDS = ("artist", "album", "track", "station")
+CANDIDATES_PER_KIND = 50
+POPULAR_PER_KIND = 5000  # names per kind in the autocomplete index
+
+def _escape_like(q: str) -> str:
+    return q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def _kind_query(kind: str, q: str, user_id: int, trigram: bool = True):
+    """Candidates of one kind, with the user's play count for each."""
+    if kind == "artist":
+        name, context = Artist.name, literal(None)
+        entity, joins = Artist, []
+        plays = select(func.count()).select_from(Play).join(Play.track).where(Track.artist_id == Artist.id)
+    elif kind == "album":
+        album_artist = aliased(Artist)
+        name, context = Album.title, album_artist.name
+        entity, joins = Album, [(album_artist, album_artist.id == Album.artist_id)]
+        plays = select(func.count()).select_from(Play).join(Play.track).where(Track.album_id == Album.id)
+    elif kind == "track":
+        track_artist = aliased(Artist)
+        name, context = Track.title, track_artist.name
+        entity, joins = Track, [(track_artist, track_artist.id == Track.artist_id)]
+        plays = select(func.count()).select_from(Play).where(Play.track_id == Track.id)
+    else:
+        name, context = Station.name, literal(None)
+        entity, joins = Station, []
+        plays = select(func.count()).select_from(Play).where(Play.station_id == Station.id)
+
+    user_plays = plays.where(Play.user_id == user_id).correlate(entity).scalar_subquery()
+    prefix = name.ilike(_escape_like(q) + "%", escape="\\")
+    if trigram:
+        similarity, match = func.similarity(name, q), name.op("%")(q)
+    else:
+        # No pg_trgm: score substring matches by how much of the name they cover
+        similarity, match = literal(float(len(q))) / func.length(name), name.ilike(f"%{_escape_like(q)}%", escape="\\")
+
+    # Trigram index narrows the catalog to a handful of candidates first
+    candidates = select(entity.id.label("id")).where(prefix | match) \
+        .order_by(desc(prefix), desc(similarity)).limit(CANDIDATES_PER_KIND).subquery()
+
+    query = select(
+        literal(kind).label("type"),
+        entity.id.label("id"),
+        name.label("name"),
+        context.label("context"),
+        user_plays.label("play_count"),
+        case((prefix, 1.0), else_=similarity).label("score")
+    ).join(candidates, candidates.c.id == entity.id)
+    for target, onclause in joins:
+        query = query.join(target, onclause)
+    return query
+
+def search_catalog(db: Session, user_id: int, q: str, limit: int = 20, kinds: tuple[str, ...] = KINDS) -> list[dict]:
+    """Search the catalog, ranked by the user's own plays, then match quality."""
+    q = q.strip()
+    if not q:
+        return []
+    results = []
+    trigram = db.get_bind().dialect.name == "postgresql"
+    for kind in kinds:
+        results.extend(row._asdict() for row in db.execute(_kind_query(kind, q, user_id, trigram)))
+    results.sort(key=lambda r: (r['play_count'], r['score']), reverse=True)
+    return results[:limit]
+
+def _popular_counts(db: Session, per_kind: int) -> list[tuple[str, int, int]]:
+    """The most played (kind, id, play count) on one database."""
+    play_count = func.count(Play.id).label("play_count")
+    queries = {
+        "artist": select(Track.artist_id, play_count).join(Play, Play.track_id == Track.id).group_by(Track.artist_id),
+        "album": select(Track.album_id, play_count).join(Play, Play.track_id == Track.id).group_by(Track.album_id),
+        "track": select(Play.track_id, play_count).group_by(Play.track_id),
+        "station": select(Play.station_id, play_count).group_by(Play.station_id),
+    }
+    rows = []
+    for kind, query in queries.items():
+        for item_id, count in db.execute(query.order_by(desc(play_count)).limit(per_kind)):
+            rows.append((kind, item_id, count))
+    return rows
+
+def refresh_popular(db: Session, per_kind: int = POPULAR_PER_KIND) -> int:
+    """Recount the most played names on every shard into ``popular_names``. Returns rows written.
+
+    Each shard contributes its own top names, so an item just outside one
+    shard's list is undercounted; close enough to rank suggestions.
+    """
+    import sharding
+
+    totals: dict[tuple[str, int], int] = {}
+    for rows in sharding.scatter(lambda shard_db: _popular_counts(shard_db, per_kind)):
+        for kind, item_id, count in rows:
+            totals[(kind, item_id)] = totals.get((kind, item_id), 0) + count
+
+    # Names from the directory's catalog, which shard copies may lag behind
+    names = {
+        "artist": (Artist, Artist.name), "album": (Album, Album.title),
+        "track": (Track, Track.title), "station": (Station, Station.name)
+    }
+    values = []
+    for kind, (model, name) in names.items():
+        top = sorted(
+            ((item_id, count) for (item_kind, item_id), count in totals.items() if item_kind == kind),
+            key=lambda item: item[1], reverse=True
+        )[:per_kind]
+        found = dict(db.execute(select(model.id, name).where(model.id.in_([item_id for item_id, _ in top]))).all())
+        values.extend(
+            {'kind': kind, 'item_id': item_id, 'name': found[item_id], 'play_count': count}
+            for item_id, count in top if item_id in found
+        )
+    db.execute(delete(PopularName))
+    if values:
+        db.execute(insert(PopularName), values)
+    db.commit()
+    return len(values)
+
+def _fold(text: str) -> str:
+    return " ".join(text.casefold().split())
+
+class PrefixCache:
+    """In-memory prefix index over the most played catalog names.
+
+    Every word start of a name is indexed, so "right pla" finds "Everything
+    in Its Right Place". One- and two-character prefixes, which would match
+    huge ranges, get precomputed answers. The cache loads ``popular_names``
+    and reloads it in a background thread once older than ``ttl`` seconds,
+    serving the previous snapshot (or nothing, before the first load) meanwhile.
+    """
+
+    def __init__(self, session_factory, ttl: float = 600.0, max_results: int = 20):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.max_results = max_results
+        self.hits = 0
+        self.misses = 0
+        self._keys: list[str] = []
+        self._entries: list[tuple] = []
+        self._short: dict[str, list[dict]] = {}
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def _popular(self, db: Session) -> list[tuple[str, int, str, int]]:
+        return db.execute(select(PopularName.kind, PopularName.item_id, PopularName.name, PopularName.play_count)).all()
+
+    def load(self) -> None:
+        db = self.session_factory()
+        try:
+            rows = self._popular(db)
+        finally:
+            db.close()
+
+        entries = []
+        for kind, item_id, name, count in rows:
+            folded = _fold(name)
+            words = folded.split(" ")
+            for i in range(len(words)):
+                entries.append((" ".join(words[i:]), -count, kind, item_id, name))
+        entries.sort()
+
+        short: dict[str, list[tuple]] = {}
+        for key, neg_count, kind, item_id, name in entries:
+            for length in (1, 2):
+                if len(key) >= length:
+                    short.setdefault(key[:length], []).append((neg_count, kind, item_id, name))
+        short_results = {
+            prefix: self._dedupe(sorted(matches))
+            for prefix, matches in short.items()
+        }
+
+        with self._lock:
+            self._keys = [entry[0] for entry in entries]
+            self._entries = entries
+            self._short = short_results
+            self._loaded_at = time.monotonic()
+
+    def _dedupe(self, matches) -> list[dict]:
+        seen = set()
+        results = []
+        for neg_count, kind, item_id, name in matches:
+            if (kind, item_id) in seen:
+                continue
+            seen.add((kind, item_id))
+            results.append({'type': kind, 'id': item_id, 'name': name, 'play_count': -neg_count})
+            if len(results) == self.max_results:
+                break
+        return results
+
+    def _refresh_in_background(self) -> None:
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.load()
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name="prefix-cache-refresh", daemon=True).start()
+
+    def warm(self) -> None:
+        """Start loading the cache without waiting for it."""
+        self._refresh_in_background()
+
+    def lookup(self, q: str, limit: int = 10) -> list[dict]:
+        # Never load inline: lookups run on the event loop. Until the first load
+        # finishes there are no suggestions.
+        if not self._loaded_at or time.monotonic() - self._loaded_at > self.ttl:
+            self._refresh_in_background()
+
+        prefix = _fold(q)
+        if not prefix:
+            return []
+        with self._lock:
+            keys, entries, short = self._keys, self._entries, self._short
+
+        if len(prefix) <= 2:
+            results = short.get(prefix, [])
+        else:
+            start = bisect_left(keys, prefix)
+            end = bisect_left(keys, prefix + "\uffff", lo=start)
+            results = self._dedupe(sorted(entry[1:] for entry in entries[start:end]))
+
+        if results:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return results[:limit]
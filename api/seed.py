@@ -1,10 +1,43 @@
+"""Seed the database.
+
+    python seed.py                                   # small fixture dataset
+    python seed.py --users 1000 --plays 10000        # 10M synthetic plays via COPY
+    python seed.py --users 100 --plays 1000 --trace trace.jsonl --trace-requests 50000
+
+Synthetic data follows Zipfian artist/track popularity and a daily listening
+curve (quiet nights, commute and evening peaks, busier weekends). ``--trace``
+also writes a JSON-lines request trace against the generated users that
+``loadgen.py`` replays.
+"""
+import argparse
 from datetime import datetime, timedelta, UTC
+import json
 import secrets
+import sys
+import time
+
+import numpy as np
 from passlib.hash import bcrypt
+from sqlalchemy import func, select, text
 from sqlalchemy.orm import Session
 
-from models import User, Artist, Album, Track, Station, Play
-from database import SessionLocal
+from catalog import normalize_name
+from models import User, Artist, Album, Track, Station, Play, Rating
+from database import SessionLocal, engine
+
+ALBUMS_PER_ARTIST = 3
+TRACKS_PER_ALBUM = 10
+TRACKS_PER_ARTIST = ALBUMS_PER_ARTIST * TRACKS_PER_ALBUM
+PASSWORD = "password123"
+
+# Relative listening activity per UTC hour and per weekday (Monday first)
+HOUR_WEIGHTS = np.array([
+    2, 1, 1, 0.5, 0.5, 1, 3, 6, 8, 7, 6, 6,
+    7, 7, 6, 6, 7, 8, 9, 10, 10, 9, 7, 4
+], dtype=np.float64)
+WEEKDAY_WEIGHTS = np.array([0.9, 0.9, 0.95, 1.0, 1.1, 1.3, 1.2], dtype=np.float64)
+RATINGS = [Rating.UNRATED, Rating.LIKE, Rating.BAN, Rating.TIRED]
+RATING_WEIGHTS = np.array([0.85, 0.12, 0.02, 0.01])
 
 def seed_database():
     db = SessionLocal()
@@ -12,22 +45,24 @@ def seed_database():
         # Create test user
         test_user = User(
             email="test@example.com",
-            password_hash=bcrypt.hash("password123"),
+            password_hash=bcrypt.hash(PASSWORD),
             api_key=secrets.token_urlsafe(32),
+            is_verified=True,
             created_at=datetime.now(UTC)
         )
         db.add(test_user)
         db.flush()
 
-        # Create some artists with MusicBrainz IDs
-        # Create artists
+        # Create artists with MusicBrainz IDs
         radiohead = Artist(
             name="Radiohead",
+            name_normalized=normalize_name("Radiohead"),
             mbid="a74b1b7f-71a5-4011-9441-d0b5e4122711",
             validated=datetime.now(UTC)
         )
         boards = Artist(
             name="Boards of Canada",
+            name_normalized=normalize_name("Boards of Canada"),
             mbid="69158f97-4c07-4c4e-baf8-4e4ab1ed666e",
             validated=datetime.now(UTC)
         )
@@ -35,16 +70,17 @@ def seed_database():
         db.add(boards)
         db.flush()
 
-        # Create some albums
         # Create albums
         kid_a = Album(
             title="Kid A",
+            title_normalized=normalize_name("Kid A"),
             artist_id=radiohead.id,
             mbid="b1da184c-5bf9-3f41-9ac8-0bf279ce2f45",
             validated=datetime.now(UTC)
         )
         mhtrtc = Album(
             title="Music Has the Right to Children",
+            title_normalized=normalize_name("Music Has the Right to Children"),
             artist_id=boards.id,
             mbid="f7d97e6d-6ace-34a4-a891-fb95f5a2b6ce",
             validated=datetime.now(UTC)
@@ -53,27 +89,32 @@ def seed_database():
         db.add(mhtrtc)
         db.flush()
 
-        # Create some tracks
         # Create tracks
         track1 = Track(
             title="Everything in Its Right Place",
+            title_normalized=normalize_name("Everything in Its Right Place"),
             artist_id=radiohead.id,
             album_id=kid_a.id,
             mbid="2f250ed2-6285-403e-9c79-5cf2b997de39",
+            duration=251,
             validated=datetime.now(UTC)
         )
         track2 = Track(
             title="Kid A",
+            title_normalized=normalize_name("Kid A"),
             artist_id=radiohead.id,
             album_id=kid_a.id,
             mbid="105e11d7-29f2-4972-8df6-8961b2f5e07c",
+            duration=284,
             validated=datetime.now(UTC)
         )
         track3 = Track(
             title="Roygbiv",
+            title_normalized=normalize_name("Roygbiv"),
             artist_id=boards.id,
             album_id=mhtrtc.id,
             mbid="c481f44b-3a2d-4a85-a896-419c56f10002",
+            duration=151,
             validated=datetime.now(UTC)
         )
         tracks = [track1, track2, track3]
@@ -100,19 +141,268 @@ def seed_database():
                         user_id=test_user.id,
                         track_id=track.id,
                         station_id=station.id,
-                        played_at=base_time + timedelta(hours=i*24 + j*8)
+                        duration=track.duration,
+                        created_at=base_time + timedelta(hours=i*24 + j*8)
                     )
                 )
         db.bulk_save_objects(plays)
-        
+
         db.commit()
         print("Database seeded successfully!")
-        
+
     except Exception as e:
         print(f"Error seeding database: {e}")
         db.rollback()
     finally:
         db.close()
 
+def zipf_weights(n: int, s: float) -> np.ndarray:
+    weights = 1.0 / np.arange(1, n + 1) ** s
+    return weights / weights.sum()
+
+class CsvStream:
+    """File-like object feeding COPY from a generator of CSV text chunks."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = ""
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, ""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+def copy_rows(table: str, columns: list[str], chunks) -> None:
+    """Stream CSV chunks into a table with COPY, in one transaction."""
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+                CsvStream(chunks)
+            )
+        connection.commit()
+    finally:
+        connection.close()
+
+def _next_id(db: Session, model) -> int:
+    return (db.scalar(select(func.max(model.id))) or 0) + 1
+
+def _reset_sequence(db: Session, table: str) -> None:
+    db.execute(text(
+        f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT COALESCE(MAX(id), 1) FROM {table}))"
+    ))
+
+class SyntheticCatalog:
+    """Deterministic names and ids for the generated catalog.
+
+    Artist i owns albums i*3 .. i*3+2 and tracks i*30 .. i*30+29, so any
+    sampled track index maps straight to its ids and names.
+    """
+
+    def __init__(self, artists: int, stations: int, artist_base: int, album_base: int,
+                 track_base: int, station_base: int, tag: str):
+        self.artists = artists
+        self.stations = stations
+        self.artist_base = artist_base
+        self.album_base = album_base
+        self.track_base = track_base
+        self.station_base = station_base
+        self.tag = tag
+
+    def artist_name(self, i: int) -> str:
+        return f"Artist {self.tag}-{i:06d}"
+
+    def album_title(self, i: int) -> str:
+        return f"Album {self.tag}-{i:07d}"
+
+    def track_title(self, i: int) -> str:
+        return f"Track {self.tag}-{i:08d}"
+
+    def station_name(self, i: int) -> str:
+        return f"Station {self.tag}-{i:05d}"
+
+    def play_body(self, track: int, station: int, rating: int, duration: int) -> dict:
+        artist = track // TRACKS_PER_ARTIST
+        return {
+            "title": self.track_title(track),
+            "artist": self.artist_name(artist),
+            "album": self.album_title(track // TRACKS_PER_ALBUM),
+            "station": self.station_name(station),
+            "rating": rating,
+            "duration": duration
+        }
+
+class PlaySampler:
+    """Draws plays with Zipfian popularity and realistic timestamps."""
+
+    def __init__(self, rng: np.random.Generator, catalog: SyntheticCatalog, days: int, zipf: float):
+        self.rng = rng
+        self.catalog = catalog
+        self.artist_p = zipf_weights(catalog.artists, zipf)
+        self.within_p = zipf_weights(TRACKS_PER_ARTIST, zipf)
+        self.station_p = zipf_weights(catalog.stations, zipf)
+        self.hour_p = HOUR_WEIGHTS / HOUR_WEIGHTS.sum()
+        midnight = int(datetime.now(UTC).replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
+        day_starts = midnight - 86400 * np.arange(days, 0, -1)
+        weekday = ((day_starts // 86400) + 3) % 7  # 1970-01-01 was a Thursday
+        self.day_starts = day_starts
+        self.day_p = WEEKDAY_WEIGHTS[weekday] / WEEKDAY_WEIGHTS[weekday].sum()
+        self.durations = np.clip(rng.normal(240, 60, catalog.artists * TRACKS_PER_ARTIST), 60, 900).astype(np.int32)
+
+    def tracks(self, n: int) -> np.ndarray:
+        artists = self.rng.choice(self.catalog.artists, size=n, p=self.artist_p)
+        return artists * TRACKS_PER_ARTIST + self.rng.choice(TRACKS_PER_ARTIST, size=n, p=self.within_p)
+
+    def stations(self, n: int) -> np.ndarray:
+        return self.rng.choice(self.catalog.stations, size=n, p=self.station_p)
+
+    def ratings(self, n: int) -> np.ndarray:
+        return self.rng.choice(len(RATINGS), size=n, p=RATING_WEIGHTS)
+
+    def timestamps(self, n: int) -> np.ndarray:
+        days = self.day_starts[self.rng.choice(len(self.day_starts), size=n, p=self.day_p)]
+        hours = self.rng.choice(24, size=n, p=self.hour_p)
+        return days + hours * 3600 + self.rng.integers(0, 3600, size=n)
+
+def generate(users: int, plays_per_user: int, artists: int = 20000, stations: int = 2000,
+             days: int = 365, zipf: float = 1.1, seed: int = 42,
+             chunk_size: int = 500_000) -> tuple[list[tuple[int, str]], PlaySampler]:
+    """Load a synthetic dataset with COPY.
+
+    Returns the generated (user id, api key) pairs and the sampler, which
+    knows the catalog and can draw more plays for a trace.
+    """
+    rng = np.random.default_rng(seed)
+    now = datetime.now(UTC).strftime("%Y-%m-%d %H:%M:%S")
+    tag = secrets.token_hex(3)
+
+    db = SessionLocal()
+    try:
+        catalog = SyntheticCatalog(
+            artists, stations,
+            _next_id(db, Artist), _next_id(db, Album), _next_id(db, Track), _next_id(db, Station), tag
+        )
+        user_base = _next_id(db, User)
+    finally:
+        db.close()
+
+    started = time.perf_counter()
+    copy_rows("artists", ["id", "name", "name_normalized", "created_at", "updated_at"], (
+        f"{catalog.artist_base + i},{catalog.artist_name(i)},{normalize_name(catalog.artist_name(i))},{now},{now}\n"
+        for i in range(artists)
+    ))
+    copy_rows("albums", ["id", "title", "title_normalized", "artist_id", "created_at", "updated_at"], (
+        f"{catalog.album_base + i},{catalog.album_title(i)},{normalize_name(catalog.album_title(i))},"
+        f"{catalog.artist_base + i // ALBUMS_PER_ARTIST},{now},{now}\n"
+        for i in range(artists * ALBUMS_PER_ARTIST)
+    ))
+    sampler = PlaySampler(rng, catalog, days, zipf)
+    copy_rows("tracks", ["id", "title", "title_normalized", "artist_id", "album_id", "duration", "created_at", "updated_at"], (
+        f"{catalog.track_base + i},{catalog.track_title(i)},{normalize_name(catalog.track_title(i))},"
+        f"{catalog.artist_base + i // TRACKS_PER_ARTIST},{catalog.album_base + i // TRACKS_PER_ALBUM},"
+        f"{sampler.durations[i]},{now},{now}\n"
+        for i in range(artists * TRACKS_PER_ARTIST)
+    ))
+    copy_rows("stations", ["id", "name", "created_at", "updated_at"], (
+        f"{catalog.station_base + i},{catalog.station_name(i)},{now},{now}\n"
+        for i in range(stations)
+    ))
+
+    password_hash = bcrypt.hash(PASSWORD)
+    accounts = [(user_base + i, secrets.token_urlsafe(32)) for i in range(users)]
+    copy_rows("users", ["id", "email", "password_hash", "api_key", "is_active", "is_verified", "created_at", "updated_at"], (
+        f"{user_id},load-{tag}-{user_id}@example.com,{password_hash},{api_key},true,true,{now},{now}\n"
+        for user_id, api_key in accounts
+    ))
+    print(f"Catalog and {users} users loaded in {time.perf_counter() - started:.1f}s")
+
+    rating_names = np.array([rating.name for rating in RATINGS])
+
+    def play_chunks():
+        total = users * plays_per_user
+        for start in range(0, total, chunk_size):
+            n = min(chunk_size, total - start)
+            user_ids = user_base + (np.arange(start, start + n) // plays_per_user)
+            tracks = sampler.tracks(n)
+            timestamps = sampler.timestamps(n).astype("datetime64[s]").astype(str)
+            yield "".join(
+                f"{u},{catalog.track_base + t},{catalog.station_base + s},{r},{d},{ts}\n"
+                for u, t, s, r, d, ts in zip(
+                    user_ids.tolist(), tracks.tolist(), sampler.stations(n).tolist(),
+                    rating_names[sampler.ratings(n)].tolist(), sampler.durations[tracks].tolist(), timestamps.tolist()
+                )
+            )
+            print(f"  {start + n:,}/{total:,} plays generated ({time.perf_counter() - started:.0f}s)", file=sys.stderr)
+
+    copy_rows("plays", ["user_id", "track_id", "station_id", "rating", "duration", "created_at"], play_chunks())
+
+    db = SessionLocal()
+    try:
+        for table in ("users", "artists", "albums", "tracks", "stations"):
+            _reset_sequence(db, table)
+        db.commit()
+        db.execute(text("ANALYZE"))
+    finally:
+        db.close()
+    print(f"Loaded {users * plays_per_user:,} plays in {time.perf_counter() - started:.1f}s")
+    return accounts, sampler
+
+def write_trace(path: str, accounts: list[tuple[int, str]], sampler: PlaySampler, requests: int,
+                rps: float = 50.0, mix: tuple[float, float, float] = (0.7, 0.25, 0.05)) -> None:
+    """Write a request trace for the generated users.
+
+    Arrivals are a Poisson process at ``rps``; each request is a play
+    ingest, a history page or a stats call in ``mix`` proportions. Heavy
+    users get more requests (Zipf over users).
+    """
+    catalog, rng = sampler.catalog, sampler.rng
+    arrivals = np.cumsum(rng.exponential(1.0 / rps, size=requests))
+    who = rng.choice(len(accounts), size=requests, p=zipf_weights(len(accounts), 0.8))
+    kinds = rng.choice(3, size=requests, p=np.array(mix) / sum(mix))
+    tracks, stations, ratings = sampler.tracks(requests), sampler.stations(requests), sampler.ratings(requests)
+    # Most history reads are the first page, a few scroll back
+    offsets = np.minimum(rng.geometric(0.6, size=requests) - 1, 20) * 50
+
+    with open(path, "w") as f:
+        for i in range(requests):
+            api_key = accounts[who[i]][1]
+            if kinds[i] == 0:
+                record = {"method": "POST", "path": "/track/play",
+                          "body": catalog.play_body(int(tracks[i]), int(stations[i]), int(ratings[i]),
+                                                    int(sampler.durations[tracks[i]]))}
+            elif kinds[i] == 1:
+                record = {"method": "GET", "path": f"/plays?limit=50&offset={int(offsets[i])}"}
+            else:
+                record = {"method": "GET", "path": "/api/stats"}
+            f.write(json.dumps({"t": round(float(arrivals[i]), 4), "api_key": api_key, **record}) + "\n")
+    print(f"Wrote {requests:,} requests over {arrivals[-1]:.0f}s to {path}")
+
 if __name__ == "__main__":
-    seed_database()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, help="generate this many synthetic users")
+    parser.add_argument("--plays", type=int, default=1000, help="plays per synthetic user")
+    parser.add_argument("--artists", type=int, default=20000)
+    parser.add_argument("--stations", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=365, help="spread plays over this many past days")
+    parser.add_argument("--zipf", type=float, default=1.1, help="popularity skew exponent")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--trace", help="also write a request trace (JSON lines) to this path")
+    parser.add_argument("--trace-requests", type=int, default=100_000)
+    parser.add_argument("--trace-rps", type=float, default=50.0)
+    args = parser.parse_args()
+
+    if args.users is None:
+        seed_database()
+    else:
+        accounts, sampler = generate(args.users, args.plays, args.artists, args.stations, args.days, args.zipf, args.seed)
+        if args.trace:
+            write_trace(args.trace, accounts, sampler, args.trace_requests, args.trace_rps)
+        print("Derived tables are not populated; run `python hll.py rebuild` if you need them.")
@@ -0,0 +1,413 @@
+"""User-sharded storage for plays.
+
+With ``SHARD_DATABASE_URLS`` set, each user's plays and daily sketches live on
+one of N shard databases. The primary (``DATABASE_URL``) is the directory: it
+keeps users, the ``user_shards`` map and the catalog. Catalog ids are
+allocated there, and the rows a shard's plays reference are copied to that
+shard on first use, so per-user queries join locally. The primary may itself
+be listed as a shard.
+
+New users go to shard ``user_id % N`` and stay there unless moved:
+
+    python sharding.py move USER_ID SHARD
+    python sharding.py sync-catalog     # refresh catalog copies after enrichment
+
+Cross-user queries (charts, site-wide unique counts) scatter to every shard
+in parallel and merge the partial results. Without shard URLs every function
+here falls back to the single database.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, UTC
+import os
+import threading
+import time
+
+from sqlalchemy import create_engine, select, func, update, delete, inspect
+from sqlalchemy.orm import Session, sessionmaker
+
+import aggregates
+import crud
+import hll
+from database import SessionLocal, insert, read_session
+from models import (
+    User, Artist, Album, Track, Station, Play, UserDailySketch, UserDailyPlays, UserHourlyPlays, UserShard,
+    WebhookSubscription, WebhookOutbox
+)
+from schemas import PlayCreate
+
+SHARD_URLS = [url.strip() for url in os.getenv("SHARD_DATABASE_URLS", "").split(",") if url.strip()]
+SHARD_MAP_TTL = 30.0  # seconds a worker trusts its cached user -> shard entry
+CHARTS_TTL = float(os.getenv("CHARTS_TTL", "300"))  # seconds a worker serves a chart before recounting
+CHARTS_MAX_DAYS = 90
+CHARTS_MAX_LIMIT = 100
+CATALOG_MODELS = (Artist, Album, Track, Station)  # in foreign key order
+
+shard_engines = [
+    create_engine(url, pool_size=10, max_overflow=20, pool_timeout=60, pool_recycle=3600)
+    for url in SHARD_URLS
+]
+shard_sessions = [sessionmaker(autocommit=False, autoflush=False, bind=e) for e in shard_engines]
+
+_shard_cache: dict[int, tuple[float, int]] = {}
+_cache_lock = threading.Lock()
+_charts: dict[tuple[str, int], tuple[float, list[dict]]] = {}  # (kind, days) -> (counted at, top entries)
+_chart_locks: dict[tuple[str, int], threading.Lock] = {}
+
+def enabled() -> bool:
+    return bool(shard_sessions)
+
+def _row_values(obj) -> dict:
+    return {attr.key: getattr(obj, attr.key) for attr in inspect(type(obj)).column_attrs}
+
+def _snapshot(objs) -> list[tuple[type, dict]]:
+    """Column values of ORM objects, readable after their session commits."""
+    return [(type(obj), _row_values(obj)) for obj in objs]
+
+def _copy_rows(db: Session, objs, overwrite: bool = False) -> None:
+    """Insert rows by primary key, keeping (or overwriting) existing copies.
+
+    objs are ORM objects or ``_snapshot`` pairs.
+    """
+    for obj in objs:
+        model, values = obj if isinstance(obj, tuple) else (type(obj), _row_values(obj))
+        statement = insert(model).values(values)
+        keys = [column.name for column in model.__table__.primary_key]
+        if overwrite:
+            statement = statement.on_conflict_do_update(index_elements=keys, set_=values)
+        else:
+            statement = statement.on_conflict_do_nothing(index_elements=keys)
+        db.execute(statement)
+
+def assign_shard(db: Session, user: User) -> int | None:
+    """Place a new user on a shard and copy their user row there."""
+    if not enabled():
+        return None
+    shard = user.id % len(shard_sessions)
+    db.execute(insert(UserShard).values(user_id=user.id, shard=shard).on_conflict_do_nothing(index_elements=["user_id"]))
+    db.commit()
+    shard = shard_for_user(user.id, db)
+    shard_db = shard_sessions[shard]()
+    try:
+        _copy_rows(shard_db, [user])
+        shard_db.commit()
+    finally:
+        shard_db.close()
+    return shard
+
+def shard_for_user(user_id: int, db: Session | None = None) -> int:
+    """The user's shard, from a short-lived cache of the directory."""
+    now = time.monotonic()
+    cached = _shard_cache.get(user_id)
+    if cached and now - cached[0] < SHARD_MAP_TTL:
+        return cached[1]
+
+    own = db is None
+    db = db or SessionLocal()
+    try:
+        shard = db.scalar(select(UserShard.shard).where(UserShard.user_id == user_id))
+        if shard is None:
+            # Users created before sharding was enabled
+            user = db.get(User, user_id)
+            return assign_shard(db, user)
+    finally:
+        if own:
+            db.close()
+    with _cache_lock:
+        _shard_cache[user_id] = (now, shard)
+    return shard
+
+def user_session(user_id: int) -> Session:
+    """A read-write session on the database holding the user's plays."""
+    if not enabled():
+        return SessionLocal()
+    return shard_sessions[shard_for_user(user_id)]()
+
+def user_read_session(user_id: int, written_at: datetime | None = None) -> Session:
+    """Like ``user_session``, but unsharded deployments may read from a replica."""
+    if not enabled():
+        return read_session(written_at)
+    return shard_sessions[shard_for_user(user_id)]()
+
+def create_play(db: Session, play_data: PlayCreate, user_id: int) -> Play:
+    """``crud.create_play`` with the catalog on the primary and the play on the user's shard."""
+    if not enabled():
+        return crud.create_play(db, play_data, user_id)
+
+    artist, album, track, station = crud.resolve_catalog(db, play_data)
+    catalog_rows = _snapshot([artist, album, track, station])
+    # Commit first: the shard may be this same database, and would wait on our uncommitted rows
+    db.commit()
+    shard_db = user_session(user_id)
+    try:
+        _copy_rows(shard_db, catalog_rows)
+        play = crud.add_play(
+            shard_db, play_data, user_id,
+            catalog_rows[2][1]["id"], catalog_rows[0][1]["id"], catalog_rows[3][1]["id"]
+        )
+        shard_db.commit()
+        play.id  # load before the session closes
+        return play
+    finally:
+        shard_db.close()
+
+def create_plays(db: Session, plays: list[tuple[int, PlayCreate, datetime]], before_write=None) -> int:
+    """Batch ``create_play`` for (user_id, play_data, played_at) tuples. Returns plays written.
+
+    Each distinct catalog entry is resolved once and every database gets its
+    plays in one transaction. ``before_write(session, indexes)`` runs first in
+    each of those transactions and returns the indexes still to write.
+    """
+    groups: dict[int | None, list[int]] = {}
+    for index, (user_id, _, _) in enumerate(plays):
+        groups.setdefault(shard_for_user(user_id, db) if enabled() else None, []).append(index)
+    sessions = {shard: db if shard is None else shard_sessions[shard]() for shard in groups}
+    try:
+        if before_write:
+            groups = {shard: before_write(sessions[shard], indexes) for shard, indexes in groups.items()}
+
+        resolved: dict[tuple, list[tuple[type, dict]]] = {}
+        catalog_rows: dict[int, list[tuple[type, dict]]] = {}
+        for indexes in groups.values():
+            for index in indexes:
+                play_data = plays[index][1]
+                key = (play_data.artist, play_data.album, play_data.title, play_data.station)
+                if key not in resolved:
+                    resolved[key] = _snapshot(crud.resolve_catalog(db, play_data))
+                catalog_rows[index] = resolved[key]
+        if enabled():
+            # As in create_play: the directory commits before any shard copies its rows
+            db.commit()
+
+        written = 0
+        for shard, indexes in groups.items():
+            session = sessions[shard]
+            if shard is not None:
+                copies = {(model, values["id"]): (model, values) for i in indexes for model, values in catalog_rows[i]}
+                _copy_rows(session, list(copies.values()))
+            if indexes:
+                crud.add_plays(session, [
+                    (
+                        plays[i][0], plays[i][1],
+                        catalog_rows[i][2][1]["id"], catalog_rows[i][0][1]["id"], catalog_rows[i][3][1]["id"],
+                        plays[i][2]
+                    )
+                    for i in indexes
+                ])
+            session.commit()
+            written += len(indexes)
+        return written
+    finally:
+        for shard, session in sessions.items():
+            if shard is not None:
+                session.close()
+
+def scatter(fn, read_only: bool = True) -> list:
+    """Run fn(session) on every shard in parallel (or once, unsharded) and return the results."""
+    if not enabled():
+        db = read_session() if read_only else SessionLocal()
+        try:
+            return [fn(db)]
+        finally:
+            db.close()
+
+    def run(factory):
+        db = factory()
+        try:
+            return fn(db)
+        finally:
+            db.close()
+
+    with ThreadPoolExecutor(max_workers=len(shard_sessions)) as pool:
+        return list(pool.map(run, shard_sessions))
+
+def _count_charts(kind: str, days: int, limit: int) -> list[dict]:
+    since = datetime.now(UTC) - timedelta(days=days)
+    column = Track.artist_id if kind == "artist" else Play.track_id
+
+    def partial(db: Session) -> list[tuple[int, int]]:
+        # Full per-shard counts, not per-shard top N, so the merged ranking is exact
+        return db.execute(
+            select(column, func.count()).select_from(Play).join(Play.track)
+            .where(Play.created_at >= since).group_by(column)
+        ).all()
+
+    totals: dict[int, int] = {}
+    for rows in scatter(partial):
+        for item_id, count in rows:
+            totals[item_id] = totals.get(item_id, 0) + count
+    top = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+    model, name = (Artist, Artist.name) if kind == "artist" else (Track, Track.title)
+    db = read_session()
+    try:
+        names = dict(db.execute(select(model.id, name).where(model.id.in_([item_id for item_id, _ in top]))).all())
+    finally:
+        db.close()
+    return [{'id': item_id, 'name': names.get(item_id, ""), 'play_count': count} for item_id, count in top]
+
+def top_charts(kind: str, days: int = 7, limit: int = 20) -> list[dict]:
+    """Most played artists or tracks site-wide over the last `days` days (at most CHARTS_MAX_DAYS).
+
+    Each worker counts a chart at most once per CHARTS_TTL and serves every
+    limit from that count; concurrent requests for the same chart wait for it.
+    """
+    key = (kind, min(days, CHARTS_MAX_DAYS))
+    with _cache_lock:
+        cached = _charts.get(key)
+        lock = _chart_locks.setdefault(key, threading.Lock())
+    if cached is None or time.monotonic() - cached[0] >= CHARTS_TTL:
+        with lock:
+            cached = _charts.get(key)
+            if cached is None or time.monotonic() - cached[0] >= CHARTS_TTL:
+                cached = (time.monotonic(), _count_charts(kind, key[1], CHARTS_MAX_LIMIT))
+                _charts[key] = cached
+    return cached[1][:limit]
+
+def site_unique(start: date | None = None, end: date | None = None) -> dict:
+    """Site-wide distinct counts by merging every shard's site-level daily sketches."""
+    rows = []
+    for shard_rows in scatter(lambda db: hll.load_sketches(db, None, start, end)):
+        rows.extend(shard_rows)
+    return hll.estimate_from_sketches(rows)
+
+def move_user(user_id: int, target: int, batch_size: int = 10000) -> int:
+    """Move a user's plays to another shard. Returns plays moved.
+
+    Plays are copied, the map is flipped, and after workers' cached entries
+    have expired any plays that still landed on the old shard are copied too
+    before the old rows are deleted.
+    """
+    directory = SessionLocal()
+    try:
+        source = shard_for_user(user_id, directory)
+        if source == target:
+            return 0
+        user = directory.get(User, user_id)
+        source_db, target_db = shard_sessions[source](), shard_sessions[target]()
+        try:
+            _copy_rows(target_db, [user])
+            target_db.commit()
+            moved, last_id = _copy_plays(source_db, target_db, user_id, 0, batch_size)
+            # Before the flip, so plays landing on the target meanwhile already queue events
+            subscription_ids = _copy_subscriptions(source_db, target_db, user_id)
+
+            directory.execute(
+                update(UserShard).where(UserShard.user_id == user_id).values(shard=target, assigned_at=datetime.now(UTC))
+            )
+            directory.commit()
+            _shard_cache.pop(user_id, None)
+            # Don't hold the copy's read transaction open on the source while workers catch up
+            source_db.commit()
+            time.sleep(SHARD_MAP_TTL)
+
+            stragglers, _ = _copy_plays(source_db, target_db, user_id, last_id, batch_size)
+            hll.rebuild_sketches(target_db, user_id)
+            aggregates.rebuild(target_db, user_id)
+            _move_outbox(source_db, target_db, subscription_ids)
+            source_db.execute(delete(Play).where(Play.user_id == user_id))
+            source_db.execute(delete(UserDailySketch).where(UserDailySketch.user_id == user_id))
+            source_db.execute(delete(UserDailyPlays).where(UserDailyPlays.user_id == user_id))
+            source_db.execute(delete(UserHourlyPlays).where(UserHourlyPlays.user_id == user_id))
+            source_db.commit()
+            return moved + stragglers
+        finally:
+            source_db.close()
+            target_db.close()
+    finally:
+        directory.close()
+
+def _copy_plays(source_db: Session, target_db: Session, user_id: int, after_id: int, batch_size: int) -> tuple[int, int]:
+    """Copy plays with id > after_id. Play ids are per shard, so copies get new ones."""
+    copied = 0
+    while True:
+        plays = source_db.scalars(
+            select(Play).where(Play.user_id == user_id, Play.id > after_id).order_by(Play.id).limit(batch_size)
+        ).all()
+        if not plays:
+            return copied, after_id
+        tracks = source_db.scalars(select(Track).where(Track.id.in_({play.track_id for play in plays}))).all()
+        _copy_rows(target_db, source_db.scalars(select(Artist).where(Artist.id.in_({t.artist_id for t in tracks}))).all())
+        _copy_rows(target_db, source_db.scalars(select(Album).where(Album.id.in_({t.album_id for t in tracks}))).all())
+        _copy_rows(target_db, tracks)
+        _copy_rows(target_db, source_db.scalars(select(Station).where(Station.id.in_({p.station_id for p in plays}))).all())
+        target_db.execute(insert(Play), [
+            {key: value for key, value in _row_values(play).items() if key != "id"} for play in plays
+        ])
+        target_db.commit()
+        copied += len(plays)
+        after_id = plays[-1].id
+
+def _copy_subscriptions(source_db: Session, target_db: Session, user_id: int) -> dict[int, int]:
+    """Copy a user's webhook subscriptions. Returns source id -> target id."""
+    subscription_ids = {}
+    for subscription in source_db.scalars(select(WebhookSubscription).where(WebhookSubscription.user_id == user_id)):
+        values = {key: value for key, value in _row_values(subscription).items() if key != "id"}
+        subscription_ids[subscription.id] = target_db.scalar(
+            insert(WebhookSubscription).values(values).returning(WebhookSubscription.id)
+        )
+    target_db.commit()
+    return subscription_ids
+
+def _move_outbox(source_db: Session, target_db: Session, subscription_ids: dict[int, int]) -> None:
+    """Move undelivered webhook events to the target and drop the source subscriptions."""
+    if not subscription_ids:
+        return
+    # Locked, so the source's webhook workers skip them until they're gone
+    events = source_db.scalars(
+        select(WebhookOutbox)
+        .where(WebhookOutbox.subscription_id.in_(subscription_ids), WebhookOutbox.status.in_(["pending", "dead"]))
+        .with_for_update()
+    ).all()
+    if events:
+        target_db.execute(insert(WebhookOutbox), [
+            {
+                **{key: value for key, value in _row_values(event).items() if key != "id"},
+                'subscription_id': subscription_ids[event.subscription_id]
+            }
+            for event in events
+        ])
+        target_db.commit()
+    source_db.execute(delete(WebhookSubscription).where(WebhookSubscription.id.in_(subscription_ids)))
+
+def sync_catalog(batch_size: int = 5000) -> int:
+    """Overwrite each shard's catalog copies with the directory's current rows."""
+    synced = 0
+    directory = SessionLocal()
+    try:
+        for factory in shard_sessions:
+            shard_db = factory()
+            try:
+                for model in CATALOG_MODELS:
+                    last_id = 0
+                    while True:
+                        ids = shard_db.scalars(
+                            select(model.id).where(model.id > last_id).order_by(model.id).limit(batch_size)
+                        ).all()
+                        if not ids:
+                            break
+                        _copy_rows(shard_db, directory.scalars(select(model).where(model.id.in_(ids))).all(), overwrite=True)
+                        shard_db.commit()
+                        synced += len(ids)
+                        last_id = ids[-1]
+            finally:
+                shard_db.close()
+    finally:
+        directory.close()
+    return synced
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage user shards")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    move = subcommands.add_parser("move", help="move a user's plays to another shard")
+    move.add_argument("user_id", type=int)
+    move.add_argument("shard", type=int)
+    subcommands.add_parser("sync-catalog", help="refresh catalog copies on every shard")
+    args = parser.parse_args()
+
+    if not enabled():
+        parser.error("SHARD_DATABASE_URLS is not set")
+    if args.command == "move":
+        print(f"Moved {move_user(args.user_id, args.shard)} plays to shard {args.shard}")
+    else:
+        print(f"Synced {sync_catalog()} catalog rows")
@@ -0,0 +1,314 @@
+"""Batch job building "listeners also played" neighbours for artists and tracks.
+
+Two plays co-occur when the same user played them within ``window`` seconds of
+each other. Pair counts are accumulated in ``cooccurrence_counts`` and turned
+into a top-N neighbour table, ``similar_items``, so ``GET /artists/{id}/similar``
+is a single primary key range scan.
+
+Refreshes are incremental: only plays above the ``job_watermarks`` entry are
+read (plus the preceding window of each affected user's history, to pair the
+new plays with), and only the neighbour lists of items touched by new plays
+are recomputed.
+
+    python similarity.py                    # incremental refresh, both kinds
+    python similarity.py --kind artist --measure pmi --full
+"""
+import argparse
+from datetime import datetime, timedelta, UTC
+from typing import TYPE_CHECKING
+
+import numpy as np
+from sqlalchemy import select, delete, func, or_, union_all
+from sqlalchemy.orm import Session
+
+from database import insert
+from models import Play, Track, Artist, CooccurrenceCount, SimilarItem, JobWatermark
+
+if TYPE_CHECKING:
+    from scipy import sparse
+
+KINDS = ("artist", "track")
+MEASURES = ("cosine", "pmi")
+DEFAULT_WINDOW = 30 * 60  # seconds
+DEFAULT_TOP_N = 20
+MAX_PARTNERS = 50  # cap on the plays paired with a new play, on each side of it
+MIN_PMI_COUNT = 2  # PMI over-rewards pairs seen once
+BATCH_SIZE = 200_000
+_USER_SPAN = 1 << 40  # separates users when their timelines are flattened into one array
+_PAIR_SPAN = 1 << 32  # packs an (a, b) id pair into one int64
+
+def _watermark_name(kind: str) -> str:
+    return f"similarity:{kind}"
+
+def get_watermark(db: Session, name: str) -> int:
+    return db.scalar(select(JobWatermark.last_id).where(JobWatermark.name == name)) or 0
+
+def set_watermark(db: Session, name: str, last_id: int) -> None:
+    db.execute(
+        insert(JobWatermark).values(name=name, last_id=last_id, updated_at=datetime.now(UTC))
+        .on_conflict_do_update(
+            index_elements=[JobWatermark.name],
+            set_={'last_id': last_id, 'updated_at': datetime.now(UTC)}
+        )
+    )
+
+def _item_column(kind: str):
+    return Track.artist_id if kind == "artist" else Play.track_id
+
+def _load_batch(db: Session, kind: str, after_id: int, window: int) -> tuple[np.ndarray, ...] | None:
+    """Load the next batch of new plays plus the older plays around them they pair with.
+
+    Returns parallel arrays sorted by (user, time): user ids, epoch seconds,
+    item ids, an is-new mask, and the highest play id in the batch.
+    """
+    item = _item_column(kind)
+    new_rows = db.execute(
+        select(Play.id, Play.user_id, Play.created_at, item)
+        .join(Play.track)
+        .where(Play.id > after_id)
+        .order_by(Play.id)
+        .limit(BATCH_SIZE)
+    ).all()
+    if not new_rows:
+        return None
+
+    last_id = new_rows[-1][0]
+    user_ids = {row[1] for row in new_rows}
+    earliest = min(row[2] for row in new_rows)
+    latest = max(row[2] for row in new_rows)
+    context_rows = db.execute(
+        select(Play.id, Play.user_id, Play.created_at, item)
+        .join(Play.track)
+        .where(
+            Play.id <= after_id,
+            Play.user_id.in_(user_ids),
+            Play.created_at >= earliest - timedelta(seconds=window),
+            Play.created_at <= latest + timedelta(seconds=window)
+        )
+    ).all()
+
+    rows = context_rows + new_rows
+    users = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+    # created_at is stored as naive UTC
+    times = np.fromiter((int(row[2].replace(tzinfo=UTC).timestamp()) for row in rows), dtype=np.int64, count=len(rows))
+    items = np.fromiter((row[3] for row in rows), dtype=np.int64, count=len(rows))
+    is_new = np.zeros(len(rows), dtype=bool)
+    is_new[len(context_rows):] = True
+
+    order = np.lexsort((times, users))
+    return users[order], times[order], items[order], is_new[order], last_id
+
+def _expand(anchors: np.ndarray, partners_per_play: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Repeat each anchor once per partner, alongside offsets 0, 1, ... within its run."""
+    total = int(partners_per_play.sum())
+    anchor_idx = np.repeat(anchors, partners_per_play)
+    offsets = np.arange(total) - np.repeat(np.cumsum(partners_per_play) - partners_per_play, partners_per_play)
+    return anchor_idx, offsets
+
+def window_pairs(users: np.ndarray, times: np.ndarray, items: np.ndarray,
+                 is_new: np.ndarray, window: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Count item pairs played by the same user within ``window`` seconds.
+
+    Arrays must be sorted by (user, time). Each new play is paired with up to
+    MAX_PARTNERS earlier plays of the same user inside the window, and with up
+    to MAX_PARTNERS later plays that are not new (a backfilled play can land
+    before plays already counted). Every pair involving a new play is counted
+    once, and pairs of two old plays not at all, so old pairs are never counted
+    twice across refreshes. Returns (a, b, count) with a < b.
+    """
+    _, user_rank = np.unique(users, return_inverse=True)
+    timeline = user_rank.astype(np.int64) * _USER_SPAN + times
+    positions = np.arange(len(timeline))
+    new = positions[is_new]
+
+    # Earlier partners i-1, i-2, ... starts[i]
+    starts = np.searchsorted(timeline, timeline[new] - window, side="left")
+    starts = np.maximum(starts, new - MAX_PARTNERS)
+    later_idx, offsets = _expand(new, new - starts)
+    earlier_idx = later_idx - offsets - 1
+
+    # Later partners i+1, i+2, ... ends[i]-1, keeping the old ones (new ones pair backwards)
+    ends = np.searchsorted(timeline, timeline[new] + window, side="right")
+    ends = np.minimum(ends, new + 1 + MAX_PARTNERS)
+    anchor_idx, offsets = _expand(new, ends - new - 1)
+    following_idx = anchor_idx + offsets + 1
+    old = ~is_new[following_idx]
+
+    a = np.concatenate([items[earlier_idx], items[anchor_idx[old]]])
+    b = np.concatenate([items[later_idx], items[following_idx[old]]])
+    distinct = a != b
+    a, b = np.minimum(a, b)[distinct], np.maximum(a, b)[distinct]
+    keys, counts = np.unique(a * _PAIR_SPAN + b, return_counts=True)
+    return keys // _PAIR_SPAN, keys % _PAIR_SPAN, counts
+
+def _upsert_counts(db: Session, kind: str, a: np.ndarray, b: np.ndarray, counts: np.ndarray) -> None:
+    if not len(a):
+        return
+    stmt = insert(CooccurrenceCount)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[CooccurrenceCount.kind, CooccurrenceCount.item_a, CooccurrenceCount.item_b],
+        set_={'count': CooccurrenceCount.count + stmt.excluded.count}
+    )
+    for chunk in range(0, len(a), 10_000):
+        db.execute(stmt, [
+            {'kind': kind, 'item_a': int(x), 'item_b': int(y), 'count': int(n)}
+            for x, y, n in zip(a[chunk:chunk + 10_000], b[chunk:chunk + 10_000], counts[chunk:chunk + 10_000])
+        ])
+
+def _load_matrix(db: Session, kind: str,
+                 items: np.ndarray | None = None) -> tuple[np.ndarray, "sparse.csr_matrix", np.ndarray, float]:
+    """Load stored counts as (item ids, symmetric pair count matrix, marginals, total).
+
+    An item's marginal is its total pair count and the total is the sum of
+    all marginals. With ``items``, only the pairs involving those items are
+    loaded, so only their rows of the matrix are complete; the marginals of
+    every item in the matrix and the total are summed in SQL instead.
+    """
+    # scipy takes longer to import than the rest of the API, and only the refresh job needs it
+    from scipy import sparse
+    pair = select(CooccurrenceCount.item_a, CooccurrenceCount.item_b, CooccurrenceCount.count).where(
+        CooccurrenceCount.kind == kind
+    )
+    if items is None:
+        rows = db.execute(pair).all()
+    else:
+        rows = []
+        for chunk in range(0, len(items), 10_000):
+            ids = items[chunk:chunk + 10_000].tolist()
+            rows.extend(db.execute(
+                pair.where(or_(CooccurrenceCount.item_a.in_(ids), CooccurrenceCount.item_b.in_(ids)))
+            ).all())
+    # A pair of two items from different chunks is loaded twice
+    data = np.unique(np.array(rows, dtype=np.int64).reshape(-1, 3), axis=0)
+    ids, inverse = np.unique(data[:, :2], return_inverse=True)
+    inverse = inverse.reshape(-1, 2)
+    upper = sparse.coo_matrix(
+        (data[:, 2].astype(np.float64), (inverse[:, 0], inverse[:, 1])),
+        shape=(len(ids), len(ids))
+    )
+    pairs = (upper + upper.T).tocsr()
+    if items is None:
+        marginals = np.asarray(pairs.sum(axis=1)).ravel()
+        return ids, pairs, marginals, float(marginals.sum())
+
+    marginals = np.zeros(len(ids))
+    for chunk in range(0, len(ids), 10_000):
+        chunk_ids = ids[chunk:chunk + 10_000].tolist()
+        sides = union_all(*(
+            select(column.label("item"), CooccurrenceCount.count)
+            .where(CooccurrenceCount.kind == kind, column.in_(chunk_ids))
+            for column in (CooccurrenceCount.item_a, CooccurrenceCount.item_b)
+        )).subquery()
+        for item, total in db.execute(select(sides.c.item, func.sum(sides.c.count)).group_by(sides.c.item)):
+            marginals[np.searchsorted(ids, item)] = total
+    total = db.scalar(select(func.coalesce(func.sum(CooccurrenceCount.count), 0)).where(CooccurrenceCount.kind == kind))
+    return ids, pairs, marginals, 2.0 * float(total)
+
+def similarity_matrix(pairs: "sparse.csr_matrix", measure: str, marginals: np.ndarray | None = None,
+                      total: float | None = None) -> "sparse.csr_matrix":
+    """Normalize raw pair counts into a similarity score matrix.
+
+    Both measures use each item's total pair count as its marginal (the row
+    sums of ``pairs`` unless given), which keeps cosine within [0, 1].
+    """
+    from scipy import sparse
+
+    if marginals is None:
+        marginals = np.asarray(pairs.sum(axis=1)).ravel()
+    if measure == "cosine":
+        scale = sparse.diags(1.0 / np.sqrt(np.maximum(marginals, 1.0)))
+        return (scale @ pairs @ scale).tocsr()
+
+    scores = pairs.tocoo()
+    keep = scores.data >= MIN_PMI_COUNT
+    rows, cols, counts = scores.row[keep], scores.col[keep], scores.data[keep]
+    total = max(marginals.sum() if total is None else total, 1.0)
+    pmi = np.log(counts * total / (marginals[rows] * marginals[cols]))
+    positive = pmi > 0
+    return sparse.csr_matrix((pmi[positive], (rows[positive], cols[positive])), shape=pairs.shape)
+
+def top_neighbours(scores: "sparse.csr_matrix", row: int, top_n: int) -> tuple[np.ndarray, np.ndarray]:
+    start, end = scores.indptr[row], scores.indptr[row + 1]
+    cols, values = scores.indices[start:end], scores.data[start:end]
+    if len(values) > top_n:
+        keep = np.argpartition(-values, top_n)[:top_n]
+        cols, values = cols[keep], values[keep]
+    order = np.argsort(-values, kind="stable")
+    return cols[order], values[order]
+
+def _write_neighbours(db: Session, kind: str, ids: np.ndarray, scores: "sparse.csr_matrix",
+                      affected: np.ndarray, top_n: int) -> None:
+    rows = np.searchsorted(ids, affected)
+    db.execute(delete(SimilarItem).where(SimilarItem.kind == kind, SimilarItem.item_id.in_(affected.tolist())))
+    records = []
+    for item_id, row in zip(affected.tolist(), rows.tolist()):
+        cols, values = top_neighbours(scores, row, top_n)
+        records.extend(
+            {'kind': kind, 'item_id': item_id, 'rank': rank, 'similar_id': int(ids[col]), 'score': float(value)}
+            for rank, (col, value) in enumerate(zip(cols, values), start=1)
+        )
+    if records:
+        db.execute(insert(SimilarItem), records)
+
+def refresh(db: Session, kind: str, window: int = DEFAULT_WINDOW, top_n: int = DEFAULT_TOP_N,
+            measure: str = "cosine", full: bool = False) -> int:
+    """Fold new plays into the co-occurrence counts and refresh affected neighbour lists.
+
+    Returns the number of plays processed.
+    """
+    name = _watermark_name(kind)
+    if full:
+        db.execute(delete(CooccurrenceCount).where(CooccurrenceCount.kind == kind))
+        db.execute(delete(SimilarItem).where(SimilarItem.kind == kind))
+        set_watermark(db, name, 0)
+        db.commit()
+
+    processed = 0
+    affected = np.array([], dtype=np.int64)
+    while (batch := _load_batch(db, kind, get_watermark(db, name), window)) is not None:
+        users, times, items, is_new, last_id = batch
+        a, b, counts = window_pairs(users, times, items, is_new, window)
+        _upsert_counts(db, kind, a, b, counts)
+        set_watermark(db, name, last_id)
+        db.commit()
+        affected = np.union1d(affected, np.concatenate([a, b]))
+        processed += int(is_new.sum())
+
+    if len(affected):
+        # A full rebuild touches every item, so it reads the whole table in one go
+        ids, pairs, marginals, total = _load_matrix(db, kind, None if full else affected)
+        scores = similarity_matrix(pairs, measure, marginals, total)
+        _write_neighbours(db, kind, ids, scores, affected, top_n)
+        db.commit()
+    return processed
+
+def get_similar(db: Session, kind: str, item_id: int, limit: int = 10) -> list[dict]:
+    """Precomputed neighbours for an artist or track, best first."""
+    entity, name = (Artist, Artist.name) if kind == "artist" else (Track, Track.title)
+    rows = db.execute(
+        select(SimilarItem.similar_id, name, SimilarItem.score)
+        .join(entity, entity.id == SimilarItem.similar_id)
+        .where(SimilarItem.kind == kind, SimilarItem.item_id == item_id)
+        .order_by(SimilarItem.rank)
+        .limit(limit)
+    ).all()
+    return [{'id': row[0], 'name': row[1], 'score': row[2]} for row in rows]
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Refresh artist/track similarity tables")
+    parser.add_argument("--kind", choices=KINDS + ("all",), default="all")
+    parser.add_argument("--window", type=int, default=DEFAULT_WINDOW, help="co-occurrence window in seconds")
+    parser.add_argument("--top-n", type=int, default=DEFAULT_TOP_N)
+    parser.add_argument("--measure", choices=MEASURES, default="cosine")
+    parser.add_argument("--full", action="store_true", help="discard stored counts and rebuild from scratch")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        for kind in (KINDS if args.kind == "all" else (args.kind,)):
+            processed = refresh(db, kind, args.window, args.top_n, args.measure, args.full)
+            print(f"{kind}: processed {processed} new plays")
+    finally:
+        db.close()
@@ -0,0 +1,98 @@
+"""A local stand-in for the MusicBrainz search API.
+
+It answers ``/ws/2/{recording,release,artist}/?query=`` with canned results
+in MusicBrainz's XML, the format musicbrainzngs parses, and records every
+request it gets with the time it arrived. Point the enrichment worker at it
+with ``MUSICBRAINZ_HOST=127.0.0.1:<port> MUSICBRAINZ_HTTPS=false``:
+
+    python tests/fake_musicbrainz.py [--port 5055]
+"""
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+from urllib.parse import urlsplit, parse_qs
+from xml.sax.saxutils import escape, quoteattr
+
+ENTITIES = ("recording", "release", "artist")
+
+def _recording(match: dict) -> str:
+    artists = "".join(
+        f"<name-credit><artist id={quoteattr(artist['id'])}><name>{escape(artist['name'])}</name></artist></name-credit>"
+        for artist in match.get("artists", [])
+    )
+    releases = "".join(
+        f"<release id={quoteattr(release['id'])}><title>{escape(release['title'])}</title></release>"
+        for release in match.get("releases", [])
+    )
+    length = f"<length>{match['length']}</length>" if match.get("length") else ""
+    return (f"<title>{escape(match['title'])}</title>{length}"
+            f"<artist-credit>{artists}</artist-credit><release-list>{releases}</release-list>")
+
+def _body(entity: str, matches: list[dict]) -> bytes:
+    items = []
+    for match in matches:
+        content = _recording(match) if entity == "recording" else (
+            f"<title>{escape(match['title'])}</title>" if entity == "release" else f"<name>{escape(match['name'])}</name>"
+        )
+        items.append(f'<{entity} id={quoteattr(match["id"])} ext:score="{match.get("score", 100)}">{content}</{entity}>')
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<metadata xmlns="http://musicbrainz.org/ns/mmd-2.0#" xmlns:ext="http://musicbrainz.org/ns/ext#-2.0">'
+        f'<{entity}-list count="{len(items)}" offset="0">{"".join(items)}</{entity}-list></metadata>'
+    ).encode()
+
+class FakeMusicBrainz:
+    """Serves ``results[entity]`` for every search of that entity.
+
+    A recording is ``{id, title, score, length, artists: [{id, name}],
+    releases: [{id, title}]}``; releases have ``{id, title, score}`` and artists
+    ``{id, name, score}``. ``requests`` collects ``(entity, query, monotonic time)``.
+    """
+
+    def __init__(self, port: int = 0):
+        self.results: dict[str, list[dict]] = {entity: [] for entity in ENTITIES}
+        self.requests: list[tuple[str, str, float]] = []
+        self.status = 200  # set to an error status to fail every search
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlsplit(self.path)
+                entity = url.path.removeprefix("/ws/2/").strip("/")
+                if entity not in ENTITIES:
+                    self.send_error(404)
+                    return
+                fake.requests.append((entity, parse_qs(url.query).get("query", [""])[0], time.monotonic()))
+                if fake.status != 200:
+                    self.send_error(fake.status)
+                    return
+                body = _body(entity, fake.results[entity])
+                self.send_response(200)
+                self.send_header("Content-Type", "application/xml; charset=UTF-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.host = f"127.0.0.1:{self.server.server_port}"
+
+    def start(self) -> "FakeMusicBrainz":
+        threading.Thread(target=self.server.serve_forever, name="fake-musicbrainz", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve canned MusicBrainz search results")
+    parser.add_argument("--port", type=int, default=5055)
+    args = parser.parse_args()
+
+    fake = FakeMusicBrainz(args.port)
+    print(f"MUSICBRAINZ_HOST={fake.host} MUSICBRAINZ_HTTPS=false (no results configured)")
+    fake.server.serve_forever()
@@ -0,0 +1,179 @@
+"""The cover art cache against a local origin server."""
+import asyncio
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import math
+import os
+import threading
+
+from fastapi import HTTPException
+import pytest
+
+import artcache
+
+class Origin:
+    """Serves ``images[path]`` as JPEG, 404 for anything else, and counts requests per path."""
+
+    def __init__(self):
+        self.images: dict[str, bytes] = {}
+        self.requests: list[str] = []
+        origin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                origin.requests.append(self.path)
+                body = origin.images.get(self.path)
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "image/jpeg")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, name="art-origin", daemon=True).start()
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}{path}"
+
+def _jpeg(color: tuple[int, int, int], side: int = 600) -> bytes:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (side, side), color).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+@pytest.fixture
+def origin():
+    origin = Origin()
+    yield origin
+    origin.server.shutdown()
+    origin.server.server_close()
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = artcache.ArtCache(str(tmp_path / "art"), 10 * 1024 ** 2, workers=1)
+    yield cache
+    cache.close()
+
+def _thumbnail(cache, url: str, size: int = 128, ext: str = "jpg") -> artcache.Thumbnail:
+    return asyncio.run(cache.thumbnail(url, size, ext))
+
+def test_first_request_fetches_and_later_ones_hit(cache, origin):
+    from PIL import Image
+
+    origin.images["/cover.jpg"] = _jpeg((200, 30, 30))
+    first = _thumbnail(cache, origin.url("/cover.jpg"))
+    with Image.open(first.path) as image:
+        assert image.size == (128, 128)
+    again = _thumbnail(cache, origin.url("/cover.jpg"))
+    other_size = _thumbnail(cache, origin.url("/cover.jpg"), size=64, ext="webp")
+    assert (again.path, again.etag) == (first.path, first.etag)
+    assert other_size.media_type == "image/webp" and other_size.etag != first.etag
+    # Every size is rendered from the one fetched original
+    assert origin.requests == ["/cover.jpg"]
+
+def test_missing_and_oversized_originals(cache, origin, monkeypatch):
+    with pytest.raises(HTTPException) as missing:
+        _thumbnail(cache, origin.url("/missing.jpg"))
+    assert missing.value.status_code == 404
+
+    origin.images["/huge.jpg"] = _jpeg((10, 10, 10))
+    monkeypatch.setattr(artcache, "MAX_ORIGINAL_BYTES", 1000)
+    with pytest.raises(HTTPException) as huge:
+        _thumbnail(cache, origin.url("/huge.jpg"))
+    assert (huge.value.status_code, huge.value.detail) == (502, "Cover art is too large")
+    # Nothing half-written is left behind
+    assert not os.listdir(os.path.join(cache.directory, "originals"))
+
+def test_failures_are_remembered_until_they_expire(cache, origin, monkeypatch):
+    url = origin.url("/late.jpg")
+    with pytest.raises(HTTPException):
+        _thumbnail(cache, url)
+    origin.images["/late.jpg"] = _jpeg((0, 90, 0))
+    with pytest.raises(HTTPException):
+        _thumbnail(cache, url)
+    assert origin.requests == ["/late.jpg"]
+
+    # As if FAILURE_TTL had passed
+    expires, error = cache._failures[url]
+    cache._failures[url] = (expires - artcache.FAILURE_TTL - 1, error)
+    _thumbnail(cache, url)
+    assert origin.requests == ["/late.jpg", "/late.jpg"]
+    assert url not in cache._failures
+
+def test_remembered_failures_are_bounded(cache, origin, monkeypatch):
+    monkeypatch.setattr(artcache, "MAX_FAILURES", 3)
+    for n in range(5):
+        with pytest.raises(HTTPException):
+            _thumbnail(cache, origin.url(f"/gone-{n}.jpg"))
+    assert list(cache._failures) == [origin.url(f"/gone-{n}.jpg") for n in (2, 3, 4)]
+
+def _files_of(cache, url: str, thumbnail: artcache.Thumbnail) -> list[str]:
+    """The URL record, original and thumbnail stored for one cover."""
+    return [cache._ref_path(url), cache._original_path(cache._resolved(url)), thumbnail.path]
+
+def _age(paths: list[str], mtime: float) -> None:
+    for n, path in enumerate(paths):
+        os.utime(path, (mtime + n, mtime + n))
+
+def test_least_recently_used_files_are_evicted(cache, origin):
+    covers = []
+    for n, color in enumerate([(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0)]):
+        origin.images[f"/{n}.jpg"] = _jpeg(color)
+        url = origin.url(f"/{n}.jpg")
+        covers.append(_files_of(cache, url, _thumbnail(cache, url)))
+        _age(covers[-1], 1000 + 10 * n)
+
+    # Just small enough that the oldest cover has to go to get under the low-water mark
+    total = cache.usage()[1]
+    cache.max_bytes = math.ceil((total - sum(os.path.getsize(path) for path in covers[0])) / artcache.LOW_WATER)
+    assert cache.max_bytes < total
+    assert cache.evict() == 3
+    assert not any(os.path.exists(path) for path in covers[0])
+    assert all(os.path.exists(path) for paths in covers[1:] for path in paths)
+    assert cache.usage()[1] <= cache.max_bytes * artcache.LOW_WATER
+
+def test_writes_past_the_limit_evict(cache, origin):
+    origin.images["/a.jpg"] = _jpeg((1, 2, 3))
+    first = _files_of(cache, origin.url("/a.jpg"), _thumbnail(cache, origin.url("/a.jpg")))
+    _age(first, 1000)
+    cache.max_bytes = int(cache.usage()[1] * 1.5)
+
+    origin.images["/b.jpg"] = _jpeg((3, 2, 1))
+    second = _files_of(cache, origin.url("/b.jpg"), _thumbnail(cache, origin.url("/b.jpg")))
+    assert not all(os.path.exists(path) for path in first)
+    assert all(os.path.exists(path) for path in second)
+    assert cache.usage()[1] <= cache.max_bytes
+
+def test_revalidation_gets_a_304(client, db, origin, monkeypatch, tmp_path):
+    import main
+    from models import Artist, Album
+
+    cache = artcache.ArtCache(str(tmp_path / "art"), 10 * 1024 ** 2, workers=1)
+    monkeypatch.setattr(main, "art_cache", cache)
+    origin.images["/album.jpg"] = _jpeg((40, 40, 160))
+    artist = Artist(name="Art Cache Artist")
+    db.add(artist)
+    db.flush()
+    album = Album(title="Art Cache Album", artist_id=artist.id, cover_art_url=origin.url("/album.jpg"))
+    db.add(album)
+    db.commit()
+    try:
+        response = client.get(f"/art/{album.id}?size=100", headers={"Accept": "image/webp"})
+        assert response.status_code == 200 and response.headers["content-type"] == "image/webp"
+        etag = response.headers["etag"]
+        revalidated = client.get(f"/art/{album.id}?size=100", headers={"Accept": "image/webp", "If-None-Match": etag})
+        assert revalidated.status_code == 304 and revalidated.headers["etag"] == etag
+        assert origin.requests == ["/album.jpg"]
+        assert client.get("/art/0").status_code == 404
+    finally:
+        cache.close()
+        db.delete(album)
+        db.delete(artist)
+        db.commit()
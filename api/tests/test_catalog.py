@@ -0,0 +1,34 @@
+"""Catalog name normalization."""
+import pytest
+
+import catalog
+
+@pytest.mark.parametrize("name", [
+    "Radiohead",
+    "radiohead ",
+    "RADIOHEAD",
+    "Radiohead feat. Thom Yorke",
+    "Radiohead (feat. Thom Yorke)",
+    "Radiohead [ft. Thom Yorke]",
+    "Radiohead (Featuring Thom Yorke)",
+    "Radiohead - ft. Thom Yorke",
+    "Radiohead, featuring Thom Yorke",
+    "Radiohead / Feat Thom Yorke",
+])
+def test_credits_are_stripped(name):
+    assert catalog.normalize_name(name) == "radiohead"
+
+@pytest.mark.parametrize("name, key", [
+    ("Featuring the Band", "featuring the band"),
+    ("Ft. Lauderdale Blues", "ft. lauderdale blues"),
+    ("Blues Featuring the Band", "blues featuring the band"),
+    ("Live in Ft. Lauderdale", "live in ft. lauderdale"),
+    ("Drift ft Nothing", "drift ft nothing"),
+    ("(feat. Nobody)", "(feat. nobody)"),
+])
+def test_titles_that_only_look_like_credits_are_kept(name, key):
+    assert catalog.normalize_name(name) == key
+
+def test_quotes_and_unicode_fold_together():
+    assert catalog.normalize_name("Don’t Stop") == catalog.normalize_name("don't  stop")
+    assert catalog.normalize_name("Ｒａｄｉｏｈｅａｄ") == "radiohead"
@@ -0,0 +1,48 @@
+"""Site-wide charts, counted at most once per CHARTS_TTL."""
+from datetime import datetime, timedelta, UTC
+import secrets
+
+import pytest
+
+import sharding
+
+@pytest.fixture
+def charts(monkeypatch):
+    monkeypatch.setattr(sharding, "_charts", {})
+    # Rank everything, so a test's own artist is in the chart whatever else is in the database
+    monkeypatch.setattr(sharding, "CHARTS_MAX_LIMIT", 10 ** 6)
+    return sharding._charts
+
+def _play(db, user_id: int, title: str, artist: str, played_at: datetime | None = None) -> int:
+    import crud
+    from schemas import PlayCreate
+
+    play_data = PlayCreate(title=title, artist=artist, album="Chart Album", station="Chart Station")
+    artist_row, _, track, station = crud.resolve_catalog(db, play_data)
+    crud.add_plays(db, [(user_id, play_data, track.id, artist_row.id, station.id, played_at or datetime.now(UTC))])
+    db.commit()
+    return artist_row.id
+
+def _count(artist_id: int) -> int | None:
+    return next((entry['play_count'] for entry in sharding.top_charts("artist", 7, 10 ** 6) if entry['id'] == artist_id), None)
+
+def test_charts_are_counted_once_per_ttl(charts, db, ingest_user, monkeypatch):
+    user_id, _ = ingest_user
+    artist = f"Chart Artist {secrets.token_hex(4)}"
+    artist_id = _play(db, user_id, "One", artist)
+    assert _count(artist_id) == 1
+
+    _play(db, user_id, "Two", artist)
+    assert _count(artist_id) == 1
+    monkeypatch.setattr(sharding, "CHARTS_TTL", 0)
+    assert _count(artist_id) == 2
+
+def test_long_ranges_are_capped(charts, db, ingest_user):
+    user_id, _ = ingest_user
+    artist_id = _play(db, user_id, "Old", f"Chart Artist {secrets.token_hex(4)}", datetime.now(UTC) - timedelta(days=200))
+    year = sharding.top_charts("artist", 366)
+    assert list(charts) == [("artist", sharding.CHARTS_MAX_DAYS)]
+    assert artist_id not in {entry['id'] for entry in year}
+    # Every limit is served from the one count
+    assert sharding.top_charts("artist", 1000, 5) == year[:5]
+    assert len(charts) == 1
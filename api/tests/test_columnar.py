@@ -0,0 +1,91 @@
+"""Columnar stats against the ORM implementation, including after a catalog merge."""
+from datetime import datetime, timedelta
+import secrets
+
+import pytest
+from sqlalchemy import select
+
+import catalog
+import columnar
+import crud
+from schemas import StatsResponse
+
+@pytest.fixture
+def listener(schema):
+    """A user with a duplicated track: "Song" and "SONG " played apart, plus one other track."""
+    from database import SessionLocal
+    from models import Artist, Album, Track, Station, Play, Rating
+
+    db = SessionLocal()
+    tag = secrets.token_hex(4)
+    user = crud.create_user(db, f"columnar-{tag}@example.com", "password123")
+    artist = Artist(name=f"Columnar Artist {tag}")
+    station = Station(name=f"Columnar Station {tag}")
+    db.add_all([artist, station])
+    db.flush()
+    album = Album(title=f"Columnar Album {tag}", artist_id=artist.id)
+    db.add(album)
+    db.flush()
+    song, duplicate, other = (
+        Track(title=title, artist_id=artist.id, album_id=album.id)
+        for title in (f"Song {tag}", f"SONG  {tag} ", f"Other {tag}")
+    )
+    db.add_all([song, duplicate, other])
+    db.flush()
+    start = datetime(2026, 3, 2, 9)
+    plays = [song] * 3 + [duplicate] * 2 + [other] * 4
+    db.add_all(
+        Play(user_id=user.id, track_id=track.id, station_id=station.id, rating=Rating.UNRATED,
+             duration=180 + n, created_at=start + timedelta(hours=7 * n))
+        for n, track in enumerate(plays)
+    )
+    db.commit()
+    try:
+        yield db, user.id, (song.id, duplicate.id)
+    finally:
+        columnar.store.discard(user.id)
+        db.close()
+
+def _both(db, user_id: int) -> tuple[dict, dict]:
+    db.expire_all()
+    return tuple(
+        StatsResponse.model_validate(stats(db, user_id)).model_dump(mode="json")
+        for stats in (columnar.get_user_stats, crud.get_user_stats)
+    )
+
+def _merge(db, kind: str, ids: tuple[int, int]) -> None:
+    catalog.merge_kind(db, kind)
+    assert catalog.canonical_id(db, kind, ids[1]) == ids[0]
+
+def test_columnar_matches_orm_before_and_after_a_merge(listener):
+    db, user_id, ids = listener
+    before, orm = _both(db, user_id)
+    assert before == orm
+    assert [item['play_count'] for item in before['top_tracks']] == [4, 3, 2]
+
+    _merge(db, "track", ids)
+    after, orm = _both(db, user_id)
+    assert after == orm
+    assert [item['play_count'] for item in after['top_tracks']] == [5, 4]
+    assert after['top_tracks'][0]['id'] == ids[0]
+
+def test_bumped_generation_reloads_residents(listener):
+    from models import JobWatermark
+
+    db, user_id, ids = listener
+    columnar.get_user_stats(db, user_id)
+    generation = db.scalar(select(JobWatermark.last_id).where(JobWatermark.name == catalog.GENERATION)) or 0
+    _merge(db, "track", ids)
+    assert db.scalar(select(JobWatermark.last_id).where(JobWatermark.name == catalog.GENERATION)) == generation + 1
+    stats = columnar.get_user_stats(db, user_id)
+    assert ids[1] not in {item['id'] for item in stats['top_tracks']}
+
+def test_missing_names_reload_residents(listener, monkeypatch):
+    db, user_id, ids = listener
+    columnar.get_user_stats(db, user_id)
+    # As on a database whose generation hasn't been bumped yet
+    monkeypatch.setattr(catalog, "bump_generation", lambda db: None)
+    _merge(db, "track", ids)
+    after, orm = _both(db, user_id)
+    assert after == orm
+    assert all(item['name'] for item in after['top_tracks'])
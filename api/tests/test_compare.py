@@ -0,0 +1,53 @@
+"""Period comparisons: which artists count as new."""
+from datetime import date, datetime
+import secrets
+
+import pytest
+
+import compare
+
+@pytest.fixture
+def listener(db):
+    """A user with their own artists, one track each, as (user id, {name: artist id}, {name: track id})."""
+    import crud
+    from models import Artist, Album, Track, Station
+
+    user = crud.create_user(db, f"compare-{secrets.token_hex(4)}@example.com", "password123")
+    artists, tracks = {}, {}
+    for name in ("Old Favourite", "Back Again", "Brand New", "Only Before"):
+        artist = Artist(name=f"{name} {secrets.token_hex(4)}")
+        db.add(artist)
+        db.flush()
+        album = Album(title="Album", artist_id=artist.id)
+        db.add(album)
+        db.flush()
+        track = Track(title="Track", artist_id=artist.id, album_id=album.id)
+        db.add(track)
+        db.flush()
+        artists[name], tracks[name] = artist.id, track.id
+    db.add(Station(name=f"Station {secrets.token_hex(4)}"))
+    db.commit()
+    return user.id, artists, tracks
+
+def _play(db, user_id: int, track_id: int, day: date) -> None:
+    from sqlalchemy import select
+    from models import Play, Station
+
+    station_id = db.scalar(select(Station.id).limit(1))
+    db.add(Play(user_id=user_id, track_id=track_id, station_id=station_id, created_at=datetime(day.year, day.month, day.day, 12)))
+
+def test_new_artists_were_never_played_before_a(db, listener):
+    user_id, artists, tracks = listener
+    _play(db, user_id, tracks["Old Favourite"], date(2026, 9, 10))
+    _play(db, user_id, tracks["Old Favourite"], date(2026, 10, 3))
+    # Skipped in b, but played long before
+    _play(db, user_id, tracks["Back Again"], date(2025, 4, 1))
+    _play(db, user_id, tracks["Back Again"], date(2026, 10, 5))
+    _play(db, user_id, tracks["Brand New"], date(2026, 10, 7))
+    _play(db, user_id, tracks["Brand New"], date(2026, 10, 8))
+    _play(db, user_id, tracks["Only Before"], date(2025, 4, 1))
+    db.commit()
+
+    result = compare.compare(db, user_id, compare.parse_period("2026-10"), compare.parse_period("2026-09"))
+    assert [entry['id'] for entry in result['new_artists']] == [artists["Brand New"]]
+    assert result['a']['unique_artists'] == 3 and result['b']['unique_artists'] == 1
@@ -0,0 +1,225 @@
+"""The MusicBrainz enrichment worker against a local fake server."""
+from datetime import datetime, timedelta, UTC
+import secrets
+import uuid
+
+import pytest
+from sqlalchemy import select, update, delete
+
+from fake_musicbrainz import FakeMusicBrainz
+
+@pytest.fixture
+def fake():
+    server = FakeMusicBrainz().start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def session(schema):
+    from database import SessionLocal
+    from models import EnrichmentJob
+
+    db = SessionLocal()
+    # claim_jobs takes whatever is pending, so each test starts from an empty queue
+    db.execute(delete(EnrichmentJob))
+    db.commit()
+    try:
+        yield db
+    finally:
+        db.rollback()
+        db.execute(delete(EnrichmentJob))
+        db.commit()
+        db.close()
+
+def _client(fake, cache_dir, rate: float = 1000.0):
+    import enrichment
+
+    return enrichment.MusicBrainzClient(
+        enrichment.ResponseCache(str(cache_dir)), enrichment.RateLimiter(rate), host=fake.host, https=False
+    )
+
+def _catalog(db, tracks: int = 1):
+    """A new artist and album with some tracks, named so they match nothing else."""
+    from models import Artist, Album, Track
+
+    tag = secrets.token_hex(4)
+    artist = Artist(name=f"Enrichment Artist {tag}")
+    db.add(artist)
+    db.flush()
+    album = Album(title=f"Enrichment Album {tag}", artist_id=artist.id)
+    db.add(album)
+    db.flush()
+    rows = [Track(title=f"Enrichment Track {tag} {n}", artist_id=artist.id, album_id=album.id) for n in range(tracks)]
+    db.add_all(rows)
+    db.commit()
+    return artist, album, rows
+
+def _jobs(db, *entities):
+    from models import Artist, Album, EnrichmentJob
+
+    kinds = {Artist: "artist", Album: "album"}
+    db.add_all(EnrichmentJob(kind=kinds.get(type(entity), "track"), entity_id=entity.id) for entity in entities)
+    db.commit()
+
+def _mbid() -> str:
+    return str(uuid.uuid4())
+
+def test_claims_do_not_overlap_and_stale_jobs_return(session):
+    from database import SessionLocal
+    from enrichment import claim_jobs, STALE_AFTER
+    from models import EnrichmentJob
+
+    _, album, tracks = _catalog(session, tracks=3)
+    _jobs(session, album, *tracks)
+
+    other = SessionLocal()
+    try:
+        first = claim_jobs(session, 2)
+        second = claim_jobs(other, 2)
+        assert len(first) == 2 and len(second) == 2
+        assert not {job.id for job in first} & {job.id for job in second}
+        # Tracks are handed out before albums within a claim
+        assert [job.kind for job in first + second].count("album") == 1
+        assert claim_jobs(session, 2) == []
+
+        session.execute(
+            update(EnrichmentJob).where(EnrichmentJob.id == first[0].id)
+            .values(locked_at=datetime.now(UTC) - STALE_AFTER - timedelta(minutes=1))
+        )
+        session.commit()
+        [reclaimed] = claim_jobs(other, 2)
+        assert reclaimed.id == first[0].id and reclaimed.attempts == 2
+    finally:
+        other.close()
+
+def test_claims_skip_jobs_locked_by_another_worker(session):
+    from database import SessionLocal, engine
+    from enrichment import claim_jobs
+    from models import EnrichmentJob
+
+    if engine.dialect.name != "postgresql":
+        pytest.skip("SKIP LOCKED needs Postgres")
+    _, _, tracks = _catalog(session, tracks=2)
+    _jobs(session, *tracks)
+    locked = session.scalars(select(EnrichmentJob).order_by(EnrichmentJob.id).limit(1).with_for_update()).one()
+
+    other = SessionLocal()
+    try:
+        claimed = claim_jobs(other, 10)
+        assert [job.id for job in claimed] != [] and locked.id not in {job.id for job in claimed}
+    finally:
+        other.close()
+        session.rollback()
+
+def test_track_lookup_resolves_artist_and_album(session, fake, tmp_path):
+    from enrichment import claim_jobs, process_jobs, COVER_ART_URL
+
+    artist, album, [track] = _catalog(session)
+    _jobs(session, artist, album, track)
+    recording, artist_mbid, release = _mbid(), _mbid(), _mbid()
+    fake.results["recording"] = [{
+        'id': recording, 'title': track.title, 'score': 100, 'length': 241_500,
+        'artists': [{'id': artist_mbid, 'name': artist.name}],
+        'releases': [{'id': release, 'title': album.title}]
+    }]
+
+    client = _client(fake, tmp_path)
+    process_jobs(session, client, claim_jobs(session, 10))
+    session.expire_all()
+    assert (track.mbid, track.duration) == (recording, 241)
+    assert artist.mbid == artist_mbid and artist.validated
+    assert album.mbid == release and album.cover_art_url == f"{COVER_ART_URL}/release/{release}/front-500"
+    # The artist and album jobs finished off the track's answer
+    assert [entity for entity, _, _ in fake.requests] == ["recording"]
+    assert client.calls == 1
+
+def test_lookups_wait_for_the_rate_limit(session, fake, tmp_path):
+    from enrichment import claim_jobs, process_jobs
+
+    albums = [_catalog(session)[1] for _ in range(3)]
+    _jobs(session, *albums)
+
+    process_jobs(session, _client(fake, tmp_path, rate=1.0), claim_jobs(session, 10))
+    times = [at for entity, _, at in fake.requests if entity == "release"]
+    assert len(times) == 3
+    # Spaced a second apart when sent; arrival adds a little jitter
+    assert min(later - earlier for earlier, later in zip(times, times[1:])) >= 0.8
+
+def test_workers_share_one_rate_limit(schema):
+    from concurrent.futures import ThreadPoolExecutor
+    import time
+    from database import SessionLocal
+    from enrichment import SharedRateLimiter
+
+    # Two workers' limiters on the same row, each called from two threads
+    name = f"test-{secrets.token_hex(4)}"
+    limiters = [SharedRateLimiter(SessionLocal, name, rate=10.0) for _ in range(2)]
+    slots = []
+    for limiter in limiters:
+        reserve = limiter._reserve
+
+        def record(db, reserve=reserve):
+            slot = reserve(db)
+            if slot is not None:
+                slots.append(slot)
+            return slot
+
+        limiter._reserve = record
+
+    def call(limiter) -> float:
+        limiter.wait()
+        return time.time()
+
+    with ThreadPoolExecutor(4) as pool:
+        times = sorted(pool.map(call, limiters * 4))
+    # Wake-ups jitter with the thread scheduler; the reserved slots don't
+    slots.sort()
+    assert len(slots) == 8
+    assert min(later - earlier for earlier, later in zip(slots, slots[1:])) == pytest.approx(0.1)
+    # Nobody went before their slot
+    assert times[-1] >= slots[-1]
+
+def test_cached_responses_are_not_requested_again(session, fake, tmp_path):
+    from enrichment import enrich_album
+
+    _, album, _ = _catalog(session)
+    release = _mbid()
+    fake.results["release"] = [{'id': release, 'title': album.title, 'score': 95}]
+
+    enrich_album(session, _client(fake, tmp_path), album)
+    album.mbid, album.validated = None, None
+    # A fresh client, as after a restart, reading the same cache directory
+    client = _client(fake, tmp_path)
+    enrich_album(session, client, album)
+    assert album.mbid == release
+    assert len(fake.requests) == 1 and client.calls == 0
+
+def test_mbid_owned_by_another_row_is_left_for_the_merge_job(session, fake, tmp_path):
+    from enrichment import claim_jobs, process_jobs
+    from models import EnrichmentJob
+
+    _, _, [owner, duplicate] = _catalog(session, tracks=2)
+    recording = _mbid()
+    owner.mbid = recording
+    session.commit()
+    _jobs(session, duplicate)
+    fake.results["recording"] = [{'id': recording, 'title': duplicate.title, 'score': 100}]
+
+    process_jobs(session, _client(fake, tmp_path), claim_jobs(session, 10))
+    session.expire_all()
+    assert duplicate.mbid is None and duplicate.validated
+    assert session.scalar(select(EnrichmentJob.status).where(EnrichmentJob.entity_id == duplicate.id)) == "done"
+
+def test_failed_lookups_are_retried_later(session, fake, tmp_path):
+    from enrichment import claim_jobs, process_jobs
+    from models import EnrichmentJob
+
+    _, album, _ = _catalog(session)
+    _jobs(session, album)
+    fake.status = 400
+
+    process_jobs(session, _client(fake, tmp_path), claim_jobs(session, 10))
+    job = session.scalars(select(EnrichmentJob).where(EnrichmentJob.entity_id == album.id)).one()
+    assert job.status == "pending" and job.attempts == 1 and job.last_error
+    assert job.run_after > datetime.now(UTC).replace(tzinfo=None)
+    assert claim_jobs(session, 10) == []
@@ -0,0 +1,99 @@
+"""Site-wide daily sketches, kept up to date as plays are recorded."""
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import sessionmaker
+
+import hll
+from hll import HyperLogLog
+from models import Base, SiteDailySketch, UserDailySketch
+
+DAY = datetime(2026, 3, 2, 12)
+
+@pytest.fixture
+def db(tmp_path):
+    """An empty database of its own, so site-wide sketches hold only this test's plays."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'sketches.db'}")
+    Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as db:
+        yield db
+    engine.dispose()
+
+def _plays(users: range, days: int, tracks: int) -> list[tuple[int, int, int, datetime]]:
+    return [
+        (user_id, track_id, track_id % 7, DAY + timedelta(days=day))
+        for user_id in users for day in range(days) for track_id in range(user_id * 10, user_id * 10 + tracks)
+    ]
+
+def _site(db) -> dict[date, tuple[bytes, bytes]]:
+    return {row.day: (row.track_sketch, row.artist_sketch) for row in db.scalars(select(SiteDailySketch))}
+
+def _union_of_users(db) -> dict[date, tuple[bytes, bytes]]:
+    days: dict[date, list[UserDailySketch]] = {}
+    for sketch in db.scalars(select(UserDailySketch)):
+        days.setdefault(sketch.day, []).append(sketch)
+    return {
+        day: (
+            HyperLogLog.union([sketch.track_sketch for sketch in sketches]).to_bytes(),
+            HyperLogLog.union([sketch.artist_sketch for sketch in sketches]).to_bytes()
+        )
+        for day, sketches in days.items()
+    }
+
+def test_site_sketches_are_the_union_of_the_users(db):
+    hll.record_plays(db, _plays(range(1, 4), days=3, tracks=20))
+    hll.record_plays(db, _plays(range(3, 6), days=2, tracks=25))
+    db.commit()
+    assert _site(db) == _union_of_users(db)
+    assert len(hll.load_sketches(db, None, DAY.date(), DAY.date() + timedelta(days=1))) == 2
+    estimate = hll.estimate_unique(db, None)
+    assert estimate['unique_tracks'] == pytest.approx(len({track for _, track, _, _ in _plays(range(1, 6), 1, 25)}), rel=0.05)
+    assert estimate['unique_artists'] == 7
+
+def test_repeat_plays_do_not_lock_the_site_row(db):
+    hll.record_plays(db, _plays(range(1, 3), days=1, tracks=10))
+    db.commit()
+    statements = []
+    event.listen(db.get_bind(), "before_cursor_execute", lambda conn, cursor, sql, *args: statements.append(sql))
+    hll.record_plays(db, _plays(range(1, 3), days=1, tracks=10))
+    db.commit()
+    site = [sql.split()[0] for sql in statements if "site_daily_sketches" in sql]
+    assert site == ["SELECT"]
+
+def test_rebuilds_match_the_incremental_sketches(db):
+    from models import Artist, Album, Track, Station, Play, User, Rating
+
+    users = [User(email=f"sketch{n}@example.com", password_hash="x") for n in range(3)]
+    artists = [Artist(name=f"Artist {n}") for n in range(4)]
+    station = Station(name="Station")
+    db.add_all(users + artists + [station])
+    db.flush()
+    album = Album(title="Album", artist_id=artists[0].id)
+    db.add(album)
+    db.flush()
+    tracks = [Track(title=f"Track {n}", artist_id=artists[n % 4].id, album_id=album.id) for n in range(30)]
+    db.add_all(tracks)
+    db.flush()
+    plays = [
+        Play(user_id=user.id, track_id=track.id, station_id=station.id, rating=Rating.UNRATED,
+             created_at=DAY + timedelta(days=n % 3))
+        for user in users for n, track in enumerate(tracks[:10 + 10 * (user.id % 2)])
+    ]
+    db.add_all(plays)
+    artist_of = {track.id: track.artist_id for track in tracks}
+    hll.record_plays(db, [(play.user_id, play.track_id, artist_of[play.track_id], play.created_at) for play in plays])
+    db.commit()
+    incremental = _site(db)
+
+    assert hll.rebuild_site_sketches(db) == 3
+    assert _site(db) == incremental
+    assert hll.rebuild_sketches(db) == 9
+    assert _site(db) == incremental
+
+    # Rebuilding one user (as after a shard move) merges their sketches into the site-wide ones
+    db.execute(SiteDailySketch.__table__.delete())
+    db.commit()
+    hll.rebuild_sketches(db, users[0].id)
+    mine = hll.load_sketches(db, users[0].id)
+    assert sorted(_site(db).values()) == sorted(mine)
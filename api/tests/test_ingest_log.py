@@ -0,0 +1,126 @@
+"""The write-behind ingest log: recovery, exactly-once replay, rejects and segment cleanup."""
+import asyncio
+from datetime import datetime, UTC
+import json
+import os
+import secrets
+
+import pytest
+from sqlalchemy import select
+
+import ingest_log
+from schemas import PlayCreate
+
+@pytest.fixture
+def reopen(tmp_path):
+    """Opens the slot, closing the log that had it first, as a restarted process would."""
+    logs = []
+
+    def reopen() -> ingest_log.IngestLog:
+        if logs:
+            logs.pop().close()
+        logs.append(ingest_log.open_slot(str(tmp_path)))
+        return logs[-1]
+
+    yield reopen
+    for log in logs:
+        log.close()
+
+@pytest.fixture
+def slot(reopen):
+    return reopen()
+
+def _record(user_id: int, title: str) -> dict:
+    return {
+        'user_id': user_id,
+        'played_at': datetime.now(UTC).isoformat(),
+        'play': PlayCreate(title=title, artist="Ingest Artist", album="Ingest Album", station="Ingest Station").model_dump()
+    }
+
+def _append(log: ingest_log.IngestLog, records: list[dict]) -> list[int]:
+    async def run():
+        return [await log.append(record) for record in records]
+    return asyncio.run(run())
+
+def test_torn_tail_is_cut_off_on_reopen(slot, reopen):
+    _append(slot, [_record(1, f"Song {n}") for n in range(3)])
+    [(_, path)] = slot.segments()
+    intact = os.path.getsize(path)
+    with open(path, "ab") as f:
+        f.write(ingest_log._encode({**_record(1, "Torn"), 'seq': 4})[:-10])  # crashed mid-write
+
+    log = reopen()
+    assert log.durable_seq == 3
+    assert os.path.getsize(path) == intact
+    assert _append(log, [_record(1, "After")]) == [4]
+    assert [record["play"]["title"] for record in log.read(0, 10)] == ["Song 0", "Song 1", "Song 2", "After"]
+
+def test_segments_with_undrained_records_are_kept(slot):
+    slot.segment_bytes = 600
+    _append(slot, [_record(1, f"Song {n}") for n in range(20)])
+    assert len(slot.segments()) > 2
+    for upto in range(slot.durable_seq + 1):
+        slot.drop_segments(upto)
+        assert [record["seq"] for record in slot.read(upto, 100)] == list(range(upto + 1, slot.durable_seq + 1))
+    # The segment being written to stays, even once it is fully drained
+    assert len(slot.segments()) == 1
+
+@pytest.fixture
+def listener(db):
+    import crud
+
+    return crud.create_user(db, f"ingest-{secrets.token_hex(4)}@example.com", "password123").id
+
+def _titles(db, user_id: int) -> list[str]:
+    from models import Play, Track
+
+    db.expire_all()
+    return db.scalars(select(Track.title).join(Play.track).where(Play.user_id == user_id).order_by(Play.id)).all()
+
+def test_replay_after_a_crash_writes_nothing_twice(slot, reopen, db, listener, monkeypatch):
+    _append(slot, [_record(listener, f"Song {n}") for n in range(5)])
+    drainer = ingest_log.Drainer(slot, batch_size=2)
+    # Crash after the second batch is committed, before its segments are dropped
+    batches = []
+    original = ingest_log.write_batch
+
+    def write_batch(name, records, skip=False):
+        written = original(name, records, skip)
+        batches.append(written)
+        if len(batches) == 2:
+            raise SystemExit("killed")
+        return written
+
+    monkeypatch.setattr(ingest_log, "write_batch", write_batch)
+    with pytest.raises(SystemExit):
+        drainer.drain_available()
+    assert _titles(db, listener) == [f"Song {n}" for n in range(4)]
+
+    monkeypatch.undo()
+    replayed = ingest_log.Drainer(reopen(), batch_size=2)
+    assert replayed.drained_seq == 0  # starts from the beginning of the log
+    assert replayed.drain_available() == 1
+    assert _titles(db, listener) == [f"Song {n}" for n in range(5)]
+
+def test_a_rejected_record_does_not_block_later_ones(slot, db, listener):
+    from models import JobWatermark
+
+    _append(slot, [_record(listener, "Before"), _record(2 ** 31 - 1, "No such user"), _record(listener, "After")])
+    drainer = ingest_log.Drainer(slot, batch_size=10)
+    assert drainer.drain_available() == 2
+    assert _titles(db, listener) == ["Before", "After"]
+    with open(os.path.join(slot.directory, "rejected.jsonl")) as f:
+        [rejected] = [json.loads(line) for line in f]
+    assert rejected["seq"] == 2 and rejected["play"]["title"] == "No such user"
+    # The watermark is past the rejected record, so a replay doesn't try it again
+    assert db.scalar(select(JobWatermark.last_id).where(JobWatermark.name == slot.name)) == 3
+
+def test_draining_marks_the_users_as_having_written(slot, db, listener, monkeypatch):
+    from models import User
+
+    monkeypatch.setattr(ingest_log, "replica_sessions", [object()])
+    _append(slot, [_record(listener, "Marked")])
+    assert db.scalar(select(User.last_write_at).where(User.id == listener)) is None
+    ingest_log.Drainer(slot).drain_available()
+    db.expire_all()
+    assert db.scalar(select(User.last_write_at).where(User.id == listener)) is not None
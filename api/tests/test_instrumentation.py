@@ -0,0 +1,58 @@
+"""Query budget enforcement in QueryStatsMiddleware."""
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import pytest
+from sqlalchemy import create_engine, text
+
+import instrumentation
+from instrumentation import QueryBudgetExceeded, QueryStatsMiddleware, query_budget
+
+@pytest.fixture(scope="module")
+def client():
+    engine = create_engine("sqlite://")
+    instrumentation.install(engine)
+    app = FastAPI()
+    app.add_middleware(QueryStatsMiddleware, enforce_budgets=True)
+
+    def run(queries: int) -> None:
+        with engine.connect() as conn:
+            for _ in range(queries):
+                conn.execute(text("SELECT 1"))
+
+    @app.get("/within")
+    @query_budget(2)
+    def within():
+        run(2)
+        return {}
+
+    @app.get("/over")
+    @query_budget(2)
+    def over():
+        run(3)
+        return {}
+
+    @app.get("/over-and-failing")
+    @query_budget(2)
+    def over_and_failing():
+        run(3)
+        raise LookupError("the endpoint's own error")
+
+    with TestClient(app) as client:
+        yield client
+
+def test_suite_enforces_budgets():
+    # conftest sets QUERY_BUDGET_ENFORCE=true for the app under test
+    assert instrumentation.ENFORCE_BUDGETS
+
+def test_within_budget(client):
+    response = client.get("/within")
+    assert response.status_code == 200
+    assert 'desc="2 queries"' in response.headers["server-timing"]
+
+def test_over_budget_raises(client):
+    with pytest.raises(QueryBudgetExceeded, match="ran 3 queries, budget is 2"):
+        client.get("/over")
+
+def test_endpoint_errors_are_not_replaced(client):
+    with pytest.raises(LookupError, match="the endpoint's own error"):
+        client.get("/over-and-failing")
@@ -0,0 +1,63 @@
+"""Token buckets, admission before the API key lookup, and client addresses behind proxies."""
+import ipaddress
+
+import ratelimit
+
+def _admission(burst: float = 3, max_keys: int = 100) -> ratelimit.Admission:
+    return ratelimit.Admission(
+        ratelimit.TokenBuckets(0.001, burst, max_keys), {}, ratelimit.ConcurrencyLimits({})
+    )
+
+def test_made_up_keys_share_the_client_bucket():
+    admission = _admission()
+    assert [admission.admit(f"guess-{n}", "/api/plays", "203.0.113.7") for n in range(3)] == [None] * 3
+    status, _, retry_after = admission.admit("guess-3", "/api/plays", "203.0.113.7")
+    assert status == 429 and retry_after > 0
+    # Another address has its own allowance
+    assert admission.admit("guess-4", "/api/plays", "198.51.100.1") is None
+    assert "guess-0" not in admission.buckets
+
+def test_verified_keys_get_their_own_bucket():
+    admission = _admission()
+    for _ in range(3):
+        admission.admit("guess", "/api/plays", "203.0.113.7")
+    admission.verified("real", "/api/plays")
+    # The address is out of tokens, but a key that was found is charged on its own
+    assert [admission.admit("real", "/api/plays", "203.0.113.7") for _ in range(3)] == [None] * 3
+    assert admission.admit("real", "/api/plays", "203.0.113.7")[0] == 429
+
+def test_least_recently_used_buckets_are_dropped():
+    buckets = ratelimit.TokenBuckets(1, 5, max_keys=3)
+    for key in ("a", "b", "c"):
+        buckets.take(key)
+    buckets.take("a")
+    buckets.take("d")
+    assert [key for key in ("a", "b", "c", "d") if key in buckets] == ["a", "c", "d"]
+
+def test_public_paths_are_limited_per_client_address():
+    admission = ratelimit.Admission(
+        ratelimit.TokenBuckets(1, 5), {}, ratelimit.ConcurrencyLimits({}), ratelimit.TokenBuckets(0.001, 2)
+    )
+    assert [admission.admit_public("203.0.113.7") for _ in range(2)] == [None, None]
+    assert admission.admit_public("203.0.113.7")[0] == 429
+    assert admission.admit_public("198.51.100.1") is None
+
+PROXIES = [ipaddress.ip_network("10.0.0.0/8"), ipaddress.ip_network("127.0.0.1/32")]
+
+def test_client_is_the_last_hop_a_trusted_proxy_added():
+    assert ratelimit.client_address("10.0.0.2", "203.0.113.7", PROXIES) == "203.0.113.7"
+    # Through two proxies
+    assert ratelimit.client_address("127.0.0.1", "203.0.113.7, 10.0.0.2", PROXIES) == "203.0.113.7"
+
+def test_forwarded_addresses_the_client_made_up_are_ignored():
+    # The client sent "X-Forwarded-For: 198.51.100.1" and the proxy appended its address
+    assert ratelimit.client_address("10.0.0.2", "198.51.100.1, 203.0.113.7", PROXIES) == "203.0.113.7"
+    # Straight to the API, not through a proxy
+    assert ratelimit.client_address("203.0.113.7", "198.51.100.1", PROXIES) == "203.0.113.7"
+    assert ratelimit.client_address("10.0.0.2", "198.51.100.1", []) == "10.0.0.2"
+
+def test_unusable_forwarded_headers_fall_back_to_the_proxy():
+    assert ratelimit.client_address("10.0.0.2", None, PROXIES) == "10.0.0.2"
+    assert ratelimit.client_address("10.0.0.2", "", PROXIES) == "10.0.0.2"
+    assert ratelimit.client_address("10.0.0.2", "10.0.0.3", PROXIES) == "10.0.0.3"
+    assert ratelimit.client_address("10.0.0.2", "not-an-address", PROXIES) == "not-an-address"
@@ -0,0 +1,42 @@
+"""Routing a user's reads after their plays are stored."""
+from datetime import datetime, timedelta, UTC
+
+import pytest
+from sqlalchemy import select
+
+import database
+
+@pytest.fixture
+def replica(monkeypatch):
+    """One always-healthy replica whose sessions are told apart from the primary's."""
+    replica_session = object()
+    monkeypatch.setattr(database, "replica_sessions", [lambda: replica_session])
+    monkeypatch.setattr(database.lag_guard, "healthy", lambda index: True)
+    monkeypatch.setattr(database, "SessionLocal", lambda: "primary")
+    return replica_session
+
+def _naive(moment: datetime) -> datetime:
+    # As read back from users.last_write_at
+    return moment.astimezone(UTC).replace(tzinfo=None)
+
+def test_users_who_never_wrote_read_the_replica(replica):
+    assert database.read_session(None) is replica
+
+def test_recent_writes_read_the_primary(replica):
+    assert database.read_session(_naive(datetime.now(UTC))) == "primary"
+    # Another worker's clock may be slightly ahead
+    assert database.read_session(_naive(datetime.now(UTC) + timedelta(seconds=1))) == "primary"
+
+def test_old_writes_read_the_replica(replica):
+    old = datetime.now(UTC) - timedelta(seconds=database.READ_YOUR_WRITES_WINDOW + 1)
+    assert database.read_session(_naive(old)) is replica
+
+def test_mark_is_stored_on_the_user(db, ingest_user):
+    from crud import mark_write
+    from models import User
+
+    user_id, _ = ingest_user
+    mark_write(db, [user_id])
+    db.commit()
+    written_at = db.scalar(select(User.last_write_at).where(User.id == user_id))
+    assert database.wrote_recently(written_at)
@@ -0,0 +1,62 @@
+"""Replica lag measured against the primary's WAL position."""
+import threading
+
+import database
+from database import ReplicaLagGuard, lag_behind
+
+INF = float("inf")
+
+def test_caught_up_replicas_are_as_old_as_the_last_sample_they_have():
+    history = [(100.0, 1000.0), (101.0, 2000.0), (102.0, 3000.0)]
+    assert lag_behind(history, 3000.0, 50.0, 102.5) == 0.5
+    # Replayed past the second sample but not the third
+    assert lag_behind(history, 2500.0, 0.1, 102.5) == 1.5
+
+def test_disconnected_replicas_fall_behind_while_the_primary_writes():
+    # The receiver stopped at LSN 1000; everything it received is replayed
+    history = [(t, 1000.0 + 500 * (t - 100)) for t in (100.0, 101.0, 102.0, 110.0)]
+    assert lag_behind(history, 1000.0, 0.0, 110.0) == 10.0
+    assert lag_behind(history, 1000.0, 0.0, 110.0) > database.REPLICA_MAX_LAG
+
+def test_replicas_behind_every_sample():
+    history = [(100.0, 5000.0), (101.0, 6000.0)]
+    # Older than the history goes back: at least as far behind as the oldest sample
+    assert lag_behind(history, 1000.0, 0.5, 130.0) == 30.0
+    # The last replayed commit can tell it is further behind than that
+    assert lag_behind(history, 1000.0, 90.0, 130.0) == 90.0
+    assert lag_behind([], 1000.0, 3.0, 130.0) == 3.0
+
+def test_replicas_that_are_not_replaying_are_infinitely_behind():
+    assert lag_behind([(100.0, 1000.0)], None, None, 101.0) == INF
+    assert lag_behind([(100.0, 5000.0)], 1000.0, None, 101.0) == INF
+
+def test_other_threads_use_the_cached_lag_while_a_probe_runs(monkeypatch):
+    guard = ReplicaLagGuard([None], check_interval=0)
+    started, release = threading.Event(), threading.Event()
+    probes = []
+
+    def measure(index):
+        probes.append(index)
+        started.set()
+        release.wait(5)
+        return 0.25
+
+    monkeypatch.setattr(guard, "_measure", measure)
+    probe = threading.Thread(target=guard.lag, args=(0,))
+    probe.start()
+    assert started.wait(5)
+    # Not measured yet, so the replica isn't trusted, and nobody waits on the probe
+    assert guard.lag(0) == INF and not guard.healthy(0)
+    release.set()
+    probe.join(5)
+    assert probes == [0]
+    guard.check_interval = 60
+    assert guard.lag(0) == 0.25 and guard.healthy(0)
+
+def test_failed_probes_count_as_infinitely_behind(monkeypatch):
+    class Unreachable:
+        def connect(self):
+            raise OSError("connection refused")
+
+    guard = ReplicaLagGuard([Unreachable()], Unreachable())
+    assert guard.lag(0) == INF
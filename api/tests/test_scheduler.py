@@ -0,0 +1,130 @@
+"""Cron schedules, overlapping runs and leader takeover."""
+from datetime import datetime, timedelta, UTC
+import secrets
+import threading
+
+import pytest
+from sqlalchemy import select
+
+from scheduler import Cron, Job, Scheduler
+
+def _at(*args) -> datetime:
+    return datetime(*args, tzinfo=UTC)
+
+@pytest.mark.parametrize("expression, after, expected", [
+    ("*/15 * * * *", _at(2026, 3, 2, 9, 7, 30), _at(2026, 3, 2, 9, 15)),
+    ("*/15 * * * *", _at(2026, 3, 2, 9, 15), _at(2026, 3, 2, 9, 30)),  # strictly after
+    ("@hourly", _at(2026, 3, 2, 23, 59), _at(2026, 3, 3, 0, 0)),
+    ("5 3 * * *", _at(2026, 3, 2, 3, 6), _at(2026, 3, 3, 3, 5)),
+    ("0 9-17/4 * * *", _at(2026, 3, 2, 13, 0), _at(2026, 3, 2, 17, 0)),
+    ("0 0 1 1 *", _at(2026, 6, 15), _at(2027, 1, 1)),
+    ("0 0 29 2 *", _at(2026, 3, 1), _at(2028, 2, 29)),
+    ("0 0 * * 0", _at(2026, 3, 2), _at(2026, 3, 8)),  # 2026-03-08 is a Sunday
+    ("0 0 * * 7", _at(2026, 3, 2), _at(2026, 3, 8)),
+])
+def test_next_after(expression, after, expected):
+    assert Cron(expression).next_after(after) == expected
+
+def test_day_of_month_and_day_of_week_are_ored():
+    # The 13th, or any Friday; 2026-03-06 is a Friday
+    cron = Cron("0 0 13 * 5")
+    runs, t = [], _at(2026, 3, 1)
+    for _ in range(4):
+        t = cron.next_after(t)
+        runs.append(t.day)
+    assert runs == [6, 13, 20, 27]
+
+def test_one_restricted_day_field_is_anded_with_the_other():
+    assert Cron("0 0 13 * *").next_after(_at(2026, 3, 1)) == _at(2026, 3, 13)
+    assert Cron("0 0 * * 5").next_after(_at(2026, 3, 7)) == _at(2026, 3, 13)
+
+@pytest.mark.parametrize("expression", ["0 0 31 2 *", "60 * * * *", "* * *", "*/0 * * * *", "5-1 * * * *"])
+def test_invalid_expressions(expression):
+    with pytest.raises(ValueError):
+        Cron(expression)
+
+class FakeLock:
+    def __init__(self):
+        self.acquired = 0
+        self.released = 0
+
+    def acquire(self) -> bool:
+        self.acquired += 1
+        return True
+
+    def held(self) -> bool:
+        return True
+
+    def release(self) -> None:
+        self.released += 1
+
+@pytest.fixture
+def runner(schema):
+    runner = Scheduler({}, FakeLock(), threads=2)
+    yield runner
+    runner.pool.shutdown(wait=True, cancel_futures=True)
+
+def _job(fn, schedule: str = "* * * * *") -> Job:
+    return Job(f"test_{secrets.token_hex(4)}", schedule, fn, timeout=60.0, jitter=0.0, process=False)
+
+def _runs(job: Job) -> list[str]:
+    from database import SessionLocal
+    from models import JobRun
+
+    with SessionLocal() as db:
+        return db.scalars(select(JobRun.status).where(JobRun.job == job.name).order_by(JobRun.id)).all()
+
+def test_a_run_is_skipped_while_the_previous_one_is_going(runner, capsys):
+    release = threading.Event()
+    calls = []
+
+    def slow(db):
+        calls.append(1)
+        release.wait(10)
+
+    job = _job(slow)
+    runner.jobs = {job.name: job}
+    runner.next_run[job.name] = datetime.now(UTC) - timedelta(minutes=1)
+    runner._start_due()
+    runner.next_run[job.name] = datetime.now(UTC) - timedelta(minutes=1)
+    runner._start_due()
+    assert f"Skipping {job.name}" in capsys.readouterr().out
+    assert _runs(job) == ["running"]
+    assert runner.next_run[job.name] > datetime.now(UTC)
+
+    release.set()
+    runner.active[job.name].task.result(10)
+    runner._reap()
+    assert _runs(job) == ["ok"] and calls == [1]
+
+def test_takeover_abandons_open_runs_and_catches_up(runner):
+    from database import SessionLocal
+    from models import JobRun
+
+    job = _job(lambda db: None, "0 * * * *")
+    runner.jobs = {job.name: job}
+    with SessionLocal() as db:
+        # Left running by a leader that died two hours ago, so a run was missed since
+        db.add(JobRun(job=job.name, status="running", host="gone:1", started_at=datetime.now(UTC) - timedelta(hours=2)))
+        db.commit()
+    runner._check_leadership()
+    assert runner.leader and runner.lock.acquired == 1
+    assert _runs(job) == ["abandoned"]
+    # The missed run happens once, straight away
+    assert runner.next_run[job.name] <= datetime.now(UTC)
+
+def test_failed_takeover_releases_the_lock(runner, monkeypatch):
+    def fail():
+        raise RuntimeError("database went away")
+
+    monkeypatch.setattr(runner, "_take_over", fail)
+    with pytest.raises(RuntimeError):
+        runner._check_leadership()
+    assert not runner.leader
+    assert (runner.lock.acquired, runner.lock.released) == (1, 1)
+
+    # The next retry takes over
+    monkeypatch.undo()
+    runner._checked_at = 0.0
+    runner._check_leadership()
+    assert runner.leader and runner.lock.acquired == 2
@@ -0,0 +1,68 @@
+"""Autocomplete names counted across every shard by the scheduled job."""
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+import search
+from models import Base, Artist, Album, Track, Station, Play, PopularName
+
+@pytest.fixture
+def directory(tmp_path, monkeypatch):
+    """A directory database and two shards, each with a copy of the same catalog."""
+    import sharding
+
+    factories = []
+    for name in ("directory", "shard0", "shard1"):
+        engine = create_engine(f"sqlite:///{tmp_path / f'{name}.db'}")
+        Base.metadata.create_all(engine)
+        factory = sessionmaker(bind=engine)
+        with factory() as db:
+            artists = [Artist(name="Radiohead"), Artist(name="Rachmaninoff")]
+            station = Station(name="Radio Paradise")
+            db.add_all(artists + [station])
+            db.flush()
+            album = Album(title="In Rainbows", artist_id=artists[0].id)
+            db.add(album)
+            db.flush()
+            db.add_all([
+                Track(title="Reckoner", artist_id=artists[0].id, album_id=album.id),
+                Track(title="Rhapsody", artist_id=artists[1].id, album_id=album.id)
+            ])
+            db.commit()
+        factories.append(factory)
+    monkeypatch.setattr(sharding, "shard_sessions", factories[1:])
+    yield factories
+    for factory in factories:
+        factory.kw["bind"].dispose()
+
+def _play(factory, track_id: int, times: int) -> None:
+    with factory() as db:
+        db.add_all(Play(user_id=1, track_id=track_id, station_id=1) for _ in range(times))
+        db.commit()
+
+def test_counts_are_summed_across_shards(directory):
+    db_factory, shard0, shard1 = directory
+    _play(shard0, 1, 3)
+    _play(shard1, 1, 2)
+    _play(shard1, 2, 4)
+    with db_factory() as db:
+        assert search.refresh_popular(db) == 6
+        counts = {(row.kind, row.name): row.play_count for row in db.scalars(select(PopularName))}
+    assert counts == {
+        ("artist", "Radiohead"): 5, ("artist", "Rachmaninoff"): 4, ("album", "In Rainbows"): 9,
+        ("track", "Reckoner"): 5, ("track", "Rhapsody"): 4, ("station", "Radio Paradise"): 9
+    }
+
+    cache = search.PrefixCache(db_factory)
+    cache.load()
+    assert [(r['type'], r['name'], r['play_count']) for r in cache.lookup("rad")] == [
+        ("station", "Radio Paradise", 9), ("artist", "Radiohead", 5)
+    ]
+
+def test_each_refresh_replaces_the_last(directory):
+    db_factory, shard0, _ = directory
+    _play(shard0, 2, 1)
+    with db_factory() as db:
+        search.refresh_popular(db)
+        assert search.refresh_popular(db, per_kind=1) == 4
+        assert db.scalar(select(PopularName.name).where(PopularName.kind == "track")) == "Rhapsody"
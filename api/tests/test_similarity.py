@@ -0,0 +1,46 @@
+"""Pair counting in the incremental similarity refresh."""
+import numpy as np
+
+import similarity
+
+WINDOW = 60
+
+def _pairs(users, times, items, is_new) -> dict[tuple[int, int], int]:
+    users, times, items, is_new = map(np.asarray, (users, times, items, is_new))
+    order = np.lexsort((times, users))
+    a, b, counts = similarity.window_pairs(users[order], times[order], items[order], is_new[order], WINDOW)
+    return {(int(x), int(y)): int(n) for x, y, n in zip(a, b, counts)}
+
+def test_backfilled_play_pairs_with_later_old_play():
+    # Item 2 was counted in an earlier refresh; item 1 arrives afterwards but was played before it
+    assert _pairs([1, 1], [100, 130], [1, 2], [True, False]) == {(1, 2): 1}
+
+def test_old_pairs_are_not_counted_again():
+    pairs = _pairs([1, 1, 1], [100, 110, 120], [1, 2, 3], [False, True, False])
+    assert pairs == {(1, 2): 1, (2, 3): 1}
+
+def test_pairs_stay_inside_the_window_and_the_user():
+    pairs = _pairs([1, 1, 2], [100, 100 + WINDOW + 1, 110], [1, 2, 3], [True, False, False])
+    assert pairs == {}
+
+def test_incremental_refreshes_match_a_full_one():
+    rng = np.random.default_rng(7)
+    size = 400
+    users = rng.integers(1, 4, size)
+    times = rng.integers(0, 3000, size)
+    items = rng.integers(1, 30, size)
+    # Plays arrive in id order, which is not time order; split them into three refreshes
+    arrival = rng.permutation(size)
+    full = _pairs(users, times, items, np.ones(size, dtype=bool))
+
+    incremental: dict[tuple[int, int], int] = {}
+    for start, end in ((0, 150), (150, 300), (300, size)):
+        # A refresh loads the plays that arrived so far; those since the last refresh are new
+        loaded = np.zeros(size, dtype=bool)
+        loaded[arrival[:end]] = True
+        is_new = np.zeros(size, dtype=bool)
+        is_new[arrival[start:end]] = True
+        pairs = _pairs(users[loaded], times[loaded], items[loaded], is_new[loaded])
+        for pair, count in pairs.items():
+            incremental[pair] = incremental.get(pair, 0) + count
+    assert incremental == full
@@ -0,0 +1,190 @@
+"""Webhook URLs that must not be subscribed to or delivered to, and event ids."""
+import asyncio
+from datetime import datetime, UTC
+import socket
+
+import httpx
+import pytest
+from sqlalchemy import select
+
+import webhooks
+
+PUBLIC = "93.184.215.14"
+BLOCKED = [
+    "127.0.0.1",        # loopback
+    "10.1.2.3",         # private
+    "192.168.0.10",     # private
+    "100.64.0.1",       # carrier-grade NAT
+    "169.254.169.254",  # link-local: cloud metadata
+    "0.0.0.0",          # unspecified
+    "240.0.0.1",        # reserved
+    "224.0.0.1",        # multicast
+    "::1",
+    "fd00::1",          # unique local
+    "fe80::1%eth0",     # link-local with a zone
+    "::ffff:127.0.0.1"  # IPv4-mapped loopback
+]
+
+@pytest.fixture
+def dns(monkeypatch):
+    """Answers lookups of any name from ``dns[name]``, a list of addresses."""
+    answers: dict[str, list[str]] = {}
+
+    async def getaddrinfo(self, host, port, *, type=0, **kwargs):
+        if host not in answers:
+            raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+        return [
+            (socket.AF_INET6 if ":" in address else socket.AF_INET, socket.SOCK_STREAM, 6, "", (address, port))
+            for address in answers[host]
+        ]
+
+    monkeypatch.setattr(asyncio.BaseEventLoop, "getaddrinfo", getaddrinfo)
+    return answers
+
+def _resolve(url: str) -> str:
+    return asyncio.run(webhooks.resolve_destination(url))
+
+def test_public_https_host_resolves(dns):
+    dns["hooks.example.com"] = [PUBLIC]
+    assert _resolve("https://hooks.example.com/play") == PUBLIC
+
+@pytest.mark.parametrize("address", BLOCKED)
+def test_hosts_resolving_to_internal_addresses_are_refused(dns, address):
+    dns["hooks.example.com"] = [address]
+    with pytest.raises(webhooks.UnsafeDestination, match="private or reserved"):
+        _resolve("https://hooks.example.com/play")
+
+def test_one_internal_answer_among_public_ones_is_refused(dns):
+    dns["hooks.example.com"] = [PUBLIC, "10.0.0.5"]
+    with pytest.raises(webhooks.UnsafeDestination):
+        _resolve("https://hooks.example.com/play")
+
+@pytest.mark.parametrize("url", ["http://hooks.example.com/play", "ftp://hooks.example.com/", "https:///play"])
+def test_only_https_urls_are_accepted(dns, url):
+    dns["hooks.example.com"] = [PUBLIC]
+    with pytest.raises(webhooks.UnsafeDestination, match="https"):
+        _resolve(url)
+
+def test_unresolvable_hosts_are_refused(dns):
+    with pytest.raises(webhooks.UnsafeDestination, match="does not resolve"):
+        _resolve("https://nowhere.invalid/play")
+
+def _batch(url: str) -> dict:
+    return {'url': url, 'secret': "s3cret", 'events': [{'id': 1, 'type': "play.created"}], 'attempts': {1: 1}}
+
+def _deliver(batch: dict, handler) -> str | None:
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler), follow_redirects=False) as client:
+            return await webhooks.deliver(client, batch)
+    return asyncio.run(run())
+
+def test_delivery_connects_to_the_checked_address(dns):
+    dns["hooks.example.com"] = [PUBLIC]
+    sent = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        sent.append(request)
+        return httpx.Response(204)
+
+    assert _deliver(_batch("https://hooks.example.com:8443/play"), handler) is None
+    [request] = sent
+    assert (request.url.host, request.url.port, request.url.path) == (PUBLIC, 8443, "/play")
+    assert request.headers["Host"] == "hooks.example.com:8443"
+    assert request.extensions["sni_hostname"] == "hooks.example.com"
+
+def test_delivery_rechecks_a_host_that_now_resolves_inside(dns):
+    # Public when subscribed, then rebound to the metadata service
+    dns["hooks.example.com"] = [PUBLIC]
+    _resolve("https://hooks.example.com/play")
+    dns["hooks.example.com"] = ["169.254.169.254"]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        raise AssertionError("no request should be sent")
+
+    assert "private or reserved" in _deliver(_batch("https://hooks.example.com/play"), handler)
+
+def test_redirects_are_failed_deliveries(dns):
+    dns["hooks.example.com"] = [PUBLIC]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(307, headers={"Location": "http://169.254.169.254/latest/meta-data/"})
+
+    assert _deliver(_batch("https://hooks.example.com/play"), handler) == "HTTP 307"
+
+def test_subscribing_refuses_unsafe_urls(client, ingest_user):
+    _, api_key = ingest_user
+    headers = {"X-API-Key": api_key}
+    response = client.post("/webhooks", json={'url': "http://example.com/hook"}, headers=headers)
+    assert response.status_code == 422
+    for url in ("https://127.0.0.1/hook", "https://localhost:8443/hook", "https://[::1]/hook", "https://10.0.0.1/hook"):
+        response = client.post("/webhooks", json={'url': url}, headers=headers)
+        assert response.status_code == 400, url
+
+@pytest.fixture
+def two_shards(tmp_path):
+    """Two empty databases with the same schema, as (session factory, user id, subscription id) each."""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    import crud
+    from models import Base, WebhookSubscription
+
+    shards = []
+    for n in range(2):
+        engine = create_engine(f"sqlite:///{tmp_path / f'shard{n}.db'}")
+        Base.metadata.create_all(engine)
+        factory = sessionmaker(bind=engine)
+        with factory() as db:
+            user = crud.create_user(db, f"shard{n}@example.com", "password123")
+            subscription = WebhookSubscription(user_id=user.id, url="https://hooks.example.com/play")
+            db.add(subscription)
+            db.commit()
+            shards.append((factory, user.id, subscription.id))
+    yield shards
+    for factory, _, _ in shards:
+        factory.kw["bind"].dispose()
+
+def _record(factory, user_id: int, titles: list[str]) -> None:
+    """One play through ``add_play`` and the rest through ``add_plays``."""
+    import crud
+    from schemas import PlayCreate
+
+    plays = [PlayCreate(title=title, artist="Artist", album="Album", station="Station") for title in titles]
+    with factory() as db:
+        artist, _, track, station = crud.resolve_catalog(db, plays[0])
+        crud.add_play(db, plays[0], user_id, track.id, artist.id, station.id)
+        crud.add_plays(db, [
+            (user_id, play, track.id, artist.id, station.id, datetime.now(UTC)) for play in plays[1:]
+        ])
+        db.commit()
+
+def test_event_ids_are_unique_across_shards(two_shards):
+    from models import WebhookOutbox
+
+    events = {}
+    for factory, user_id, _ in two_shards:
+        _record(factory, user_id, ["One", "Two", "Three"])
+        with factory() as db:
+            [batch] = webhooks.claim_batches(db)
+            assert set(batch['attempts']) == {1, 2, 3}  # the same row ids on both shards
+            events[factory] = [event['id'] for event in batch['events']]
+            stored = db.scalars(select(WebhookOutbox.event_id).order_by(WebhookOutbox.id)).all()
+            assert events[factory] == stored
+    first, second = events.values()
+    assert len(set(first) | set(second)) == 6
+
+def test_event_ids_move_with_the_user(two_shards):
+    from models import WebhookOutbox
+    import sharding
+
+    (source, user_id, subscription_id), (target, _, target_subscription_id) = two_shards
+    _record(source, user_id, ["One", "Two"])
+    with source() as source_db, target() as target_db:
+        queued = source_db.scalars(select(WebhookOutbox.event_id).order_by(WebhookOutbox.id)).all()
+        sharding._move_outbox(source_db, target_db, {subscription_id: target_subscription_id})
+        source_db.commit()
+        moved = target_db.scalars(
+            select(WebhookOutbox.event_id)
+            .where(WebhookOutbox.subscription_id == target_subscription_id)
+            .order_by(WebhookOutbox.id)
+        ).all()
+    assert moved == queued
@@ -0,0 +1,336 @@
+"""Outbound webhooks for play events.
+
+Subscriptions are stored beside the user's plays (on their shard, or the one
+database). ``crud.add_play`` writes one ``webhook_outbox`` row per active
+subscription in the play's own transaction, so an event exists exactly when
+its play does and ingestion never waits on a receiver.
+
+The worker delivers the outbox:
+
+- rows are claimed with ``FOR UPDATE SKIP LOCKED``, so several workers can run;
+- a subscription's pending events go out together, up to
+  ``WEBHOOK_BATCH_SIZE`` per request, over one pooled HTTP client;
+- each body is signed with the subscription's secret (``X-Trackhaus-Signature``);
+- failed requests retry with exponential backoff, and after ``MAX_ATTEMPTS``
+  the events are marked ``dead`` until redelivered through the API.
+
+Receivers must be public https endpoints. A URL's host is resolved when it is
+subscribed and again before every delivery, and is refused if any address it
+resolves to is loopback, private, link-local or otherwise not globally
+routable. Deliveries connect to the address that was checked, so a DNS answer
+that changes between the check and the request cannot redirect them, and
+redirects are not followed.
+
+Delivery is at least once: receivers should dedupe on the event id, a UUID
+that is unique across shards and kept when a user's events move between them.
+
+    python webhooks.py work [--once]
+"""
+import argparse
+import asyncio
+from datetime import datetime, timedelta, UTC
+import hashlib
+import hmac
+import ipaddress
+import json
+import os
+import random
+import socket
+import time
+from typing import TYPE_CHECKING
+from urllib.parse import urlsplit
+import uuid
+
+from sqlalchemy import select, insert, update, delete, func, literal, JSON
+from sqlalchemy.orm import Session
+
+from models import Play, WebhookSubscription, WebhookOutbox
+from schemas import PlayCreate
+
+if TYPE_CHECKING:
+    import httpx
+
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "50"))  # events per request
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "50"))  # connections per worker
+WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", "10"))  # seconds per request
+
+SIGNATURE_HEADER = "X-Trackhaus-Signature"
+MAX_SUBSCRIPTIONS = 10  # per user
+MAX_ATTEMPTS = 12  # up to about a day of retries
+BASE_BACKOFF = timedelta(seconds=30)
+MAX_BACKOFF = timedelta(hours=6)
+STALE_AFTER = timedelta(minutes=5)  # sending rows older than this were abandoned by a dead worker
+DELIVERED_RETENTION = timedelta(days=7)
+
+class UnsafeDestination(ValueError):
+    """A webhook URL that deliveries must not be sent to."""
+
+def _is_public(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])  # drop an IPv6 zone
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+async def resolve_destination(url: str) -> str:
+    """The address to deliver ``url`` to, or UnsafeDestination if it is not a public https host."""
+    parts = urlsplit(url)
+    if parts.scheme != "https" or not parts.hostname:
+        raise UnsafeDestination("Webhook URLs must use https")
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(parts.hostname, parts.port or 443, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError):
+        raise UnsafeDestination(f"{parts.hostname} does not resolve")
+    addresses = [info[4][0] for info in infos]
+    # Every answer must be public, since a client may connect to any of them
+    if not addresses or not all(_is_public(address) for address in addresses):
+        raise UnsafeDestination(f"{parts.hostname} resolves to a private or reserved address")
+    return addresses[0]
+
+def _payload(play: Play, play_data: PlayCreate, artist_id: int) -> dict:
+    return {
+        'id': play.id,
+        'played_at': play.created_at.isoformat(),
+        'title': play_data.title,
+        'artist': play_data.artist,
+        'album': play_data.album,
+        'station': play_data.station,
+        'track_id': play.track_id,
+        'artist_id': artist_id,
+        'station_id': play.station_id,
+        'rating': play.rating.value,
+        'duration': play.duration
+    }
+
+def enqueue_play(db: Session, play: Play, play_data: PlayCreate, artist_id: int) -> None:
+    """Queue a play.created event for each of the user's active subscriptions. Caller commits.
+
+    Every subscription gets the event under the same id, unique across databases.
+    """
+    db.flush()  # assigns play.id
+    now = datetime.now(UTC)
+    # One statement whether or not the user has subscriptions
+    db.execute(
+        insert(WebhookOutbox).from_select(
+            ["event_id", "subscription_id", "event", "payload", "status", "attempts", "run_after", "created_at"],
+            select(
+                literal(str(uuid.uuid4())), WebhookSubscription.id, literal("play.created"), literal(_payload(play, play_data, artist_id), JSON),
+                literal("pending"), literal(0), literal(now), literal(now)
+            ).where(WebhookSubscription.user_id == play.user_id, WebhookSubscription.is_active)
+        )
+    )
+
+def enqueue_plays(db: Session, plays: list[tuple[Play, PlayCreate, int]]) -> None:
+    """Batch ``enqueue_play`` for flushed (play, play_data, artist_id) triples. Caller commits."""
+    subscriptions: dict[int, list[int]] = {}
+    for subscription_id, user_id in db.execute(
+        select(WebhookSubscription.id, WebhookSubscription.user_id)
+        .where(WebhookSubscription.user_id.in_({play.user_id for play, _, _ in plays}), WebhookSubscription.is_active)
+    ):
+        subscriptions.setdefault(user_id, []).append(subscription_id)
+    if not subscriptions:
+        return
+    now = datetime.now(UTC)
+    event_ids = [str(uuid.uuid4()) for _ in plays]
+    db.execute(insert(WebhookOutbox), [
+        {
+            'event_id': event_id,
+            'subscription_id': subscription_id,
+            'event': "play.created",
+            'payload': _payload(play, play_data, artist_id),
+            'status': "pending",
+            'attempts': 0,
+            'run_after': now,
+            'created_at': now
+        }
+        for event_id, (play, play_data, artist_id) in zip(event_ids, plays)
+        for subscription_id in subscriptions.get(play.user_id, [])
+    ])
+
+def sign(secret: str, timestamp: str, body: bytes) -> str:
+    """Signature header value: HMAC-SHA256 of "<timestamp>.<body>"."""
+    digest = hmac.new(secret.encode(), timestamp.encode() + b"." + body, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+def backoff(attempts: int) -> timedelta:
+    """Delay before the next try, doubling per attempt with jitter so failed batches spread out."""
+    delay = min(BASE_BACKOFF * 2 ** (attempts - 1), MAX_BACKOFF)
+    return delay * random.uniform(0.5, 1.0)
+
+def count_subscriptions(db: Session, user_id: int) -> int:
+    return db.scalar(select(func.count()).select_from(WebhookSubscription).where(WebhookSubscription.user_id == user_id))
+
+def get_subscriptions(db: Session, user_id: int) -> list[WebhookSubscription]:
+    return db.scalars(
+        select(WebhookSubscription).where(WebhookSubscription.user_id == user_id).order_by(WebhookSubscription.id)
+    ).all()
+
+def get_subscription(db: Session, user_id: int, subscription_id: int) -> WebhookSubscription | None:
+    return db.scalar(
+        select(WebhookSubscription)
+        .where(WebhookSubscription.id == subscription_id, WebhookSubscription.user_id == user_id)
+    )
+
+def get_deliveries(db: Session, subscription_id: int, status: str | None = None, limit: int = 50) -> list[WebhookOutbox]:
+    """Most recent events for a subscription, optionally only those in one status."""
+    query = select(WebhookOutbox).where(WebhookOutbox.subscription_id == subscription_id)
+    if status:
+        query = query.where(WebhookOutbox.status == status)
+    return db.scalars(query.order_by(WebhookOutbox.id.desc()).limit(limit)).all()
+
+def redeliver(db: Session, subscription_id: int) -> int:
+    """Queue a subscription's dead events again. Returns events requeued."""
+    result = db.execute(
+        update(WebhookOutbox)
+        .where(WebhookOutbox.subscription_id == subscription_id, WebhookOutbox.status == "dead")
+        .values(status="pending", attempts=0, run_after=datetime.now(UTC))
+    )
+    db.commit()
+    return result.rowcount
+
+def claim_batches(db: Session, limit: int = 500) -> list[dict]:
+    """Claim pending events and group them into per-subscription request batches."""
+    now = datetime.now(UTC)
+    db.execute(
+        update(WebhookOutbox)
+        .where(WebhookOutbox.status == "sending", WebhookOutbox.locked_at < now - STALE_AFTER)
+        .values(status="pending")
+    )
+    rows = db.execute(
+        select(WebhookOutbox, WebhookSubscription.url, WebhookSubscription.secret)
+        .join(WebhookSubscription, WebhookSubscription.id == WebhookOutbox.subscription_id)
+        .where(WebhookOutbox.status == "pending", WebhookOutbox.run_after <= now, WebhookSubscription.is_active)
+        .order_by(WebhookOutbox.id)
+        .limit(limit)
+        .with_for_update(of=WebhookOutbox, skip_locked=True)
+    ).all()
+
+    batches: dict[int, list[dict]] = {}
+    for event, url, secret in rows:
+        event.status = "sending"
+        event.locked_at = now
+        event.attempts += 1
+        chunks = batches.setdefault(event.subscription_id, [])
+        if not chunks or len(chunks[-1]['events']) >= WEBHOOK_BATCH_SIZE:
+            chunks.append({'url': url, 'secret': secret, 'events': [], 'attempts': {}})
+        chunks[-1]['events'].append({
+            'id': event.event_id,
+            'type': event.event,
+            'created_at': event.created_at.isoformat(),
+            'data': event.payload
+        })
+        chunks[-1]['attempts'][event.id] = event.attempts
+    db.commit()
+    return [chunk for chunks in batches.values() for chunk in chunks]
+
+def finish_batches(db: Session, results: list[tuple[dict, str | None]]) -> None:
+    """Mark delivered events, and schedule a retry (or give up) on the rest."""
+    now = datetime.now(UTC)
+    for batch, error in results:
+        if error is None:
+            db.execute(
+                update(WebhookOutbox)
+                .where(WebhookOutbox.id.in_(batch['attempts']))
+                .values(status="delivered", delivered_at=now, last_error=None)
+            )
+            continue
+        for event_id, attempts in batch['attempts'].items():
+            db.execute(
+                update(WebhookOutbox).where(WebhookOutbox.id == event_id).values(
+                    status="dead" if attempts >= MAX_ATTEMPTS else "pending",
+                    run_after=now + backoff(attempts),
+                    last_error=error[:500]
+                )
+            )
+    db.commit()
+
+def prune_delivered(db: Session) -> int:
+    """Delete delivered events past their retention. Returns rows deleted."""
+    result = db.execute(
+        delete(WebhookOutbox)
+        .where(WebhookOutbox.status == "delivered", WebhookOutbox.delivered_at < datetime.now(UTC) - DELIVERED_RETENTION)
+    )
+    db.commit()
+    return result.rowcount
+
+async def deliver(client: "httpx.AsyncClient", batch: dict) -> str | None:
+    """POST one batch. Returns None on a 2xx response, else the error to record."""
+    import httpx
+
+    try:
+        address = await resolve_destination(batch['url'])
+    except UnsafeDestination as e:
+        return str(e)
+    url = httpx.URL(batch['url'])
+    body = json.dumps({'events': batch['events']}, separators=(",", ":")).encode()
+    timestamp = str(int(time.time()))
+    try:
+        # Connect to the checked address; Host and SNI keep the name, so the certificate is still verified against it
+        response = await client.post(url.copy_with(host=address), content=body, headers={
+            "Host": url.netloc.decode("ascii"),
+            "Content-Type": "application/json",
+            SIGNATURE_HEADER: sign(batch['secret'], timestamp, body)
+        }, extensions={"sni_hostname": url.host})
+    except httpx.HTTPError as e:
+        return f"{type(e).__name__}: {e}"
+    if not response.is_success:
+        return f"HTTP {response.status_code}"
+    return None
+
+def _in_session(session_factory, fn, *args):
+    db = session_factory()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+async def run_worker(session_factories: list, batch_size: int = 500, idle_sleep: float = 2.0, once: bool = False) -> None:
+    """Deliver outbox events from every database until stopped (or, with once, until all are empty)."""
+    # Only the worker sends requests; the API imports this module without httpx
+    import httpx
+
+    client = httpx.AsyncClient(
+        # Requests wait for a free connection rather than failing on the pool
+        timeout=httpx.Timeout(WEBHOOK_TIMEOUT, pool=None),
+        limits=httpx.Limits(max_connections=WEBHOOK_CONCURRENCY, max_keepalive_connections=WEBHOOK_CONCURRENCY),
+        headers={"User-Agent": "track.haus-webhooks/0.1"},
+        # A redirect could point anywhere, including back inside the network; a 3xx is a failed delivery
+        follow_redirects=False
+    )
+
+    async def drain(session_factory) -> int:
+        batches = await asyncio.to_thread(_in_session, session_factory, claim_batches, batch_size)
+        if not batches:
+            return 0
+        errors = await asyncio.gather(*(deliver(client, batch) for batch in batches))
+        await asyncio.to_thread(_in_session, session_factory, finish_batches, list(zip(batches, errors)))
+        delivered = sum(len(batch['events']) for batch, error in zip(batches, errors) if error is None)
+        total = sum(len(batch['events']) for batch in batches)
+        print(f"Delivered {delivered} of {total} webhook events in {len(batches)} requests")
+        return total
+
+    last_prune = 0.0
+    try:
+        while True:
+            claimed = sum(await asyncio.gather(*(drain(factory) for factory in session_factories)))
+            if time.monotonic() - last_prune > 3600:
+                for factory in session_factories:
+                    await asyncio.to_thread(_in_session, factory, prune_delivered)
+                last_prune = time.monotonic()
+            if not claimed:
+                if once:
+                    return
+                await asyncio.sleep(idle_sleep)
+    finally:
+        await client.aclose()
+
+if __name__ == "__main__":
+    from database import SessionLocal
+    import sharding
+
+    parser = argparse.ArgumentParser(description="Webhook delivery worker")
+    parser.add_argument("command", choices=["work"])
+    parser.add_argument("--batch-size", type=int, default=500, help="events claimed per database per round")
+    parser.add_argument("--once", action="store_true", help="exit when the outbox is empty")
+    args = parser.parse_args()
+
+    asyncio.run(run_worker(sharding.shard_sessions or [SessionLocal], args.batch_size, once=args.once))
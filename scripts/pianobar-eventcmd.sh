@@ -68,7 +68,7 @@ if [ "$1" == "songfinish" ]; then
     http_body=$(echo "$response" | head -n 1)
     http_code=$(echo "$response" | tail -n 1)
 
-    if [ "$http_code" -eq 200 ]; then
+    if [ "$http_code" -eq 200 ] || [ "$http_code" -eq 202 ]; then  # 202: queued by a write-behind server
         log "Successfully recorded play: $artist - $title"
     else
         log "Error recording play: $http_body (HTTP $http_code)"